@@ -3,6 +3,7 @@
 #include <time.h>
 #include <math.h>
 #include <string.h>
+#include <stdlib.h>
 #include "rapl.h"
 #include <sys/time.h>
 
@@ -27,12 +28,20 @@ int main (int argc, char **argv)
   strcat(command,argv[1]);
   //Language name
   strcpy(language,argv[2]);
-  //Path to language .csv file
-  strcpy(path, "/home/hpeng/E2COOL/src/runtime_logs/");
-  strcat(language,".csv");
-  strcat(path,language);
+  //Path to language .csv file, an optional 4th argument overrides it
+  if (argc > 4)
+    strcpy(path,argv[4]);
+  else
+    {
+      strcpy(path, "/home/hpeng/E2COOL/src/runtime_logs/");
+      strcat(language,".csv");
+      strcat(path,language);
+    }
   //Test name
   strcpy(test,argv[3]);
+  //Core whose MSRs are read, an optional 5th argument, the package of the core the command is pinned to
+  if (argc > 5)
+    core = atoi(argv[5]);
  
 
   fp = fopen(path,"a");
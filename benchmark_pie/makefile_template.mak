@@ -1,4 +1,6 @@
 # include ../../.env
+RAPL_LOG ?= ${USER_PREFIX}/src/runtime_logs/c++.csv
+RAPL_CORE ?= 0
 
 compile:
 	/usr/bin/g++ -c -pipe -fomit-frame-pointer -march=native  -std=c++11 -fopenmp ${FILE_NAME}.cpp -o ${FILE_NAME}.cpp.o &&  /usr/bin/g++ ${FILE_NAME}.cpp.o -o ${FILE_NAME}.gpp_run -fopenmp 
@@ -8,13 +10,13 @@ compile_optimized:
 
 measure:
 	sudo modprobe msr
-	sudo ${USER_PREFIX}/RAPL/main "${USER_PREFIX}/benchmark_pie/$(problem_id)/${FILE_NAME}.gpp_run < $(input)" c++ $(problem_id)
-	sudo chmod -R 777 ${USER_PREFIX}/src/runtime_logs/c++.csv
+	sudo ${USER_PREFIX}/RAPL/main "$(CURDIR)/${FILE_NAME}.gpp_run < $(input)" c++ $(problem_id) $(RAPL_LOG) $(RAPL_CORE)
+	-sudo chmod -R 777 $(RAPL_LOG)
 
 measure_optimized:
 	sudo modprobe msr
-	sudo ${USER_PREFIX}/RAPL/main "${USER_PREFIX}/benchmark_pie/$(problem_id)/optimized_${FILE_NAME}.gpp_run < $(input)" c++ $(problem_id)
-	sudo chmod -R 777 ${USER_PREFIX}/src/runtime_logs/c++.csv
+	sudo ${USER_PREFIX}/RAPL/main "$(CURDIR)/optimized_${FILE_NAME}.gpp_run < $(input)" c++ $(problem_id) $(RAPL_LOG) $(RAPL_CORE)
+	-sudo chmod -R 777 $(RAPL_LOG)
 
 run:
 	./${FILE_NAME}.gpp_run
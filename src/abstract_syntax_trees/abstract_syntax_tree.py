@@ -10,8 +10,8 @@ class AbstractSyntaxTree:
         pass
 
     @abstractmethod
-    def parse_ast(self):
+    def parse_ast(self, source_code_path):
         """
-        Implement later based on how we decide to use the AST.
+        Structured summary of the source code, see CPPAST.parse_ast.
         """
         pass
\ No newline at end of file
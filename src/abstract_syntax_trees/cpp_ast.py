@@ -1,35 +1,280 @@
 from abstract_syntax_trees.abstract_syntax_tree import AbstractSyntaxTree
-import subprocess
+import hashlib
+import json
+import os
 import re
+import subprocess
+import tempfile
+
+try:
+    from clang import cindex
+except ImportError:
+    cindex = None
+
+LOOP_KINDS = {"FOR_STMT": "for", "CXX_FOR_RANGE_STMT": "range-for", "WHILE_STMT": "while", "DO_STMT": "do-while"}
+FUNCTION_KINDS = {"FUNCTION_DECL", "CXX_METHOD", "CONSTRUCTOR", "DESTRUCTOR", "FUNCTION_TEMPLATE"}
+RECORD_KINDS = {"STRUCT_DECL", "CLASS_DECL", "CLASS_TEMPLATE", "NAMESPACE"}
+VARIABLE_KINDS = {"VAR_DECL", "FIELD_DECL", "PARM_DECL"}
+ALLOCATION_CALLS = {"malloc", "calloc", "realloc", "strdup", "make_unique", "make_shared"}
+# The JSON dump uses clang's own node names for the same kinds
+JSON_KINDS = {
+    "FunctionDecl": "FUNCTION_DECL", "CXXMethodDecl": "CXX_METHOD", "CXXConstructorDecl": "CONSTRUCTOR",
+    "CXXDestructorDecl": "DESTRUCTOR", "FunctionTemplateDecl": "FUNCTION_TEMPLATE",
+    "CXXRecordDecl": "STRUCT_DECL", "ClassTemplateDecl": "CLASS_TEMPLATE", "NamespaceDecl": "NAMESPACE",
+    "ForStmt": "FOR_STMT", "CXXForRangeStmt": "CXX_FOR_RANGE_STMT", "WhileStmt": "WHILE_STMT", "DoStmt": "DO_STMT",
+    "VarDecl": "VAR_DECL", "FieldDecl": "FIELD_DECL", "ParmVarDecl": "PARM_DECL",
+    "CXXNewExpr": "CXX_NEW_EXPR", "CallExpr": "CALL_EXPR", "CXXMemberCallExpr": "CALL_EXPR",
+    "CXXOperatorCallExpr": "CALL_EXPR"
+}
+CONTAINER_TYPE = re.compile(r"\b(?:std::)?(vector|map|unordered_map|multimap|set|unordered_set|multiset|deque|list|forward_list|queue|priority_queue|stack|array|bitset|string)\b")
+
+# Summaries already computed in this process, keyed on the source hash
+_summary_cache = {}
+
+class _SummaryBuilder:
+    """Collects functions, loops, allocation sites, container types and the call graph of one source file."""
+    def __init__(self):
+        self.functions = []
+        self.containers = set()
+        self.calls = {}
+
+    def function(self, name, line):
+        entry = {"name": name, "line": line, "loops": [], "max_loop_depth": 0, "allocations": [], "calls": []}
+        self.functions.append(entry)
+        return entry
+
+    def loop(self, function, kind, line, depth):
+        function["loops"].append({"kind": kind, "line": line, "depth": depth})
+        function["max_loop_depth"] = max(function["max_loop_depth"], depth)
+
+    def allocation(self, function, kind, line, depth):
+        function["allocations"].append({"kind": kind, "line": line, "loop_depth": depth})
+
+    def call(self, function, name):
+        if name and name not in function["calls"]:
+            function["calls"].append(name)
+
+    def variable(self, type_spelling):
+        if CONTAINER_TYPE.search(type_spelling):
+            type_spelling = re.sub(r"^const |\s*[&*]+$", "", re.sub(r"\s+", " ", type_spelling))
+            self.containers.add(type_spelling.replace("std::__cxx11::", "std::"))
+
+    def build(self):
+        defined = {function["name"] for function in self.functions}
+        call_graph = {}
+        for function in self.functions:
+            callees = [name for name in function["calls"] if name in defined]
+            if callees:
+                call_graph[function["name"]] = callees
+        return {"functions": self.functions, "containers": sorted(self.containers), "call_graph": call_graph}
 
 class CPPAST(AbstractSyntaxTree):
-    def __init__(self, language):
+    """
+    Compact structural summary of a C++ source file for the generator prompt, built with the
+    libclang Python bindings, or from `clang++ -ast-dump=json` when they are not installed.
+    Summaries are cached per source hash, in memory and in cache_dir when one is given.
+    """
+    def __init__(self, language, cache_dir=None):
         super().__init__(language)
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
 
     def create_ast(self, source_code_path) -> str:
-        command = f"clang++ -Xclang -ast-dump -fsyntax-only {source_code_path} | grep -A 1000 {source_code_path}"
-        ast = subprocess.run(command, shell=True, capture_output=True, text=True)
-        ast = ast.stdout
-        print(ast)
-        return self.clean_ast(ast)
-    
-    def clean_ast(self, ast_text):
-        # Remove memory addresses (0x followed by hex digits)
-        ast_text = re.sub(r'0x[0-9a-fA-F]+', '', ast_text)
-        
-        # Remove file path and location info inside <>
-        ast_text = re.sub(r'<[^>]+>', '', ast_text)
-        
-        # Remove line and column markers (e.g., line:4:5, col:19)
-        ast_text = re.sub(r'\b(line|col):\d+(:\d+)?', '', ast_text)
-
-        # Remove excessive spaces from cleaned lines while keeping line breaks
-        ast_text = '\n'.join(line.strip() for line in ast_text.splitlines())
-        
-        return ast_text   
-    
-    def parse_ast(self):
-        """
-        Implement later based on how we decide to use the AST.
-        """
-        pass
\ No newline at end of file
+        return self.format_summary(self.parse_ast(source_code_path))
+
+    def parse_ast(self, source_code_path):
+        with open(source_code_path, "r") as file:
+            source_code = file.read()
+        key = hashlib.sha256(source_code.encode("utf-8")).hexdigest()
+        summary = _summary_cache.get(key)
+        if summary is None:
+            summary = self._load_cached(key)
+        if summary is None:
+            if cindex is not None:
+                summary = self._summarize_libclang(source_code_path)
+            else:
+                summary = self._summarize_json_dump(source_code_path)
+            self._store_cached(key, summary)
+        _summary_cache[key] = summary
+        return summary
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_cached(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(key), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _store_cached(self, key, summary):
+        if self.cache_dir is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(summary, file)
+        os.replace(tmp_path, self._cache_path(key))
+
+    def _compiler_args(self):
+        args = ["-x", "c++", "-std=c++17"]
+        # The libclang wheel ships without clang's builtin headers (stddef.h, float.h), use gcc's
+        try:
+            include_dir = subprocess.run(["g++", "-print-file-name=include"], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            include_dir = ""
+        if os.path.isdir(include_dir):
+            args += ["-isystem", include_dir]
+        return args
+
+    def _summarize_libclang(self, source_code_path):
+        translation_unit = cindex.Index.create().parse(source_code_path, args=self._compiler_args())
+        source_file = os.path.realpath(source_code_path)
+        builder = _SummaryBuilder()
+
+        def in_source(cursor):
+            return cursor.location.file is not None and os.path.realpath(cursor.location.file.name) == source_file
+
+        def qualified_name(cursor):
+            names = [cursor.spelling]
+            parent = cursor.semantic_parent
+            while parent is not None and parent.kind.name in RECORD_KINDS:
+                names.insert(0, parent.spelling)
+                parent = parent.semantic_parent
+            return "::".join(names)
+
+        def walk_body(cursor, function, depth):
+            for child in cursor.get_children():
+                kind = child.kind.name
+                child_depth = depth
+                if kind in LOOP_KINDS:
+                    child_depth = depth + 1
+                    builder.loop(function, LOOP_KINDS[kind], child.location.line, child_depth)
+                elif kind == "CXX_NEW_EXPR":
+                    builder.allocation(function, "new", child.location.line, depth)
+                elif kind == "CALL_EXPR":
+                    referenced = child.referenced
+                    if child.spelling in ALLOCATION_CALLS:
+                        builder.allocation(function, child.spelling, child.location.line, depth)
+                    if referenced is not None and referenced.kind.name in FUNCTION_KINDS and in_source(referenced):
+                        builder.call(function, qualified_name(referenced))
+                elif kind in VARIABLE_KINDS:
+                    builder.variable(child.type.spelling)
+                walk_body(child, function, child_depth)
+
+        def walk(cursor):
+            for child in cursor.get_children():
+                if not in_source(child):
+                    continue
+                kind = child.kind.name
+                if kind in FUNCTION_KINDS and child.is_definition():
+                    walk_body(child, builder.function(qualified_name(child), child.location.line), 0)
+                elif kind in RECORD_KINDS:
+                    walk(child)
+                elif kind in VARIABLE_KINDS:
+                    builder.variable(child.type.spelling)
+
+        walk(translation_unit.cursor)
+        return builder.build()
+
+    def _summarize_json_dump(self, source_code_path):
+        command = ["clang++", "-Xclang", "-ast-dump=json", "-fsyntax-only", "-std=c++17", source_code_path]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if not result.stdout:
+            return _SummaryBuilder().build()
+        root = json.loads(result.stdout)
+        source_file = os.path.realpath(source_code_path)
+        builder = _SummaryBuilder()
+        # The dump only repeats file and line when they change, track them in dump order
+        position = {"file": None, "line": None}
+
+        def track(location):
+            if not location:
+                return
+            if "expansionLoc" in location:
+                track(location.get("spellingLoc"))
+                track(location["expansionLoc"])
+                return
+            if "file" in location:
+                position["file"] = os.path.realpath(location["file"])
+            if "line" in location:
+                position["line"] = location["line"]
+
+        def visit(node):
+            # Returns (in source, line) of the node and moves the tracked position past its range
+            track(node.get("loc"))
+            in_source, line = position["file"] == source_file, position["line"]
+            track(node.get("range", {}).get("begin"))
+            track(node.get("range", {}).get("end"))
+            return in_source, line
+
+        def callee_name(node):
+            for child in node.get("inner", []):
+                referenced = child.get("referencedDecl") or child.get("referencedMemberDecl")
+                if isinstance(referenced, dict) and referenced.get("name"):
+                    return referenced["name"]
+                if child.get("kind") == "MemberExpr" and child.get("name"):
+                    return child["name"]
+                name = callee_name(child)
+                if name:
+                    return name
+            return None
+
+        def walk_body(node, function, depth):
+            for child in node.get("inner", []):
+                _, line = visit(child)
+                kind = JSON_KINDS.get(child.get("kind"))
+                child_depth = depth
+                if kind in LOOP_KINDS:
+                    child_depth = depth + 1
+                    builder.loop(function, LOOP_KINDS[kind], line, child_depth)
+                elif kind == "CXX_NEW_EXPR":
+                    builder.allocation(function, "new", line, depth)
+                elif kind == "CALL_EXPR":
+                    name = callee_name(child)
+                    if name in ALLOCATION_CALLS:
+                        builder.allocation(function, name, line, depth)
+                    builder.call(function, name)
+                elif kind in VARIABLE_KINDS:
+                    builder.variable(child.get("type", {}).get("qualType", ""))
+                walk_body(child, function, child_depth)
+
+        def walk(node, scope):
+            for child in node.get("inner", []):
+                in_source, line = visit(child)
+                kind = JSON_KINDS.get(child.get("kind"))
+                if not in_source or child.get("isImplicit"):
+                    # Keep the tracked position in sync without collecting anything
+                    walk_body(child, {"loops": [], "max_loop_depth": 0, "allocations": [], "calls": []}, 0)
+                    continue
+                name = "::".join(scope + [child.get("name", "")])
+                if kind in FUNCTION_KINDS and any(inner.get("kind") == "CompoundStmt" for inner in child.get("inner", [])):
+                    walk_body(child, builder.function(name, line), 0)
+                elif kind in RECORD_KINDS:
+                    walk(child, scope + [child.get("name", "")])
+                elif kind in VARIABLE_KINDS:
+                    builder.variable(child.get("type", {}).get("qualType", ""))
+                    walk_body(child, {"loops": [], "max_loop_depth": 0, "allocations": [], "calls": []}, 0)
+                else:
+                    walk(child, scope)
+
+        walk(root, [])
+        return builder.build()
+
+    def format_summary(self, summary):
+        lines = []
+        for function in summary["functions"]:
+            lines.append(f"function {function['name']} (line {function['line']}), max loop depth {function['max_loop_depth']}")
+            if function["loops"]:
+                lines.append("  loops: " + ", ".join(f"{loop['kind']}@{loop['line']} depth {loop['depth']}" for loop in function["loops"]))
+            if function["allocations"]:
+                lines.append("  allocations: " + ", ".join(f"{allocation['kind']}@{allocation['line']} loop depth {allocation['loop_depth']}" for allocation in function["allocations"]))
+            callees = summary["call_graph"].get(function["name"])
+            if callees:
+                lines.append("  calls: " + ", ".join(callees))
+        if summary["containers"]:
+            lines.append("containers: " + ", ".join(summary["containers"]))
+        return "\n".join(lines)
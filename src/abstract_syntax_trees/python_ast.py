@@ -13,7 +13,7 @@ class PythonAST(AbstractSyntaxTree):
 
         return ast.dump(parsed_ast, indent=4)
         
-    def parse_ast(self):
+    def parse_ast(self, source_code_path):
         """
         Implement later based on how we decide to use the AST.
         """
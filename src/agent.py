@@ -1,23 +1,56 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import contextlib
+import copy
 import time
+import types
 import subprocess
+import weakref
 from utils import Logger
 import sys
-from ollama import Client
+from ollama import Client, AsyncClient
 from pydantic import BaseModel
+from memory_policy import count_memory_tokens
+from llm_client import RetryPolicy, LLMRequestError, call_with_retries, async_call_with_retries
+from llm_stream import StreamCollector
+from batch_llm import get_batch_coordinator
 
 logger = Logger("logs", sys.argv[2]).logger
 
+# Served through the OpenAI API, every other model is pulled and run through ollama
+OPENAI_MODELS = ["gpt-4o", "o1", "o3-mini"]
+
+# Requests in flight over the AsyncLLMAgents of an event loop that were not given their own semaphore
+MAX_CONCURRENCY = 8
+_request_semaphores = weakref.WeakKeyDictionary()
+
+def get_request_semaphore():
+    """Semaphore shared by the AsyncLLMAgents of the running event loop, an asyncio.Semaphore is bound to one loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _request_semaphores:
+        _request_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _request_semaphores[loop]
+
 class LLMAgent:
-    def __init__(self, api_key, model, system_message="You are a helpful assistant."):
+    def __init__(self, api_key, model, system_message="You are a helpful assistant.", response_cache=None, retry_policy=None):
         if not model:
             raise ValueError("A model must be specified when creating a LLM Agent.")
         self.model = model
         self.system_message=system_message
         self.memory = [{"role": "system", "content": system_message}]
+        self.request_limiter = contextlib.nullcontext()
+        self.response_cache = response_cache
+        self.memory_policy = None
+        self.prompt_budget = None
+        self.token_usage = []
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.streaming = False
 
-        if self.is_openai_model():
-            self.client = OpenAI(api_key=api_key)
+        if response_cache is not None and response_cache.replay:
+            # Replayed runs are served from the cache only, they need no credentials and no pulled model
+            self.client = None
+        elif self.is_openai_model():
+            self.client = self._create_client(api_key)
         else:
             try:
                 subprocess.run(["ollama", "pull", model], check=True)
@@ -25,29 +58,154 @@ class LLMAgent:
                 logger.error(f"Error pulling model from ollama: {e}")
                 sys.exit(1)
             else:
-                self.client = Client(host="http://localhost:11434")
+                self.client = self._create_client(api_key)
+
+    def _create_client(self, api_key):
+        """Client of the model's API, AsyncLLMAgent overrides it with the asyncio clients."""
+        if self.is_openai_model():
+            # Retries are done by llm_client, the OpenAI client must not retry on its own
+            return OpenAI(api_key=api_key, timeout=self.retry_policy.timeout, max_retries=0)
+        return Client(host="http://localhost:11434", timeout=self.retry_policy.timeout)
     
     def add_to_memory(self, role, content):
         self.memory.append({"role": role, "content": content})
     
-    def generate_response(self, response_format=BaseModel):
+    def set_request_limiter(self, request_limiter):
+        # Shared semaphore capping in-flight LLM requests across scheduler workers
+        self.request_limiter = request_limiter
+
+    def set_memory_policy(self, memory_policy):
+        """memory_policy.MemoryPolicy applied to the conversation before every request."""
+        self.memory_policy = memory_policy
+
+    def set_prompt_budget(self, prompt_budget):
+        """prompt_budget.PromptBudget used by the generator and evaluator prompts of this agent."""
+        self.prompt_budget = prompt_budget
+
+    def set_streaming(self, streaming):
+        """Stream replies, fields of the JSON reply are passed to generate_response's on_field as soon as they are complete."""
+        self.streaming = streaming
+
+    def get_token_usage(self):
+        return self.token_usage
+
+    def _prepare_memory(self):
+        if self.memory_policy is not None:
+            self.memory = self.memory_policy.apply(self.memory)
+        estimated_tokens = count_memory_tokens(self.memory)
+        logger.info(f"LLM request: ~{estimated_tokens} prompt tokens in {len(self.memory)} messages")
+        return estimated_tokens
+
+    def _record_usage(self, estimated_tokens, response, collector=None):
+        # OpenAI reports usage, ollama reports eval counts
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens, completion_tokens = getattr(response, "prompt_eval_count", None), getattr(response, "eval_count", None)
+        entry = {"estimated_prompt_tokens": estimated_tokens, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        logger.info(f"LLM usage: {prompt_tokens} prompt tokens, {completion_tokens} completion tokens")
+        if collector is not None:
+            entry.update(collector.metrics(completion_tokens))
+            if entry["time_to_first_token"] is not None and entry["tokens_per_second"] is not None:
+                logger.info(f"LLM stream: {entry['time_to_first_token']:.2f}s to first token, {entry['tokens_per_second']:.1f} tokens/s")
+        self.token_usage.append(entry)
+
+    def _lookup_cache(self, response_format):
+        """Returns (cache_key, cached_content), both None when caching is disabled."""
+        if self.response_cache is None:
+            return None, None
+        cache_key = self.response_cache.make_key(self.model, self.memory, response_format)
+        return cache_key, self.response_cache.get(cache_key)
+
+    def generate_response(self, response_format=BaseModel, on_field=None):
+        """
+        Appends the reply to memory, returns 1 on success and -1 on failure.
+        With streaming on, on_field(key, value) is called for every top-level field of the
+        JSON reply as soon as it is complete.
+        """
+        estimated_tokens = self._prepare_memory()
+        cache_key, content = self._lookup_cache(response_format)
+        if content is not None:
+            self.add_to_memory("assistant", content)
+            return 1
+        if self.response_cache is not None and self.response_cache.replay:
+            logger.error("Replay mode: no cached response for this request")
+            return -1
+
+        if get_batch_coordinator() is not None:
+            return self._generate_batched(response_format, estimated_tokens, cache_key)
+
+        # One collector per attempt, a retried stream starts over
+        collectors = []
+        def request():
+            if not self.streaming:
+                return self._request(response_format)
+            collectors.append(StreamCollector(on_field))
+            return self._request_stream(response_format, collectors[-1])
+
         try:
-            if (self.is_openai_model()):
-                response = self.client.beta.chat.completions.parse(
-                    model = self.model,
-                     messages = self.memory,
-                    response_format=response_format
-                )
-                content = response.choices[0].message.content
-            else:
-                response = self.client.chat(model=self.model, messages=self.memory, format=response_format.model_json_schema())
-                content = response.message.content
-        except Exception as e:
+            response, content = call_with_retries(request, self.retry_policy, estimated_tokens)
+        except LLMRequestError as e:
             logger.error(f"Error when generating response: {e}")
             return -1
+        self._record_usage(estimated_tokens, response, collectors[-1] if collectors else None)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, self.model, content)
         self.add_to_memory("assistant", content)
         return 1
     
+    def _generate_batched(self, response_format, estimated_tokens, cache_key):
+        """Waits for this request's result in the next batch round, see batch_llm.BatchCoordinator."""
+        result = get_batch_coordinator().request(self.model, self.memory, response_format)
+        if "error" in result:
+            logger.error(f"Error when generating response: batch request failed: {result['error']}")
+            return -1
+        usage = result.get("usage")
+        response = types.SimpleNamespace(usage=types.SimpleNamespace(**usage) if usage else None)
+        self._record_usage(estimated_tokens, response)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, self.model, result["content"])
+        self.add_to_memory("assistant", result["content"])
+        return 1
+
+    def _request(self, response_format):
+        """One attempt, returns (response, content, rate-limit headers)."""
+        # The limiter is only held during the attempt, not while backing off
+        with self.request_limiter:
+            if (self.is_openai_model()):
+                raw_response = self.client.beta.chat.completions.with_raw_response.parse(
+                    model = self.model,
+                    messages = self.memory,
+                    response_format=response_format
+                )
+                response = raw_response.parse()
+                return response, response.choices[0].message.content, raw_response.headers
+            response = self.client.chat(model=self.model, messages=self.memory, format=response_format.model_json_schema())
+            return response, response.message.content, None
+
+    def _request_stream(self, response_format, collector):
+        """One streamed attempt, returns (final response with usage, content, None)."""
+        with self.request_limiter:
+            if (self.is_openai_model()):
+                with self.client.beta.chat.completions.stream(
+                    model = self.model,
+                    messages = self.memory,
+                    response_format=response_format,
+                    stream_options={"include_usage": True}
+                ) as stream:
+                    for event in stream:
+                        if event.type == "content.delta":
+                            collector.add(event.delta)
+                    response = stream.get_final_completion()
+                return response, collector.finish(), None
+            response = None
+            for chunk in self.client.chat(model=self.model, messages=self.memory, format=response_format.model_json_schema(), stream=True):
+                collector.add(chunk.message.content)
+                # The last chunk carries the eval counts
+                response = chunk
+            return response, collector.finish(), None
+
     def get_last_msg(self):
         if self.memory:
             return self.memory[-1]
@@ -58,9 +216,105 @@ class LLMAgent:
     
     def clear_memory(self):
         self.memory = [{"role": "system", "content": self.system_message}]
+
+    def set_memory(self, memory):
+        self.memory = list(memory)
+
+    def fork(self):
+        """Copy of the agent sharing its client but with its own memory, to explore an alternative reply."""
+        forked = copy.copy(self)
+        forked.memory = list(self.memory)
+        return forked
     
     def is_openai_model(self):
-        return self.model in ["gpt-4o", "o1", "o3-mini"]
+        return self.model in OPENAI_MODELS
+
+class AsyncLLMAgent(LLMAgent):
+    """
+    asyncio version of LLMAgent built on AsyncOpenAI / ollama.AsyncClient.
+    Agents sharing the same semaphore never have more than its limit of requests in flight,
+    so generator and evaluator conversations of many programs can be awaited together.
+    Without a semaphore an agent shares get_request_semaphore() with the other agents.
+    """
+    def __init__(self, api_key, model, system_message="You are a helpful assistant.", semaphore=None, response_cache=None, retry_policy=None):
+        self.semaphore = semaphore
+        super().__init__(api_key, model, system_message, response_cache=response_cache, retry_policy=retry_policy)
+
+    def _request_slot(self):
+        return self.semaphore if self.semaphore is not None else get_request_semaphore()
+
+    def _create_client(self, api_key):
+        if self.is_openai_model():
+            return AsyncOpenAI(api_key=api_key, timeout=self.retry_policy.timeout, max_retries=0)
+        return AsyncClient(host="http://localhost:11434", timeout=self.retry_policy.timeout)
+
+    async def generate_response(self, response_format=BaseModel, on_field=None):
+        estimated_tokens = self._prepare_memory()
+        cache_key, content = self._lookup_cache(response_format)
+        if content is not None:
+            self.add_to_memory("assistant", content)
+            return 1
+        if self.response_cache is not None and self.response_cache.replay:
+            logger.error("Replay mode: no cached response for this request")
+            return -1
+
+        # Snapshot the conversation so later add_to_memory calls do not leak into this request
+        messages = list(self.memory)
+        collectors = []
+        async def request():
+            if self.streaming:
+                collectors.append(StreamCollector(on_field))
+                return await self._request_stream_async(messages, response_format, collectors[-1])
+            async with self._request_slot():
+                if (self.is_openai_model()):
+                    raw_response = await self.client.beta.chat.completions.with_raw_response.parse(
+                        model = self.model,
+                        messages = messages,
+                        response_format=response_format
+                    )
+                    response = raw_response.parse()
+                    return response, response.choices[0].message.content, raw_response.headers
+                response = await self.client.chat(model=self.model, messages=messages, format=response_format.model_json_schema())
+                return response, response.message.content, None
+
+        try:
+            response, content = await async_call_with_retries(request, self.retry_policy, estimated_tokens)
+        except LLMRequestError as e:
+            logger.error(f"Error when generating response: {e}")
+            return -1
+        self._record_usage(estimated_tokens, response, collectors[-1] if collectors else None)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, self.model, content)
+        self.add_to_memory("assistant", content)
+        return 1
+
+    async def _request_stream_async(self, messages, response_format, collector):
+        async with self._request_slot():
+            if (self.is_openai_model()):
+                async with self.client.beta.chat.completions.stream(
+                    model = self.model,
+                    messages = messages,
+                    response_format=response_format,
+                    stream_options={"include_usage": True}
+                ) as stream:
+                    async for event in stream:
+                        if event.type == "content.delta":
+                            collector.add(event.delta)
+                    response = await stream.get_final_completion()
+                return response, collector.finish(), None
+            response = None
+            async for chunk in await self.client.chat(model=self.model, messages=messages, format=response_format.model_json_schema(), stream=True):
+                collector.add(chunk.message.content)
+                response = chunk
+            return response, collector.finish(), None
+
+async def generate_concurrently(requests):
+    """
+    Pipeline several conversations at once.
+    requests is a list of (AsyncLLMAgent, response_format) pairs, one per conversation,
+    returns the generate_response status of every request in the same order.
+    """
+    return await asyncio.gather(*(agent.generate_response(response_format) for agent, response_format in requests))
 
 class OpenAIAssistant:
     def __init__(self, api_key: str, name: str, instructions: str, model: str = "gpt-4o"):
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from utils import Logger
+
+try:
+    from openai.lib._parsing._completions import type_to_response_format_param
+except ImportError:
+    type_to_response_format_param = None
+
+logger = Logger("logs", sys.argv[2]).logger
+
+# Coordinator every LLMAgent of the process sends its requests to, see set_batch_coordinator
+_batch_coordinator = None
+
+def response_format_param(response_format):
+    """Chat completions response_format for a pydantic model, as the batch API needs it spelled out."""
+    if type_to_response_format_param is not None:
+        return type_to_response_format_param(response_format)
+    return {"type": "json_schema", "json_schema": {"name": response_format.__name__, "schema": response_format.model_json_schema()}}
+
+class OpenAIBatchBackend:
+    """Submits a round of requests as one OpenAI Batch API job over /v1/chat/completions."""
+    def __init__(self, client, completion_window="24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, requests):
+        lines = "".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}) + "\n"
+                        for custom_id, body in requests.items())
+        batch_file = self.client.files.create(file=("batch.jsonl", io.BytesIO(lines.encode("utf-8"))), purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window=self.completion_window)
+        return batch.id
+
+    def poll(self, job_id):
+        """None while the job runs, then {custom_id: {"content", "usage"} or {"error"}}."""
+        batch = self.client.batches.retrieve(job_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.update(parse_batch_output(self.client.files.content(file_id).text))
+        if batch.status != "completed":
+            logger.error(f"Batch {job_id} ended with status {batch.status}")
+        return results
+
+class LocalFileBatchBackend:
+    """
+    File-based stand-in for a batch provider, for tests and offline runs. A job is written to
+    <batch_dir>/<job>.input.jsonl in the OpenAI batch format and is done once
+    <batch_dir>/<job>.output.jsonl exists, written by another process or, when a responder is
+    given, right away by responder(body) -> content for every request.
+    """
+    def __init__(self, batch_dir, responder=None):
+        self.batch_dir = batch_dir
+        self.responder = responder
+        os.makedirs(batch_dir, exist_ok=True)
+
+    def _path(self, job_id, kind):
+        return os.path.join(self.batch_dir, f"{job_id}.{kind}.jsonl")
+
+    def submit(self, requests):
+        job_id = f"batch_{uuid.uuid4().hex}"
+        self._write(self._path(job_id, "input"), [
+            {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body} for custom_id, body in requests.items()
+        ])
+        if self.responder is not None:
+            self._write(self._path(job_id, "output"), [
+                {"custom_id": custom_id, "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"role": "assistant", "content": self.responder(body)}}]
+                }}} for custom_id, body in requests.items()
+            ])
+        return job_id
+
+    def _write(self, path, lines):
+        # Written atomically, pollers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.batch_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            for line in lines:
+                file.write(json.dumps(line) + "\n")
+        os.replace(tmp_path, path)
+
+    def poll(self, job_id):
+        try:
+            with open(self._path(job_id, "output"), "r") as file:
+                return parse_batch_output(file.read())
+        except FileNotFoundError:
+            return None
+
+def parse_batch_output(text):
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        body = response.get("body") or {}
+        if entry.get("error") or response.get("status_code", 200) != 200 or not body.get("choices"):
+            results[entry["custom_id"]] = {"error": entry.get("error") or body.get("error") or "empty response"}
+        else:
+            results[entry["custom_id"]] = {"content": body["choices"][0]["message"]["content"], "usage": body.get("usage")}
+    return results
+
+class BatchCoordinator:
+    """
+    Advances every program's optimization loop in rounds. Program threads join before they
+    start and leave when they finish; an LLM request blocks its thread. Once every joined
+    thread is blocked on a request, all pending requests are submitted as one batch job,
+    polled until done and handed back, and the programs continue together to the next round.
+    """
+    def __init__(self, backend, poll_interval=30):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.running = 0
+        self.pending = {}
+        self.results = {}
+        self.rounds = 0
+
+    def join(self, count=1):
+        with self.condition:
+            self.running += count
+
+    def leave(self):
+        with self.condition:
+            self.running -= 1
+            self._flush_if_blocked()
+
+    def request(self, model, messages, response_format):
+        """Returns {"content", "usage"} or {"error"} for one chat completion."""
+        custom_id = uuid.uuid4().hex
+        with self.condition:
+            self.pending[custom_id] = {"model": model, "messages": list(messages), "response_format": response_format_param(response_format)}
+            self.running -= 1
+            self._flush_if_blocked()
+            while custom_id not in self.results:
+                self.condition.wait()
+            self.running += 1
+            return self.results.pop(custom_id)
+
+    def _flush_if_blocked(self):
+        # Called with the condition held, by the last thread to block
+        if self.running > 0 or not self.pending:
+            return
+        requests, self.pending = self.pending, {}
+        self.rounds += 1
+        logger.info(f"BatchCoordinator: round {self.rounds}, submitting {len(requests)} requests")
+        # Nobody else can add requests while every thread waits, poll without holding the lock
+        self.condition.release()
+        try:
+            results = self._run_job(requests)
+        finally:
+            self.condition.acquire()
+        for custom_id in requests:
+            self.results[custom_id] = results.get(custom_id, {"error": "missing from the batch output"})
+        self.condition.notify_all()
+
+    def _run_job(self, requests):
+        try:
+            job_id = self.backend.submit(requests)
+            while True:
+                results = self.backend.poll(job_id)
+                if results is not None:
+                    return results
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            logger.error(f"BatchCoordinator: batch job failed: {e}")
+            return {custom_id: {"error": str(e)} for custom_id in requests}
+
+def set_batch_coordinator(batch_coordinator):
+    global _batch_coordinator
+    _batch_coordinator = batch_coordinator
+
+def get_batch_coordinator():
+    return _batch_coordinator
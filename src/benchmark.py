@@ -1,5 +1,21 @@
 from abc import ABC, abstractmethod
+import concurrent.futures
+import contextlib
+import math
+import subprocess
+import sys
+from calibration import CalibrationError
+from measurement_store import aggregate
+from rapl_reader import parse_measure_command
+from workspace import Workspace
 from status import Status
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+def measurement_failed(stats):
+    """True when make measure or the energy meter produced no usable samples."""
+    return stats["trials"] == 0 or math.isnan(stats["energy"]["mean"]) or math.isnan(stats["runtime"]["mean"])
 
 class Benchmark:
     def __init__(self, program):
@@ -7,8 +23,30 @@ class Benchmark:
         self.compilation_error = ""
         self.energy_data = {}
         self.evaluator_feedback_data = {}
-        self.original_code = self.set_original_code()
+        self.original_code = None
         self.optimization_iteration = 0
+        self.measurement_slot = contextlib.nullcontext()
+        self.build_slot = contextlib.nullcontext()
+        self.binary_cache = None
+        self.measurement_cache = None
+        self.energy_meter = None
+        self.adaptive_sampler = None
+        self.calibration = None
+        self.measurement_env = None
+        self.measurement_stats = {}
+        self.source_dir = None
+        self.workspace_root = None
+        self.original_workspace = None
+        self.candidate_workspace = None
+        self.test_runner = None
+        self.prescreen = None
+        self.prescreen_reference = None
+        self.prescreen_best_energy = None
+        self.last_prescreen_value = None
+        self.prescreen_feedback = ""
+        self.early_compile = None
+        self.compile_executor = None
+        self.set_original_code()
 
     @abstractmethod
     def set_original_code(self):
@@ -54,15 +92,318 @@ class Benchmark:
     def get_compilation_error(self):
         return self.compilation_error
 
+    def set_measurement_slot(self, measurement_slot):
+        """
+        Context manager held around every energy measurement, used by the scheduler
+        to serialize RAPL runs across programs.
+        """
+        self.measurement_slot = measurement_slot
+
+    def set_build_slot(self, build_slot):
+        """
+        Context manager held around every build and test run, used by the scheduler to
+        bound how many programs compile and test at once when they run as threads.
+        """
+        self.build_slot = build_slot
+
+    def set_prescreen(self, prescreen):
+        """prescreen.PreScreen run on every tested candidate before its full measurement."""
+        self.prescreen = prescreen
+
+    def get_prescreen_feedback(self):
+        return self.prescreen_feedback
+
+    def set_test_runner(self, test_runner):
+        """TestCaseRunner used by benchmarks with many input/output test cases."""
+        self.test_runner = test_runner
+
+    def set_workspace_root(self, workspace_root):
+        """Directory workspaces are created in, defaults to the system temp directory."""
+        self.workspace_root = workspace_root
+
+    def _get_original_workspace(self):
+        if self.original_workspace is None:
+            self.original_workspace = Workspace(self.source_dir, f"original_{self.program}", self.workspace_root)
+        return self.original_workspace
+
+    def _create_candidate_workspace(self):
+        return Workspace(self.source_dir, f"candidate_{self.program}", self.workspace_root)
+
+    def _new_candidate_workspace(self):
+        """Fresh workspace for the next optimized candidate, the previous candidate's one is removed."""
+        if self.candidate_workspace is not None:
+            self.candidate_workspace.cleanup()
+        self.candidate_workspace = self._create_candidate_workspace()
+        return self.candidate_workspace
+
+    def _get_workspace(self, optimized):
+        return self.candidate_workspace if optimized else self._get_original_workspace()
+
+    def start_compile(self, code):
+        """
+        Compile code in the background while the LLM reply is still streaming. compile() of
+        the same post-processed code takes this build instead of compiling again.
+        """
+        optimized_code = self.post_process(code)
+        self._discard_early_compile()
+        if self.compile_executor is None:
+            self.compile_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        workspace = self._create_candidate_workspace()
+        future = self.compile_executor.submit(self._compile_candidate, workspace, optimized_code)
+        self.early_compile = (optimized_code, workspace, future)
+
+    def _discard_early_compile(self):
+        if self.early_compile is not None:
+            _, workspace, future = self.early_compile
+            # The build may still be writing into the workspace
+            future.add_done_callback(lambda _: workspace.cleanup())
+            self.early_compile = None
+
+    def _compile_in_candidate_workspace(self, optimized_code):
+        """Compile optimized_code as the current candidate, returns the compiler error or None."""
+        if self.early_compile is not None and self.early_compile[0] == optimized_code:
+            _, workspace, future = self.early_compile
+            self.early_compile = None
+            if self.candidate_workspace is not None:
+                self.candidate_workspace.cleanup()
+            self.candidate_workspace = workspace
+            logger.info("Using the build started while the reply was streaming")
+            return future.result()
+        self._discard_early_compile()
+        workspace = self._new_candidate_workspace()
+        logger.info(f"llm_optimize: : writing optimized code to {workspace.file(f'optimized_{self.program}')}")
+        return self._compile_candidate(workspace, optimized_code)
+
+    def cleanup(self):
+        self._discard_early_compile()
+        if self.compile_executor is not None:
+            self.compile_executor.shutdown(wait=True)
+            self.compile_executor = None
+        for workspace in [self.original_workspace, self.candidate_workspace]:
+            if workspace is not None:
+                workspace.cleanup()
+        self.original_workspace = None
+        self.candidate_workspace = None
+
+    def set_binary_cache(self, binary_cache):
+        self.binary_cache = binary_cache
+
+    def set_measurement_cache(self, measurement_cache):
+        self.measurement_cache = measurement_cache
+
+    def set_energy_meter(self, energy_meter):
+        """
+        Measure with an in-process rapl_reader.EnergyMeter instead of `make measure`.
+        """
+        self.energy_meter = energy_meter
+        if self.measurement_env is not None:
+            self.energy_meter.environment = self.measurement_env
+
+    def set_adaptive_sampler(self, adaptive_sampler):
+        self.adaptive_sampler = adaptive_sampler
+
+    def set_measurement_environment(self, measurement_env):
+        """
+        measurement_env.MeasurementEnvironment measurements are pinned to the core of and wait
+        for a quiet machine in. Trials measured by RAPL/main cannot be rejected one by one,
+        the whole batch waits for the background load to drop instead.
+        """
+        self.measurement_env = measurement_env
+        if self.energy_meter is not None:
+            self.energy_meter.environment = measurement_env
+
+    def _environment(self):
+        if self.measurement_env is None:
+            return contextlib.nullcontext()
+        return self.measurement_env
+
+    def set_calibration(self, calibration):
+        """
+        calibration.StartupCalibration whose startup overhead is subtracted from every measurement,
+        calibrated by _calibrate before the original code is measured.
+        """
+        self.calibration = calibration
+
+    def _calibration_programs(self):
+        """
+        (no-op source, idle source with a %d for microseconds) built with the candidates' compile
+        target, None when this benchmark cannot be calibrated.
+        """
+        return None
+
+    def _calibrate(self):
+        """Measure the calibration programs as candidates, through the same launch path as every candidate."""
+        if self.calibration is None or self.calibration.is_calibrated():
+            return
+        programs = self._calibration_programs()
+        if programs is None:
+            logger.info(f"No calibration programs for {self.program}, reporting raw measurements")
+            self.calibration = None
+            return
+        workspace = self._create_candidate_workspace()
+        previous, self.candidate_workspace = self.candidate_workspace, workspace
+
+        def measure(code):
+            error = self._compile_candidate(workspace, code)
+            if error is not None:
+                raise CalibrationError(f"calibration program failed to compile: {error}")
+            return self._candidate_stats()
+
+        try:
+            self.calibration.calibrate(measure, *programs)
+        except CalibrationError as e:
+            logger.error(f"Startup calibration failed, reporting raw measurements: {e}")
+            self.calibration = None
+        finally:
+            self.candidate_workspace = previous
+            workspace.cleanup()
+
+    def get_measurement_stats(self):
+        return self.measurement_stats
+
+    def _print_measurement_stats(self, stats):
+        logger.info("Energy: mean {:.3f}, median {:.3f}, stddev {:.3f}, 95% CI [{:.3f}, {:.3f}] over {} trials".format(
+            stats["energy"]["mean"], stats["energy"]["median"], stats["energy"]["stddev"], stats["energy"]["ci_low"], stats["energy"]["ci_high"], stats["trials"]))
+        logger.info("Runtime: mean {:.3f}, median {:.3f}, stddev {:.3f}, 95% CI [{:.3f}, {:.3f}] over {} trials".format(
+            stats["runtime"]["mean"], stats["runtime"]["median"], stats["runtime"]["stddev"], stats["runtime"]["ci_low"], stats["runtime"]["ci_high"], stats["trials"]))
+        if "raw" in stats:
+            logger.info("Net of startup overhead {:.4f} J, {:.3f} ms per trial (idle package power {:.3f} W), raw energy mean {:.3f}, raw runtime mean {:.3f}".format(
+                stats["overhead"]["energy"], stats["overhead"]["runtime"], stats["overhead"]["idle_power"], stats["raw"]["energy"]["mean"], stats["raw"]["runtime"]["mean"]))
+        for input_file, input_stats in stats.get("inputs", {}).items():
+            logger.info("  {} (weight {:.3f}): energy mean {:.3f}, runtime mean {:.3f} over {} trials".format(
+                input_file, input_stats["weight"], input_stats["energy"]["mean"], input_stats["runtime"]["mean"], input_stats["trials"]))
+
+    def _sample_batch(self, optimized, *args):
+        """
+        Run one RAPL batch on the original or optimized binary, returns its RECORD_DTYPE records.
+        Extra args select what is measured, e.g. the input file for benchmarks with several inputs.
+        """
+        pass
+
+    def _quiet_sample_batch(self, optimized, *args):
+        # The in-process EnergyMeter checks the background load before every trial itself
+        if self.measurement_env is not None and self.energy_meter is None:
+            self.measurement_env.wait_until_quiet()
+        return self._sample_batch(optimized, *args)
+
+    def _measure_stats(self, optimized, *args):
+        with self.measurement_slot, self._environment():
+            if self.adaptive_sampler is not None:
+                records = self.adaptive_sampler.run(self._quiet_sample_batch, optimized, *args)
+            else:
+                records = self._quiet_sample_batch(optimized, *args)
+        if self.adaptive_sampler is not None:
+            return aggregate(records, by=None, confidence=self.adaptive_sampler.confidence)
+        return aggregate(records, by=None)
+
+    def _memoized_measurement(self, build_dir, measure_command, binary_path, input_path, optimized, *args):
+        """
+        Return the measurement statistics of the binary (see measurement_store.aggregate),
+        reusing a stored measurement of the same binary, input and measurement setup when the
+        measurement cache has one. Extra args are passed on to _sample_batch. With a calibration,
+        the stats are net of the startup overhead (see calibration.StartupCalibration.apply).
+        """
+        if self.measurement_cache is None:
+            return self._net_stats(self._measure_stats(optimized, *args))
+
+        config = self.measurement_cache.measurement_config(build_dir, measure_command)
+        config["energy_meter"] = type(self.energy_meter.backend).__name__ if self.energy_meter is not None else "make"
+        config["adaptive_sampler"] = vars(self.adaptive_sampler) if self.adaptive_sampler is not None else None
+        if self.measurement_env is not None:
+            config["environment"] = {name: getattr(self.measurement_env, name) for name in ("core", "governor", "disable_turbo", "max_load")}
+        key = self.measurement_cache.make_key(binary_path, input_path, config)
+        cached = self.measurement_cache.get(key)
+        if cached is not None:
+            return self._net_stats(cached)
+
+        # Raw stats are stored, a later calibration applies to them as well
+        stats = self._measure_stats(optimized, *args)
+        # A failed measurement is not stored, it would be served as valid until it expires
+        if not measurement_failed(stats):
+            self.measurement_cache.put(key, stats)
+        return self._net_stats(stats)
+
+    def _net_stats(self, stats):
+        if self.calibration is None:
+            return stats
+        return self.calibration.apply(stats)
+
+    def _make_compile(self, build_dir, target, source_code):
+        """
+        Run `make <target>` in build_dir, going through the binary cache when one is set.
+        Raises subprocess.CalledProcessError when compilation fails.
+        """
+        with self.build_slot:
+            if self.binary_cache is not None:
+                result = self.binary_cache.compile(source_code, build_dir, target)
+            else:
+                result = subprocess.run(["make", target], cwd=build_dir, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout, result.stderr)
+        return result
+
+    def _compile_candidate(self, workspace, optimized_code):
+        """Write optimized_code into workspace and compile it, returns the compiler error or None."""
+        workspace.write_file(f"optimized_{self.program}", optimized_code)
+        try:
+            self._make_compile(workspace.path, "compile_optimized", optimized_code)
+            return None
+        except subprocess.CalledProcessError as e:
+            return e.stderr
+
+    def _measure_target(self, optimized):
+        """
+        Returns (build_dir, make target, make args) measuring the original or optimized binary.
+        """
+        pass
+
+    def _prescreen_sample(self, optimized, reference=None):
+        build_dir, target, make_args = self._measure_target(optimized)
+        try:
+            argv, stdin_path, _ = parse_measure_command(build_dir, target, make_args)
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+        # One timed run is as sensitive to interference as a RAPL trial, run it in the measurement slot
+        with self.measurement_slot, self._environment():
+            return self.prescreen.sample(argv, stdin_path, build_dir, reference)
+
+    def _prescreen_rejects(self):
+        """Pre-screen the current candidate against the lowest-energy version so far."""
+        self.last_prescreen_value = None
+        if self.prescreen is None:
+            return False
+        if self.prescreen_best_energy is None:
+            self.prescreen_reference = self._prescreen_sample(False)
+            self.prescreen_best_energy = self.measurement_stats[0]["energy"]["mean"]
+        self.last_prescreen_value = self._prescreen_sample(True, self.prescreen_reference)
+        if not self.prescreen.rejects(self.last_prescreen_value, self.prescreen_reference):
+            return False
+        ratio = self.last_prescreen_value / self.prescreen_reference
+        unit = "run time" if self.prescreen.metric == "time" else "instructions retired"
+        self.prescreen_feedback = f"A quick run of the code you generated took {ratio:.2f}x the {unit} of the most energy efficient version so far, it was not measured."
+        return True
+
+    def _update_prescreen_reference(self, energy):
+        # The candidate just measured becomes the reference when it is the new lowest energy
+        if self.last_prescreen_value is not None and energy < self.prescreen_best_energy:
+            self.prescreen_reference = self.last_prescreen_value
+            self.prescreen_best_energy = energy
+
+    def _candidate_stats(self):
+        """
+        Measure the binary in the current candidate workspace, returns measurement_store.aggregate stats.
+        """
+        pass
+
     @abstractmethod
-    def run_tests(self):
+    def run_tests(self, workspace=None):
         """
         Execute the main tests for benchmarking.
         """
         pass
 
     @abstractmethod
-    def measure_energy(self, optimized_code):
+    def measure_energy(self, optimized_code, stats=None):
         """
         Measure energy usage during benchmarking.
         """
@@ -74,11 +415,83 @@ class Benchmark:
     def get_evaluator_feedback_data(self):
         return self.evaluator_feedback_data
 
-    def static_analysis(self, optimized_code):
+    def _run_tests_in_slot(self, workspace=None):
+        with self.build_slot:
+            return self.run_tests(workspace)
+
+    def static_analysis(self, optimized_code, prescreen=True):
         if not self.compile(optimized_code):
             return Status.COMPILATION_ERROR
-        if not self.run_tests():
+        if not self._run_tests_in_slot():
             return Status.RUNTIME_ERROR_OR_TEST_FAILED
-        if not self.measure_energy(optimized_code):
+        if prescreen and self._prescreen_rejects():
+            return Status.PRESCREEN_REJECTED
+        stats = self._candidate_stats()
+        if measurement_failed(stats):
+            logger.error("Measurement of the optimized code produced no samples")
+            return Status.MEASUREMENT_FAILED
+        improved = self.measure_energy(optimized_code, stats)
+        self._update_prescreen_reference(self.measurement_stats[self.optimization_iteration + 1]["energy"]["mean"])
+        if not improved:
             return Status.ALL_TEST_PASSED
         return Status.PERFORMANCE_IMPROVED     
+
+    def evaluate_candidates(self, candidates, prescreen=True):
+        """
+        static_analysis for several candidates of the same optimization step.
+        Every candidate is compiled and tested concurrently in its own workspace, only the
+        survivors that pass the pre-screen are measured and the one with the lowest mean energy is recorded.
+        Returns (status, index of the recorded candidate). When no candidate survives the
+        status of the first candidate is returned, its compiler error is kept for the next prompt.
+        """
+        workspaces = [self._create_candidate_workspace() for _ in candidates]
+
+        def screen(index):
+            error = self._compile_candidate(workspaces[index], candidates[index])
+            if error is not None:
+                return Status.COMPILATION_ERROR, error
+            if not self._run_tests_in_slot(workspaces[index]):
+                return Status.RUNTIME_ERROR_OR_TEST_FAILED, None
+            return None, None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            results = list(executor.map(screen, range(len(candidates))))
+
+        survivors = [index for index, (status, _) in enumerate(results) if status is None]
+        if not survivors:
+            for workspace in workspaces:
+                workspace.cleanup()
+            status, error = results[0]
+            if error is not None:
+                self.compilation_error = error
+            return status, 0
+
+        if self.candidate_workspace is not None:
+            self.candidate_workspace.cleanup()
+        best, best_stats, best_prescreen = None, None, None
+        failed_measurements = 0
+        for index in survivors:
+            self.candidate_workspace = workspaces[index]
+            if prescreen and self._prescreen_rejects():
+                continue
+            stats = self._candidate_stats()
+            if measurement_failed(stats):
+                logger.error(f"Measurement of candidate {index} produced no samples")
+                failed_measurements += 1
+                continue
+            if best_stats is None or stats["energy"]["mean"] < best_stats["energy"]["mean"]:
+                best, best_stats, best_prescreen = index, stats, self.last_prescreen_value
+        self.candidate_workspace = None
+        for index, workspace in enumerate(workspaces):
+            if index != best:
+                workspace.cleanup()
+        if best is None:
+            return (Status.MEASUREMENT_FAILED if failed_measurements else Status.PRESCREEN_REJECTED), survivors[0]
+        self.candidate_workspace = workspaces[best]
+
+        improved = self.measure_energy(candidates[best], best_stats)
+        self.last_prescreen_value = best_prescreen
+        self._update_prescreen_reference(best_stats["energy"]["mean"])
+        if not improved:
+            return Status.ALL_TEST_PASSED, best
+        return Status.PERFORMANCE_IMPROVED, best
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+class BinaryCache:
+    """
+    Cache of compiled object files and executables.
+    An entry is keyed on the normalized source code, the compile commands that make would run
+    for the target and the compiler version, so identical candidates never reach g++ twice.
+    Failed compilations are cached too, together with their error output.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.compiler_versions = {}
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def normalize_source(self, source_code):
+        lines = [line.rstrip() for line in source_code.replace("\r\n", "\n").split("\n")]
+        return "\n".join(lines).strip("\n")
+
+    def get_compile_commands(self, build_dir, target, make_args=()):
+        # Dry run, prints the commands make would execute without compiling anything
+        result = subprocess.run(["make", "-n", target, *make_args], cwd=build_dir, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+    def _compiler_version(self, compiler):
+        if compiler not in self.compiler_versions:
+            try:
+                result = subprocess.run([compiler, "--version"], capture_output=True, text=True)
+                self.compiler_versions[compiler] = result.stdout.splitlines()[0] if result.stdout else ""
+            except OSError:
+                self.compiler_versions[compiler] = ""
+        return self.compiler_versions[compiler]
+
+    def _output_files(self, commands):
+        outputs = []
+        for command in commands:
+            tokens = shlex.split(command)
+            for i, token in enumerate(tokens[:-1]):
+                if token == "-o" and tokens[i + 1] not in outputs:
+                    outputs.append(tokens[i + 1])
+        return outputs
+
+    def make_key(self, source_code, commands):
+        compilers = sorted({shlex.split(command)[0] for command in commands if command and not command.startswith("#")})
+        payload = {
+            "source": self.normalize_source(source_code),
+            "commands": commands,
+            "compilers": [self._compiler_version(compiler) for compiler in compilers]
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def compile(self, source_code, build_dir, target, make_args=()):
+        """
+        Equivalent of `make <target>` in build_dir, returns a subprocess.CompletedProcess.
+        On a cache hit the cached object files and executables are copied into build_dir instead.
+        """
+        commands = self.get_compile_commands(build_dir, target, make_args)
+        if commands is None:
+            return subprocess.run(["make", target, *make_args], cwd=build_dir, capture_output=True, text=True)
+
+        key = self.make_key(source_code, commands)
+        entry_dir = os.path.join(self.cache_dir, key)
+        cached = self._restore(entry_dir, build_dir)
+        if cached is not None:
+            logger.info(f"BinaryCache: hit for make {target}, skipping compilation")
+            return cached
+
+        result = subprocess.run(["make", target, *make_args], cwd=build_dir, capture_output=True, text=True)
+        self._store(entry_dir, build_dir, self._output_files(commands), result)
+        return result
+
+    def _restore(self, entry_dir, build_dir):
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as file:
+            meta = json.load(file)
+        for output in meta["outputs"]:
+            cached_file = os.path.join(entry_dir, os.path.basename(output))
+            if not os.path.exists(cached_file):
+                return None
+        for output in meta["outputs"]:
+            # Copy rather than link, the next compile of this target overwrites the file in place
+            shutil.copy2(os.path.join(entry_dir, os.path.basename(output)), os.path.join(build_dir, output))
+        return subprocess.CompletedProcess(meta["args"], meta["returncode"], meta["stdout"], meta["stderr"])
+
+    def _store(self, entry_dir, build_dir, outputs, result):
+        if os.path.exists(entry_dir):
+            return
+        stored_outputs = []
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            if result.returncode == 0:
+                for output in outputs:
+                    output_path = os.path.join(build_dir, output)
+                    if os.path.exists(output_path):
+                        shutil.copy2(output_path, os.path.join(tmp_dir, os.path.basename(output)))
+                        stored_outputs.append(output)
+            meta = {
+                "args": result.args,
+                "returncode": result.returncode,
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+                "outputs": stored_outputs
+            }
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as file:
+                json.dump(meta, file)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            # Another worker stored the same entry first
+            logger.info(f"BinaryCache: not storing entry: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,64 @@
+import math
+import sys
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+# Built with the candidates' compile target, so they link and load like the measured binaries
+CPP_NOOP_PROGRAM = "int main() { return 0; }\n"
+CPP_IDLE_PROGRAM = "#include <unistd.h>\nint main() { usleep(%d); return 0; }\n"
+
+class CalibrationError(Exception):
+    pass
+
+class StartupCalibration:
+    """
+    Startup overhead of the measurement launch path: the system() shell spawn of RAPL/main
+    (or the exec of the in-process EnergyMeter), the dynamic loader and process exit. A no-op
+    program built and measured exactly like the candidates gives the overhead of one trial, a
+    program sleeping idle_ms gives the idle package power from the difference to the no-op.
+    Net stats are the raw stats minus the overhead, its uncertainty widens the confidence interval.
+    """
+    def __init__(self, idle_ms=200):
+        self.idle_ms = idle_ms
+        self.overhead = None
+        self.idle_power = None
+
+    def is_calibrated(self):
+        return self.overhead is not None
+
+    def calibrate(self, measure, noop_program=CPP_NOOP_PROGRAM, idle_program=CPP_IDLE_PROGRAM):
+        """measure(source_code) returns measurement_store.aggregate stats of the program."""
+        noop = measure(noop_program)
+        idle = measure(idle_program % (self.idle_ms * 1000))
+        if not noop["trials"] or math.isnan(noop["energy"]["mean"]):
+            raise CalibrationError("the no-op program returned no samples")
+        self.overhead = {"energy": noop["energy"], "runtime": noop["runtime"]}
+        # Both runs pay the same startup, the rest of the sleeping run is idle
+        idle_seconds = (idle["runtime"]["mean"] - noop["runtime"]["mean"]) / 1000
+        self.idle_power = (idle["energy"]["mean"] - noop["energy"]["mean"]) / idle_seconds if idle_seconds > 0 else math.nan
+        logger.info("StartupCalibration: overhead {:.4f} J, {:.3f} ms per trial, idle package power {:.3f} W".format(
+            self.overhead["energy"]["mean"], self.overhead["runtime"]["mean"], self.idle_power))
+
+    def summary(self):
+        return {"energy": self.overhead["energy"]["mean"], "runtime": self.overhead["runtime"]["mean"], "idle_power": self.idle_power}
+
+    def _subtract(self, raw, overhead):
+        mean = raw["mean"] - overhead["mean"]
+        half_width = math.hypot(raw["ci_high"] - raw["mean"], overhead["ci_high"] - overhead["mean"])
+        return dict(raw, mean=mean, median=raw["median"] - overhead["mean"], ci_low=mean - half_width, ci_high=mean + half_width,
+                    rel_ci_width=(2 * half_width / abs(mean)) if mean else math.inf)
+
+    def apply(self, stats):
+        """
+        Net stats of raw measurement_store.aggregate stats: "energy" and "runtime" have the overhead
+        subtracted, the raw ones are kept under "raw" and the calibration under "overhead".
+        """
+        if not self.is_calibrated() or "raw" in stats:
+            return stats
+        net = dict(stats)
+        for metric in ("energy", "runtime"):
+            net[metric] = self._subtract(stats[metric], self.overhead[metric])
+        net["raw"] = {"energy": stats["energy"], "runtime": stats["runtime"]}
+        net["overhead"] = self.summary()
+        return net
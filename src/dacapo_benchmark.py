@@ -4,6 +4,7 @@ import subprocess
 import sys
 from utils import Logger
 from dotenv import load_dotenv
+from measurement_store import MeasurementStore, aggregate, read_rapl_csv
 from utils import Logger
 
 load_dotenv()
@@ -16,14 +17,9 @@ USER_PREFIX = os.path.expanduser(os.getenv('USER_PREFIX'))
 class DaCapoBenchmark(Benchmark):
 
     def __init__(self, program):
-        self.program = program
-        self.compilation_error = None
-        self.energy_data = {}
-        self.evaluator_feedback_data = {}
+        super().__init__(program)
         self.expect_test_output = None
-        self.original_code = None
-        self.optimization_iteration = 0
-        self.set_original_code()
+        self.measurement_store = MeasurementStore(f"{USER_PREFIX}/src/runtime_logs/java/measurements.bin")
 
     def set_original_energy(self):
         # logger.info("Run benchmark on the original code")
@@ -31,13 +27,12 @@ class DaCapoBenchmark(Benchmark):
         # print(f"{USER_PREFIX}/benchmark_dacapo/benchmarks/bms/{self.program.split('.')[0].split('_')[-1]}")
         # os.chdir(f"{USER_PREFIX}/benchmark_dacapo/benchmarks/bms/{self.program.split('.')[0].split('_')[-1]}")  
 
-        os.chdir(f"{USER_PREFIX}/benchmark_dacapo/benchmarks/")  
-        # get current directory
-        current_dir = os.getcwd()
-        print(f"Current directory: {current_dir}")
+        current_dir = f"{USER_PREFIX}/benchmark_dacapo/benchmarks/"
+        print(f"Build directory: {current_dir}")
         try: 
             result = subprocess.run(
                 ["make", "compile", f"BENCHMARK={self.program}"], 
+                cwd=current_dir,
                 check=True,
                 capture_output=True,
                 text=True
@@ -50,9 +45,10 @@ class DaCapoBenchmark(Benchmark):
             print(f"Original code compile failed: {e}\n")
             return False
 
-        self._run_rapl()
-
-        avg_energy, avg_runtime = self._compute_avg()
+        with self.measurement_slot:
+            self._run_rapl()
+            # The runtime log is shared, read it back before releasing the slot
+            avg_energy, avg_runtime = self._compute_avg()
 
         #Append results to benchmark data dict
         self.energy_data[0] = (self.original_code, round(avg_energy, 3), round(avg_runtime, 3), len(self.original_code.splitlines()))
@@ -79,16 +75,15 @@ class DaCapoBenchmark(Benchmark):
         #     file.close()
 
         #run make measure using make file
-        #change current directory to benchmarks/folder to run make file
-        os.chdir(f"{USER_PREFIX}/benchmark_dacapo/benchmarks/")
-        current_dir = os.getcwd()
+        #run make file from the benchmarks/ folder
+        current_dir = f"{USER_PREFIX}/benchmark_dacapo/benchmarks/"
         # logger.info(f"Current directory: {current_dir}")
 
         try:
             if (self.optimization_iteration == 0):
-                result = subprocess.run(["make", "measure", f"BENCHMARK={self.program}"], check=True, capture_output=True, text=True)
+                result = subprocess.run(["make", "measure", f"BENCHMARK={self.program}"], cwd=current_dir, check=True, capture_output=True, text=True)
             else:
-                result = subprocess.run(["make", "measure_optimized", f"BENCHMARK={self.program}"], check=True, capture_output=True, text=True)
+                result = subprocess.run(["make", "measure_optimized", f"BENCHMARK={self.program}"], cwd=current_dir, check=True, capture_output=True, text=True)
             
             # logger.info("Benchmark.run: make measure successfully\n")
             print(result.stdout)
@@ -97,33 +92,10 @@ class DaCapoBenchmark(Benchmark):
             print(f"Benchmark.run: make measure failed: {e}\n")
 
     def _compute_avg(self):
-        energy_data_file = open(f"{USER_PREFIX}/src/runtime_logs/java/Java.csv", "r")
-        benchmark_data = []
-        for line in energy_data_file:
-            parts = line.split(';')
-            benchmark_name = parts[0].strip()
-            energy_data = [vals.strip() for vals in parts[1].split(',')]
-            
-            #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-            energy_data = [float(num) for num in energy_data if num]
-            benchmark_data.append((benchmark_name, *energy_data))
-
-        energy_data_file.close()
-
-        #Find average energy usage and average runtime
-        avg_energy = 0
-        avg_runtime = 0
-        for data in benchmark_data:
-            if data[1] < 0 or data[2] < 0:
-                benchmark_data.remove(data)
-            else:
-                avg_energy += data[1]
-                avg_runtime += data[2]
-
-        avg_energy /= len(benchmark_data)
-        avg_runtime /= len(benchmark_data)
-
-        return avg_energy, avg_runtime
+        records = read_rapl_csv(f"{USER_PREFIX}/src/runtime_logs/java/Java.csv", self.program, self.optimization_iteration)
+        self.measurement_store.append(records)
+        stats = aggregate(records, by=None)
+        return stats["energy"]["mean"], stats["runtime"]["mean"]
         
 
 def main():
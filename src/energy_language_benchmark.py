@@ -1,10 +1,15 @@
-from benchmark import Benchmark
+from benchmark import Benchmark, measurement_failed
 from dotenv import load_dotenv
+import hashlib
 import os
 import subprocess
+import tempfile
 import sys
 from utils import Logger
-import re
+from measurement_store import MeasurementStore, make_records, read_rapl_csv
+from calibration import CPP_NOOP_PROGRAM, CPP_IDLE_PROGRAM
+from golden_outputs import GoldenIndex, OutputDigest
+from test_runner import TestCaseRunner
 from abstract_syntax_trees.cpp_ast import CPPAST
 
 load_dotenv()
@@ -13,14 +18,10 @@ logger = Logger("logs", sys.argv[2]).logger
 
 class EnergyLanguageBenchmark(Benchmark):
     def __init__(self, program):
-        self.program = program
-        self.compilation_error = None
-        self.energy_data = {}
-        self.evaluator_feedback_data = {}
+        super().__init__(program)
+        self.source_dir = f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0]}"
         self.expect_test_output = None
-        self.original_code = None
-        self.optimization_iteration = 0
-        self.set_original_code()
+        self.measurement_store = MeasurementStore(f"{USER_PREFIX}/src/runtime_logs/measurements.bin")
     
     def set_original_code(self):
         source_path = f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0]}/{self.program}"
@@ -39,37 +40,42 @@ class EnergyLanguageBenchmark(Benchmark):
     def set_original_energy(self):
         logger.info("Run benchmark on the original code")
 
-        # compile
-        # Needed for makefiles
-        os.chdir(f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0].split('_')[-1]}")  
+        # compile inside the original workspace, the benchmark folder itself is never written to
+        build_dir = self._get_original_workspace().path
         try: 
-            result = subprocess.run(
-                ["make", "compile"], 
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            result = self._make_compile(build_dir, "compile", self.original_code)
             self.compilation_error = result.stdout + result.stderr
             logger.info(f"Original code compile successfully.\n")
         except subprocess.CalledProcessError as e:
             logger.error(f"Original code compile failed: {e}\n")
             return False
 
-        self._run_rapl()
-
-        avg_energy, avg_runtime = self._compute_avg()
+        binary_path = f"{build_dir}/{self.program.rsplit('.', 1)[0]}.gpp_run"
+        self._calibrate()
+        stats = self._memoized_measurement(build_dir, ["make", "measure"], binary_path, None, False)
+        if measurement_failed(stats):
+            logger.error(f"Measurement of the original code produced no samples\n")
+            return False
+        avg_energy, avg_runtime = stats["energy"]["mean"], stats["runtime"]["mean"]
 
         #Append results to benchmark data dict
         self.energy_data[0] = (self.original_code, round(avg_energy, 3), round(avg_runtime, 3), len(self.original_code.splitlines()))
+        self.measurement_stats[0] = stats
+        self._print_measurement_stats(stats)
         logger.info(f"original_energy_data: {self.energy_data[0]}")
         return True
 
+    def _calibration_programs(self):
+        # compile_optimized builds them like any candidate, the benchmark's arguments and input are ignored
+        return CPP_NOOP_PROGRAM, CPP_IDLE_PROGRAM
+
     def pre_process(self, code):
-        ast = CPPAST("cpp")
-        source_code_path = f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0]}/ast_{self.program}"
-        with open(source_code_path, 'w') as file:
-            file.write(code)
-        return ast.create_ast(source_code_path)
+        ast = CPPAST("cpp", cache_dir=f"{USER_PREFIX}/ast_cache")
+        with tempfile.TemporaryDirectory(prefix="ast_") as ast_dir:
+            source_code_path = f"{ast_dir}/ast_{self.program}"
+            with open(source_code_path, 'w') as file:
+                file.write(code)
+            return ast.create_ast(source_code_path)
 
     def post_process(self, code):
         # Remove code block delimiters
@@ -78,54 +84,44 @@ class EnergyLanguageBenchmark(Benchmark):
         return code
 
     def compile(self, optimized_code):
-        logger.info(f"llm_optimize: : writing optimized code to benchmark_c++/{self.program.split('.')[0]}/optimized_{self.program}")
-        destination_path = f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0]}/optimized_{self.program}"
-        with open(destination_path, "w") as file:
-            file.write(optimized_code)
-
-        # Needed for makefiles
-        os.chdir(f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0].split('_')[-1]}")  
-        try: 
-            result = subprocess.run(
-                ["make", "compile_optimized"], 
-                check=True,
-                capture_output=True,
-                text=True
-            )
+        error = self._compile_in_candidate_workspace(optimized_code)
+        if error is None:
             logger.info(f"Compile successfully.\n")
             return True
-        except subprocess.CalledProcessError as e:
-            self.compilation_error = e.stderr
-            logger.error(f"Compile failed: {self.compilation_error}\n")
-            return False
+        self.compilation_error = error
+        logger.error(f"Compile failed: {self.compilation_error}\n")
+        return False
 
     def get_compilation_error(self):
         return super().get_compilation_error()
 
-    def run_tests(self):
-        # Needed for makefiles
-        os.chdir(f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0].split('_')[-1]}")
-
+    def run_tests(self, workspace=None):
+        workspace = workspace if workspace is not None else self.candidate_workspace
         if (self.expect_test_output == None):   
-            self.expect_test_output = self._process_output_content(self._run_program(False))
+            self.expect_test_output = self._get_golden_digest()
+            if self.expect_test_output is None:
+                return False
         
-        optimized_output = self._run_program(True)
-
-        if not self._compare_outputs(optimized_output):
-            return False
-        else:
+        # Stream the optimized output against the expected one, stopping at the first difference
+        runner = TestCaseRunner(max_workers=1, timeout=None)
+        failure = runner.run(["make", "-s", "--no-print-directory", "run_optimized"], [(None, self.expect_test_output)], workspace.path)
+        if failure is None:
+            logger.info("Outputs are the same.\n")
             return True
+        logger.error(f"Optimized program failed: {failure['reason']} {failure['diff']}\n")
+        return False
     
-    def measure_energy(self, optimized_code):            
+    def measure_energy(self, optimized_code, stats=None):            
         #load the optimized code and data
         logger.info(f"Iteration {self.optimization_iteration + 1}, run benchmark on the optimized code")
-        
-        self._run_rapl()
-    
-        avg_energy, avg_runtime = self._compute_avg()
+        if stats is None:
+            stats = self._candidate_stats()
+        avg_energy, avg_runtime = stats["energy"]["mean"], stats["runtime"]["mean"]
         
         #Append results to benchmark data dict
         self.energy_data[self.optimization_iteration + 1] = (optimized_code, round(avg_energy, 3), round(avg_runtime, 3), len(optimized_code.splitlines()))
+        self.measurement_stats[self.optimization_iteration + 1] = stats
+        self._print_measurement_stats(stats)
         
         # Find the required benchmark elements
         self.evaluator_feedback_data = self._extract_content(self.energy_data)
@@ -134,108 +130,87 @@ class EnergyLanguageBenchmark(Benchmark):
         self._print_benchmark_info(self.evaluator_feedback_data)
 
  
+    def _measure_target(self, optimized):
+        if optimized:
+            return self.candidate_workspace.path, "measure_optimized", []
+        return self._get_original_workspace().path, "measure", []
+
+    def _candidate_stats(self):
+        build_dir = self.candidate_workspace.path
+        binary_path = f"{build_dir}/optimized_{self.program.rsplit('.', 1)[0]}.gpp_run"
+        return self._memoized_measurement(build_dir, ["make", "measure_optimized"], binary_path, None, True)
+
     def get_energy_data(self):
         return super().get_energy_data()
     
     def get_evaluator_feedback_data(self):
         return super().get_evaluator_feedback_data()
     
-    def static_analysis(self, optimized_code):
-        return super().static_analysis(optimized_code)
-
-    def _run_program(self, optimized):
-        # Run the make command and capture the output in a variable
-        if not optimized:
-            result = subprocess.run(["make", "run"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='latin-1')
-        else:
-            result = subprocess.run(["make", "run_optimized"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='latin-1')
-        
-        # Check for runtime errors
-        if result.returncode != 0:
-            return
-
-        # Filter out the unwanted lines
-        filtered_output = "\n".join(
-            line for line in result.stdout.splitlines()
-            if not (line.startswith("make[") or line.startswith("./"))
-        )
-        
-        return filtered_output
-    
-    def _compare_outputs(self, optimized_output):
-        # whitespace remove
-        optimized_output = self._process_output_content(optimized_output)
-        
-        if self.expect_test_output == optimized_output:
-            logger.info("Outputs are the same.\n")
-            return True
-        else:
-            logger.error(f"Original program output:\n{self.expect_test_output}\n")
-            logger.error(f"Optimized program output:\n{optimized_output}\n\n")
-            return False
-            
-    def _process_output_content(self, content):
-        """Remove all spaces, newline characters, and tabs for cleaner comparison."""
-        if content is None or not isinstance(content, str):
-           return content
-        # If content is a list of lines, join it into a single string
-        if isinstance(content, list):
-            content = ''.join(content)
-        # Remove all whitespace characters
-        return re.sub(r'\s+', '', content)
-
-    def _run_rapl(self):
-        # First clear the contents of the energy data log file
-        logger.info(f"Benchmark.run: clearing content in c++.csv")
-        log_file_path = f"{USER_PREFIX}/src/runtime_logs/c++.csv"
-        if os.path.exists(log_file_path):
-            file = open(log_file_path, "w+")
-            file.close()
-
-        #run make measure using make file
-        #change current directory to benchmarks/folder to run make file
-        os.chdir(f"{USER_PREFIX}/benchmark_c++/{self.program.split('.')[0]}")
-        current_dir = os.getcwd()
-        logger.info(f"Current directory: {current_dir}")
+    def static_analysis(self, optimized_code, prescreen=True):
+        return super().static_analysis(optimized_code, prescreen)
+
+    def _get_golden_digest(self):
+        # The original program's output is hashed once and stored next to the benchmark
+        makefile_path = f"{self.source_dir}/Makefile"
+        with open(makefile_path, 'rb') as file:
+            makefile = file.read()
+        fingerprint = hashlib.sha256(self.original_code.encode("utf-8") + makefile).hexdigest()
+        golden_index = GoldenIndex(f"{self.source_dir}/golden_outputs.json")
+        digest = golden_index.get("run", fingerprint)
+        if digest is not None:
+            return digest
+
+        logger.info("Computing golden output digest of the original program")
+        process = subprocess.Popen(["make", "-s", "--no-print-directory", "run"], cwd=self._get_original_workspace().path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with process.stdout:
+            digest = OutputDigest.from_stream(process.stdout)
+        if process.wait() != 0:
+            logger.error(f"Original program failed with exit code {process.returncode}, no golden output\n")
+            return None
+        golden_index.put("run", fingerprint, digest)
+        return digest
+
+    def _sample_batch(self, optimized):
+        # Called inside the measurement slot, measurements must not overlap between workers
+        records = self._run_rapl(optimized)
+        self.measurement_store.append(records)
+        return records
+
+    def _run_rapl(self, optimized):
+        # RAPL/main writes to the log given by RAPL_LOG, kept in the workspace so workers do not share it
+        workspace = self._get_workspace(optimized)
+        current_dir = workspace.path
+        workspace.remove_file("c++.csv")
+        workspace_log_path = workspace.file("c++.csv")
+        iteration = self.optimization_iteration + 1 if optimized else 0
+        if self.energy_meter is not None:
+            try:
+                samples = self.energy_meter.measure_make_target(current_dir, "measure_optimized" if optimized else "measure")
+                logger.info("Benchmark.run: in-process RAPL measurement successfully\n")
+                return make_records(self.program, samples, iteration)
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                logger.error(f"Benchmark.run: in-process RAPL measurement failed: {e}\n")
+                return make_records(self.program, [], iteration)
 
         try:
-            if (self.optimization_iteration == 0):
-                subprocess.run(["make", "measure"], check=True, capture_output=True, text=True)
+            make_args = [f"RAPL_LOG={workspace_log_path}"]
+            if self.measurement_env is not None and self.measurement_env.core is not None:
+                # RAPL/main reads the MSRs of the package the measurement is pinned to
+                make_args.append(f"RAPL_CORE={self.measurement_env.core}")
+            if not optimized:
+                subprocess.run(["make", "measure", *make_args], cwd=current_dir, check=True, capture_output=True, text=True)
             else:
-                subprocess.run(["make", "measure_optimized"], check=True, capture_output=True, text=True)
+                subprocess.run(["make", "measure_optimized", *make_args], cwd=current_dir, check=True, capture_output=True, text=True)
             logger.info("Benchmark.run: make measure successfully\n")
         except subprocess.CalledProcessError as e:
             logger.error(f"Benchmark.run: make measure failed: {e}\n")
 
-    def _compute_avg(self):
-        energy_data_file = open(f"{USER_PREFIX}/src/runtime_logs/c++.csv", "r")
-        benchmark_data = []
-        for line in energy_data_file:
-            parts = line.split(';')
-            benchmark_name = parts[0].strip()
-            energy_data = [vals.strip() for vals in parts[1].split(',')]
-            
-            #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-            energy_data = [float(num) for num in energy_data if num]
-            benchmark_data.append((benchmark_name, *energy_data))
+        if not os.path.exists(workspace_log_path):
+            # A RAPL/main built before RAPL_LOG was passed writes to the shared log instead, rebuild it with make -C RAPL
+            logger.error(f"Benchmark.run: RAPL/main did not write {workspace_log_path}, no samples recorded\n")
+            return make_records(self.program, [], iteration)
+        return read_rapl_csv(workspace_log_path, self.program, iteration)
 
-        energy_data_file.close()
-
-        #Find average energy usage and average runtime
-        avg_energy = 0
-        avg_runtime = 0
-        for data in benchmark_data:
-            if data[1] < 0 or data[2] < 0:
-                benchmark_data.remove(data)
-            else:
-                avg_energy += data[1]
-                avg_runtime += data[2]
-
-        avg_energy /= len(benchmark_data)
-        avg_runtime /= len(benchmark_data)
-
-        return avg_energy, avg_runtime
-    
     def _extract_content(self, contents):
         # Convert keys to a sorted list to access the first and last elements
         keys = list(contents.keys())
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import tempfile
+from output_compare import normalize
+
+CHUNK_SIZE = 65536
+
+class OutputHasher:
+    """Hashes normalized output incrementally: total sha256, length and one sha256 per chunk."""
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.total = hashlib.sha256()
+        self.chunk = hashlib.sha256()
+        self.chunk_fill = 0
+        self.length = 0
+        self.chunks = []
+
+    def update(self, text):
+        if not self.chunk_size:
+            self.total.update(text.encode("latin-1"))
+            self.length += len(text)
+            return
+        while text:
+            take = min(len(text), self.chunk_size - self.chunk_fill)
+            part = text[:take].encode("latin-1")
+            self.total.update(part)
+            self.chunk.update(part)
+            self.chunk_fill += take
+            self.length += take
+            text = text[take:]
+            if self.chunk_fill == self.chunk_size:
+                self.chunks.append(self.chunk.hexdigest())
+                self.chunk = hashlib.sha256()
+                self.chunk_fill = 0
+
+    def finish(self):
+        if self.chunk_fill:
+            self.chunks.append(self.chunk.hexdigest())
+            self.chunk_fill = 0
+        return OutputDigest(self.total.hexdigest(), self.length, self.chunk_size, self.chunks)
+
+class OutputDigest:
+    """
+    Golden output of a test case, with whitespace removed like output_compare.normalize.
+    Chunk hashes are optional; with them a diverging output is stopped at the first bad chunk
+    instead of at the end. source is the file holding the expected output, when there is one,
+    a failing case is compared against it again to locate the difference. It is not stored.
+    """
+    def __init__(self, sha256, length, chunk_size=CHUNK_SIZE, chunks=(), source=None):
+        self.sha256 = sha256
+        self.length = length
+        self.chunk_size = chunk_size
+        self.chunks = list(chunks)
+        self.source = source
+
+    @classmethod
+    def from_stream(cls, stream, chunk_size=CHUNK_SIZE, read_size=65536):
+        """Digest of a binary file or pipe, decoded as latin-1 like program output."""
+        hasher = OutputHasher(chunk_size)
+        read = getattr(stream, "read1", stream.read)
+        while True:
+            data = read(read_size)
+            if not data:
+                return hasher.finish()
+            hasher.update(normalize(data.decode("latin-1")))
+
+    @classmethod
+    def from_file(cls, path, chunk_size=CHUNK_SIZE):
+        with open(path, "rb") as file:
+            digest = cls.from_stream(file, chunk_size)
+        digest.source = path
+        return digest
+
+    def to_dict(self):
+        return {"sha256": self.sha256, "length": self.length, "chunk_size": self.chunk_size, "chunks": self.chunks}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["sha256"], data["length"], data.get("chunk_size"), data.get("chunks", []))
+
+    def comparator(self):
+        return DigestComparator(self)
+
+class DigestComparator:
+    """StreamingComparator counterpart that checks output against an OutputDigest."""
+    def __init__(self, digest):
+        self.digest = digest
+        self.hasher = OutputHasher(digest.chunk_size if digest.chunks else None)
+        self.checked = 0
+        self.mismatch = None
+
+    @property
+    def matched(self):
+        return self.mismatch is None
+
+    def feed(self, chunk):
+        if self.mismatch is not None:
+            return False
+        self.hasher.update(normalize(chunk))
+        if self.hasher.length > self.digest.length:
+            self.mismatch = f"output is longer than the expected {self.digest.length} characters"
+            return False
+        return self._check_chunks()
+
+    def finish(self):
+        if self.mismatch is None:
+            self.hasher.finish()
+            if self._check_chunks() and self.hasher.length != self.digest.length:
+                self.mismatch = f"output has {self.hasher.length} characters, expected {self.digest.length}"
+            elif self.mismatch is None and self.hasher.total.hexdigest() != self.digest.sha256:
+                self.mismatch = "output hash differs from the expected output"
+        return self.matched
+
+    def _check_chunks(self):
+        while self.checked < len(self.hasher.chunks):
+            index = self.checked
+            if index >= len(self.digest.chunks) or self.hasher.chunks[index] != self.digest.chunks[index]:
+                start = index * self.digest.chunk_size
+                self.mismatch = f"outputs differ in characters {start}-{start + self.digest.chunk_size} (whitespace removed)"
+                return False
+            self.checked += 1
+        return True
+
+    def diff(self):
+        return self.mismatch or ""
+
+class GoldenIndex:
+    """
+    golden_outputs.json stored next to the test cases, maps a test input name to the digest
+    of its expected output. Every entry carries a fingerprint of whatever produced the golden
+    output, a changed fingerprint means the entry is recomputed.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, name, fingerprint):
+        entry = self._load().get(name)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return None
+        return OutputDigest.from_dict(entry["digest"])
+
+    def put(self, name, fingerprint, digest):
+        # Re-read before writing so entries added concurrently by other workers are kept
+        entries = self._load()
+        entries[name] = {"fingerprint": fingerprint, "digest": digest.to_dict()}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
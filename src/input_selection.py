@@ -0,0 +1,67 @@
+import os
+import re
+import sys
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+def input_index(path):
+    # input.12.txt sorts after input.2.txt
+    match = re.search(r"input\.(\d+)\.txt$", os.path.basename(path))
+    return int(match.group(1)) if match else -1
+
+class InputSelector:
+    """
+    Chooses the test case inputs a program is measured on. The first input is often a
+    trivially small case whose energy is mostly process startup, so by default the
+    num_inputs heaviest inputs are measured instead:
+    - "size": heaviest by input file size
+    - "probe": heaviest by one timed run of the original binary per input, inputs whose
+      probe failed are ranked by size after the probed ones
+    - "first": the first num_inputs inputs, input.0.txt alone reproduces the old measurement
+    Every selected input gets a weight, "uniform" or proportional to its "cost" (size or
+    probe time), weights sum to 1 and the aggregate energy is the weighted mean.
+    """
+    def __init__(self, num_inputs=1, strategy="size", weighting="uniform"):
+        if strategy not in ("size", "probe", "first"):
+            raise ValueError(f"Unknown input selection strategy: {strategy}")
+        if weighting not in ("uniform", "cost"):
+            raise ValueError(f"Unknown input weighting: {weighting}")
+        self.num_inputs = max(1, num_inputs)
+        self.strategy = strategy
+        self.weighting = weighting
+
+    def select(self, input_files, probe=None):
+        """
+        input_files are paths of the candidate inputs, probe(path) returns the seconds of one
+        run on that input or None. Returns [(path, weight)], heaviest first.
+        """
+        input_files = sorted(input_files, key=input_index)
+        if not input_files:
+            return []
+        costs = {path: os.path.getsize(path) for path in input_files}
+        # (probed, cost), a probe time always outranks a size and failed probes go last
+        ranks = {path: (False, costs[path]) for path in input_files}
+        if self.strategy == "first":
+            selected = input_files[:self.num_inputs]
+        else:
+            if self.strategy == "probe" and probe is not None:
+                for path in input_files:
+                    seconds = probe(path)
+                    if seconds is not None:
+                        ranks[path] = (True, seconds)
+            selected = sorted(input_files, key=lambda path: ranks[path], reverse=True)[:self.num_inputs]
+            costs = {path: rank[1] for path, rank in ranks.items()}
+
+        # Cost weights need one unit, sizes and probe times are not mixed
+        comparable = len({ranks[path][0] for path in selected}) == 1
+        if self.weighting == "cost" and comparable and sum(costs[path] for path in selected) > 0:
+            total = sum(costs[path] for path in selected)
+            weights = [costs[path] / total for path in selected]
+        else:
+            weights = [1 / len(selected)] * len(selected)
+        selection = list(zip(selected, weights))
+        logger.info("InputSelector: {} of {} inputs by {}: {}".format(
+            len(selection), len(input_files), self.strategy,
+            ", ".join(f"{os.path.basename(path)} (cost {costs[path]:.4g}, weight {weight:.3f})" for path, weight in selection)))
+        return selection
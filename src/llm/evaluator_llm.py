@@ -4,6 +4,8 @@ import sys
 import os
 from pydantic import BaseModel
 import json
+from prompt_budget import PromptBudget, PromptSection, format_report
+from llm_client import LLMRequestError
 
 logger = Logger("logs", sys.argv[2]).logger
 load_dotenv()
@@ -14,7 +16,7 @@ with open(f"{USER_PREFIX}/src/llm/llm_prompts/evaluator_prompt.txt", "r") as fil
 class Feedback(BaseModel):
     feedback: str
 
-def evaluator_llm(evaluator_feedback_data, llm_assistant):
+def _evaluator_prompt(evaluator_feedback_data, prompt_budget=None):
 
     #extract original
     original_source_code = evaluator_feedback_data["original"]["source_code"]
@@ -29,33 +31,48 @@ def evaluator_llm(evaluator_feedback_data, llm_assistant):
     current_avg_energy = evaluator_feedback_data["current"]["avg_energy"]
     current_avg_runtime = evaluator_feedback_data["current"]["avg_runtime"]
 
-    prompt = evaluator_prompt + f"""
+    # Under a budget the original and lowest-energy versions are sent as diffs against the current code first
+    sections = [
+        PromptSection("instructions", evaluator_prompt, required=True),
+        PromptSection("original_code", original_source_code, priority=0, diff_base=current_source_code, diff_label="the code you are tasked to optimize",
+            prefix="""
     Here is the original code snippet:
     ```
-    {original_source_code}
+    """,
+            suffix=f"""
     ```
     Average energy usage: {original_avg_energy}
     Average run time: {original_avg_runtime}
-
+"""),
+        PromptSection("lowest_energy_code", lowest_soruce_code, priority=1, diff_base=current_source_code, diff_label="the code you are tasked to optimize",
+            prefix="""
     Here is the current code snippets with lowest energy usage:
     ```
-    {lowest_soruce_code}
+    """,
+            suffix=f"""
     ```
     Average energy usage: {lowest_avg_energy}
     Average run time: {lowest_avg_runtime}
-
+"""),
+        PromptSection("current_code", current_source_code, required=True,
+            prefix="""
     Here is the code snippiets that you are tasked to optimize:
     ```
-    {current_source_code}
+    """,
+            suffix=f"""
     ```
     Average energy usage: {current_avg_energy}
     Average run time: {current_avg_runtime}
-
+"""),
+        PromptSection("closing", """
     Please respond in natural language (English) with actionable suggestions for improving the current code's performance in terms of energy usage. Provide only the best code with the lowest energy usage.
-    """
+    """, required=True)
+    ]
+    prompt, report = (prompt_budget or PromptBudget()).assemble(sections)
+    logger.info(f"evaluator prompt: {format_report(report)}")
+    return prompt
 
-    llm_assistant.add_to_memory("user", prompt)
-    llm_assistant.generate_response(response_format=Feedback)
+def _extract_feedback(llm_assistant):
     response = llm_assistant.get_last_msg()
 
     try:
@@ -67,4 +84,17 @@ def evaluator_llm(evaluator_feedback_data, llm_assistant):
         return feedback
     except json.JSONDecodeError as e:
         logger.error(f"Failed to decode JSON: {e}")
-        return
\ No newline at end of file
+        return
+
+def evaluator_llm(evaluator_feedback_data, llm_assistant):
+    llm_assistant.add_to_memory("user", _evaluator_prompt(evaluator_feedback_data, llm_assistant.prompt_budget))
+    if llm_assistant.generate_response(response_format=Feedback) != 1:
+        raise LLMRequestError("evaluator request failed")
+    return _extract_feedback(llm_assistant)
+
+async def async_evaluator_llm(evaluator_feedback_data, llm_assistant):
+    """evaluator_llm for an AsyncLLMAgent, lets several programs' evaluator prompts be in flight together."""
+    llm_assistant.add_to_memory("user", _evaluator_prompt(evaluator_feedback_data, llm_assistant.prompt_budget))
+    if await llm_assistant.generate_response(response_format=Feedback) != 1:
+        raise LLMRequestError("evaluator request failed")
+    return _extract_feedback(llm_assistant)
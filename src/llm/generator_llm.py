@@ -1,9 +1,12 @@
+import concurrent.futures
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import sys
 from utils import Logger
 import json
 import os
+from prompt_budget import PromptBudget, PromptSection, format_report
+from llm_client import LLMRequestError
 
 logger = Logger("logs", sys.argv[2]).logger
 load_dotenv()
@@ -11,39 +14,69 @@ USER_PREFIX = os.getenv('USER_PREFIX')
 with open(f"{USER_PREFIX}/src/llm/llm_prompts/generator_prompt.txt", "r") as file:
     generator_prompt = file.read()
 
-def llm_optimize(code, llm_assistant, evaluator_feedback, ast):
-    class Strategy(BaseModel):
-        Strategy: str
-        Pros: str
-        Cons: str
+class Strategy(BaseModel):
+    Strategy: str
+    Pros: str
+    Cons: str
 
-    class OptimizationReasoning(BaseModel):
-        analysis: str
-        optimization_opportunities: str
-        strategies: list[Strategy] 
-        selected_strategy: str
-        final_code: str
+class OptimizationReasoning(BaseModel):
+    analysis: str
+    optimization_opportunities: str
+    strategies: list[Strategy] 
+    selected_strategy: str
+    final_code: str
 
+class ErrorReasoning(BaseModel):
+    analysis: str
+    final_code: str
+
+def _optimize_prompt(code, evaluator_feedback, ast, prompt_budget=None):
     if evaluator_feedback == "":
-        prompt = generator_prompt + f"Here is the code to optimize, follow the instruction to provide the optimized code WHILE STRICTLY MAINTAINING IT'S FUNCTIONAL EQUIVALENCE:\n{code}.\n" + f"Here is the AST of the source code: {ast}"
+        sections = [
+            PromptSection("instructions", generator_prompt, required=True),
+            PromptSection("code", code, required=True,
+                prefix="Here is the code to optimize, follow the instruction to provide the optimized code WHILE STRICTLY MAINTAINING IT'S FUNCTIONAL EQUIVALENCE:\n", suffix=".\n"),
+            PromptSection("ast", str(ast),
+                prefix="Here is a structural summary of the source code from its AST (functions, loops with nesting depth, allocation sites, containers and calls):\n")
+        ]
     else:
-        prompt = f"The code you generated does not improve energy efficiency, please reoptimize WHILE MAINTAINING IT'S FUNCTIONAL CORRECTNESS. Here are some feedbacks: {evaluator_feedback}.\n Original code to optimize:\n {code}"
-    
-    logger.info(f"llm_optimize: Generator LLM Optimizing ....")
-    logger.info(f"prompt: {prompt}")
-    
-    llm_assistant.add_to_memory("user", prompt)
-    llm_assistant.generate_response(OptimizationReasoning)
+        sections = [
+            PromptSection("feedback", evaluator_feedback, required=True,
+                prefix="The code you generated does not improve energy efficiency, please reoptimize WHILE MAINTAINING IT'S FUNCTIONAL CORRECTNESS. Here are some feedbacks: ", suffix=".\n"),
+            PromptSection("code", code, required=True, prefix=" Original code to optimize:\n ")
+        ]
+    prompt, report = (prompt_budget or PromptBudget()).assemble(sections)
+    logger.info(f"generator prompt: {format_report(report)}")
+    return prompt
+
+def _compilation_error_prompt(error_message):
+    return f"""The code you returned failed to compile with the following error message: {error_message}. 
+        Analyze the error message and explicitly identify the issue in the code that caused the compilation error. 
+        Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy.
+        Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """
+
+def _alternative_strategy_prompt(strategy):
+    return f"Now implement this other strategy instead of the selected one: {strategy}. Follow the same instructions and provide the optimized code WHILE STRICTLY MAINTAINING IT'S FUNCTIONAL EQUIVALENCE."
+
+def _extract_alternative_strategies(llm_assistant):
+    """Strategies of the last OptimizationReasoning response that were not selected."""
+    try:
+        reasoning = OptimizationReasoning.model_validate_json(llm_assistant.get_last_msg()["content"])
+    except ValueError as e:
+        logger.error(f"Failed to parse strategies: {e}")
+        return []
+    return [strategy.Strategy for strategy in reasoning.strategies if strategy.Strategy != reasoning.selected_strategy]
 
+def _extract_final_code(llm_assistant, response_format):
     response = llm_assistant.get_last_msg()
     logger.info(response)
-    
+
     try:
         if (llm_assistant.is_openai_model()):
             content_dict = json.loads(response["content"])
             final_code = content_dict["final_code"]
         else:
-            final_code = OptimizationReasoning.model_validate_json(response["content"]).final_code
+            final_code = response_format.model_validate_json(response["content"]).final_code
     except json.JSONDecodeError as e:
         logger.error(f"Failed to decode JSON: {e}")
         return
@@ -54,33 +87,77 @@ def llm_optimize(code, llm_assistant, evaluator_feedback, ast):
     
     return final_code
 
-def handle_compilation_error(error_message, llm_assistant):
-    class ErrorReasoning(BaseModel):
-        analysis: str
-        final_code: str
-        
-    compilation_error_prompt = f"""The code you returned failed to compile with the following error message: {error_message}. 
-        Analyze the error message and explicitly identify the issue in the code that caused the compilation error. 
-        Then, consider if there's a need to use a different optimization strategy to compile successfully or if there are code changes which can fix this implementation strategy.
-        Finally, update the code accordingly and ensure it compiles successfully. Ensure that the optimized code is both efficient and error-free and return it. """   
-        
-    llm_assistant.add_to_memory("user", compilation_error_prompt)
-    llm_assistant.generate_response(ErrorReasoning)
-    response = llm_assistant.get_last_msg()
+def _final_code_listener(on_code):
+    """on_field callback of a streamed reply, passes final_code to on_code as soon as it is complete."""
+    if on_code is None:
+        return None
+    def on_field(key, value):
+        if key == "final_code" and value:
+            on_code(value)
+    return on_field
 
-    try:
-        if (llm_assistant.is_openai_model()):
-            content_dict = json.loads(response["content"])
-            final_code = content_dict["final_code"]
-        else:
-            final_code = ErrorReasoning.model_validate_json(response["content"])["final_code"]
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to decode JSON: {e}")
-        return
-        
-    if final_code == "":
-        logger.error("Error in llm completion")
-        return
+def llm_optimize(code, llm_assistant, evaluator_feedback, ast, on_code=None):
+    prompt = _optimize_prompt(code, evaluator_feedback, ast, llm_assistant.prompt_budget)
+    
+    logger.info(f"llm_optimize: Generator LLM Optimizing ....")
+    logger.info(f"prompt: {prompt}")
+    
+    llm_assistant.add_to_memory("user", prompt)
+    if llm_assistant.generate_response(OptimizationReasoning, on_field=_final_code_listener(on_code)) != 1:
+        raise LLMRequestError("generator request failed")
+
+    return _extract_final_code(llm_assistant, OptimizationReasoning)
+
+def llm_optimize_candidates(code, llm_assistant, evaluator_feedback, ast, num_candidates):
+    """
+    Speculative llm_optimize. After the regular request, up to num_candidates - 1 strategies the
+    generator proposed but did not select are implemented in parallel, each in a fork of the conversation.
+    Returns a list of (final_code, memory) pairs, the selected strategy first.
+    """
+    final_code = llm_optimize(code, llm_assistant, evaluator_feedback, ast)
+    candidates = [(final_code, llm_assistant.get_memory())]
+    strategies = _extract_alternative_strategies(llm_assistant)[:num_candidates - 1] if final_code is not None else []
+    if not strategies:
+        return candidates
+
+    def implement(strategy):
+        fork = llm_assistant.fork()
+        fork.add_to_memory("user", _alternative_strategy_prompt(strategy))
+        if fork.generate_response(OptimizationReasoning) != 1:
+            # Alternatives are optional, the selected strategy's candidate is still evaluated
+            return None, fork.get_memory()
+        return _extract_final_code(fork, OptimizationReasoning), fork.get_memory()
+
+    logger.info(f"llm_optimize_candidates: implementing {len(strategies)} alternative strategies")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(strategies)) as executor:
+        for final_code, memory in executor.map(implement, strategies):
+            if final_code is not None:
+                candidates.append((final_code, memory))
+    return candidates
+
+async def async_llm_optimize(code, llm_assistant, evaluator_feedback, ast):
+    """llm_optimize for an AsyncLLMAgent, lets several programs' generator prompts be in flight together."""
+    prompt = _optimize_prompt(code, evaluator_feedback, ast, llm_assistant.prompt_budget)
+
+    logger.info(f"async_llm_optimize: Generator LLM Optimizing ....")
+    logger.info(f"prompt: {prompt}")
+
+    llm_assistant.add_to_memory("user", prompt)
+    if await llm_assistant.generate_response(OptimizationReasoning) != 1:
+        raise LLMRequestError("generator request failed")
+
+    return _extract_final_code(llm_assistant, OptimizationReasoning)
+
+def handle_compilation_error(error_message, llm_assistant, on_code=None):
+    llm_assistant.add_to_memory("user", _compilation_error_prompt(error_message))
+    if llm_assistant.generate_response(ErrorReasoning, on_field=_final_code_listener(on_code)) != 1:
+        raise LLMRequestError("generator request failed")
+
+    return _extract_final_code(llm_assistant, ErrorReasoning)
 
-    return final_code 
+async def async_handle_compilation_error(error_message, llm_assistant):
+    llm_assistant.add_to_memory("user", _compilation_error_prompt(error_message))
+    if await llm_assistant.generate_response(ErrorReasoning) != 1:
+        raise LLMRequestError("generator request failed")
 
+    return _extract_final_code(llm_assistant, ErrorReasoning)
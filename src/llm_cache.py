@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+class LLMResponseCache:
+    """
+    Persistent, content-addressed cache of LLM completions.
+    An entry is keyed on the model, the full conversation memory and the JSON schema of the
+    pydantic response_format, and stored as <cache_dir>/<sha256>.json. In replay mode the
+    cache is the only source of responses, so a whole run can be reproduced offline.
+    """
+    def __init__(self, cache_dir, max_size_bytes=1024 * 1024 * 1024, max_age_seconds=30 * 24 * 3600, replay=False):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, model, memory, response_format):
+        payload = {
+            "model": model,
+            "memory": memory,
+            "schema": response_format.model_json_schema()
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _is_expired(self, path, now):
+        # Replayed runs must see every recorded response regardless of age
+        if self.replay or self.max_age_seconds is None:
+            return False
+        return now - os.path.getmtime(path) > self.max_age_seconds
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            if self._is_expired(path, time.time()):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "r") as file:
+                entry = json.load(file)
+            # Refresh the mtime so size-based eviction drops least recently used entries first,
+            # an entry another worker evicted in between is a miss
+            os.utime(path, None)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["content"]
+
+    def put(self, key, model, content):
+        if self.replay:
+            return
+        entry = {"model": model, "created": time.time(), "content": content}
+        # Write to a temporary file first so concurrent workers never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, self._entry_path(key))
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if self._is_expired(path, now):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        if self.max_size_bytes is None or total_size <= self.max_size_bytes:
+            return
+        for mtime, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            if total_size <= self.max_size_bytes:
+                break
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
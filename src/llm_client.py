@@ -0,0 +1,216 @@
+import asyncio
+import email.utils
+import multiprocessing
+import random
+import re
+import sys
+import time
+import httpx
+import openai
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+RETRY_STATUS = {408, 409, 429}
+DURATION = re.compile(r"([\d.]+)(ms|h|m|s)")
+
+# Token bucket shared by every agent of the process, see set_token_bucket
+_token_bucket = None
+
+class LLMRequestError(Exception):
+    """An LLM request failed with a non retryable error, or every retry failed."""
+
+class RetryPolicy:
+    """
+    Per-request timeout and exponential backoff with full jitter for LLM requests.
+    A Retry-After header from the provider overrides the computed delay.
+    """
+    def __init__(self, max_retries=5, timeout=120, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class TokenBucket:
+    """
+    Client-side limit on the tokens sent to the provider, refilled continuously at tokens_per_minute.
+    The state lives in shared memory, so a bucket set before the scheduler forks its workers
+    is shared by every agent of every worker. Requests are charged their estimated size up
+    front and settled with the usage reported in the response.
+    """
+    def __init__(self, tokens_per_minute, capacity=None):
+        self.rate = tokens_per_minute / 60
+        self.capacity = capacity or tokens_per_minute
+        self.lock = multiprocessing.Lock()
+        # tokens available, time of the last refill, time before which nothing is granted
+        self.state = multiprocessing.RawArray("d", [self.capacity, time.monotonic(), 0.0])
+
+    def _refill(self, now):
+        self.state[0] = min(self.capacity, self.state[0] + (now - self.state[1]) * self.rate)
+        self.state[1] = now
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                paused = self.state[2] - now
+                if paused <= 0 and self.state[0] >= tokens:
+                    self.state[0] -= tokens
+                    return
+                wait = max(paused, (tokens - self.state[0]) / self.rate)
+            time.sleep(min(wait, 5))
+
+    def settle(self, tokens):
+        """Charge (or refund, when negative) the difference between the actual and the estimated usage."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.state[0] = max(-self.capacity, min(self.capacity, self.state[0] - tokens))
+
+    def pause(self, seconds):
+        with self.lock:
+            self.state[2] = max(self.state[2], time.monotonic() + seconds)
+
+    def sync(self, remaining, reset_seconds):
+        """Align the bucket with the provider's x-ratelimit-remaining-tokens / x-ratelimit-reset-tokens."""
+        with self.lock:
+            self._refill(time.monotonic())
+            if remaining is not None:
+                self.state[0] = min(self.state[0], remaining)
+        if remaining == 0 and reset_seconds:
+            self.pause(reset_seconds)
+
+def set_token_bucket(token_bucket):
+    global _token_bucket
+    _token_bucket = token_bucket
+
+def get_token_bucket():
+    return _token_bucket
+
+def parse_duration(value):
+    """Seconds in a rate-limit header value such as "20ms", "1.5s" or "6m0s"."""
+    if value is None:
+        return None
+    parts = DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+def retry_after(headers):
+    if not headers:
+        return None
+    if headers.get("retry-after-ms") is not None:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            # Retry-After may also be an HTTP date
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def _status_code(error):
+    status = getattr(error, "status_code", None)
+    # ollama.ResponseError uses -1 when there was no HTTP status
+    return status if isinstance(status, int) and status >= 0 else None
+
+def _error_headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None)
+
+def is_retryable(error):
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRY_STATUS or status >= 500
+    # Timeouts and dropped connections, from the openai client or from httpx under ollama
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, TimeoutError, ConnectionError))
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return usage.prompt_tokens + usage.completion_tokens
+    prompt_tokens, completion_tokens = getattr(response, "prompt_eval_count", None), getattr(response, "eval_count", None)
+    if prompt_tokens is None or completion_tokens is None:
+        return None
+    return prompt_tokens + completion_tokens
+
+def _sync_bucket(token_bucket, response, headers, charged):
+    if token_bucket is None:
+        return
+    used = _usage_tokens(response)
+    if used is not None:
+        token_bucket.settle(used - charged)
+    if headers:
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        token_bucket.sync(int(remaining) if remaining is not None and remaining.isdigit() else None,
+                          parse_duration(headers.get("x-ratelimit-reset-tokens")))
+
+def _retry_delay(error, attempt, retry_policy, token_bucket):
+    """Seconds to wait before the next attempt, raises LLMRequestError when the error is final."""
+    if not is_retryable(error) or attempt == retry_policy.max_retries:
+        raise LLMRequestError(f"{type(error).__name__}: {error}") from error
+    headers = _error_headers(error)
+    delay = retry_after(headers)
+    if delay is None and _status_code(error) == 429 and headers:
+        # Without Retry-After, wait for the limit that was hit to reset
+        delay = parse_duration(headers.get("x-ratelimit-reset-tokens") or headers.get("x-ratelimit-reset-requests"))
+    wait = retry_policy.delay(attempt, delay)
+    if _status_code(error) == 429 and token_bucket is not None:
+        # Hold back the other agents too, they share the same provider limit
+        token_bucket.pause(wait)
+    logger.warning(f"LLM request failed ({type(error).__name__}: {error}), retry {attempt + 1}/{retry_policy.max_retries} in {wait:.1f}s")
+    return wait
+
+def call_with_retries(request, retry_policy, estimated_tokens):
+    """
+    Runs request(), which makes one attempt and returns (response, content, headers), until it
+    succeeds. Waits on the shared token bucket before every attempt and retries timeouts,
+    connection errors, 429 and 5xx responses. Returns (response, content).
+    """
+    token_bucket = get_token_bucket()
+    for attempt in range(retry_policy.max_retries + 1):
+        if token_bucket is not None:
+            token_bucket.acquire(estimated_tokens)
+        try:
+            response, content, headers = request()
+        except Exception as e:
+            if token_bucket is not None:
+                token_bucket.settle(-estimated_tokens)
+            time.sleep(_retry_delay(e, attempt, retry_policy, token_bucket))
+            continue
+        _sync_bucket(token_bucket, response, headers, estimated_tokens)
+        return response, content
+
+async def async_call_with_retries(request, retry_policy, estimated_tokens):
+    """call_with_retries for a coroutine request, waits without blocking the event loop."""
+    token_bucket = get_token_bucket()
+    for attempt in range(retry_policy.max_retries + 1):
+        if token_bucket is not None:
+            await asyncio.to_thread(token_bucket.acquire, estimated_tokens)
+        try:
+            response, content, headers = await request()
+        except Exception as e:
+            if token_bucket is not None:
+                token_bucket.settle(-estimated_tokens)
+            await asyncio.sleep(_retry_delay(e, attempt, retry_policy, token_bucket))
+            continue
+        _sync_bucket(token_bucket, response, headers, estimated_tokens)
+        return response, content
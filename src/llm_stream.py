@@ -0,0 +1,127 @@
+import json
+import time
+from memory_policy import count_tokens
+
+WHITESPACE = " \t\r\n"
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON object as it streams in and reports each top-level field as soon as its
+    value is complete, without waiting for the rest of the object. A string value is
+    complete at its closing quote, which lets final_code be used before the reply ends.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.key = None
+        self.expecting_key = False
+        self.token_start = None
+        self.value_start = None
+
+    def feed(self, text):
+        """Returns the (key, value) pairs completed by this chunk."""
+        self.buffer += text
+        completed = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self._end_top_level_string(completed)
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.token_start = self.position
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    self.expecting_key = True
+                elif self.depth == 2 and self.key is not None and self.value_start is None:
+                    self.value_start = self.position
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.value_start is not None:
+                    self._complete(self.position + 1, completed)
+                elif self.depth == 0:
+                    self._end_scalar(self.position, completed)
+            elif self.depth == 1:
+                if char == ":":
+                    self.value_start = None
+                elif char == ",":
+                    self._end_scalar(self.position, completed)
+                    self.expecting_key = True
+                elif char not in WHITESPACE and self.key is not None and self.value_start is None:
+                    # Start of a number, true, false or null
+                    self.value_start = self.position
+            self.position += 1
+        return completed
+
+    def _end_top_level_string(self, completed):
+        token = json.loads(self.buffer[self.token_start:self.position + 1])
+        if self.expecting_key:
+            self.key = token
+            self.expecting_key = False
+        elif self.key is not None:
+            self.value_start = self.token_start
+            self._complete(self.position + 1, completed)
+
+    def _end_scalar(self, end, completed):
+        if self.key is not None and self.value_start is not None:
+            self._complete(end, completed)
+
+    def _complete(self, end, completed):
+        try:
+            value = json.loads(self.buffer[self.value_start:end])
+        except ValueError:
+            value = None
+        if value is not None or self.buffer[self.value_start:end].strip() == "null":
+            completed.append((self.key, value))
+        self.key = None
+        self.value_start = None
+
+class StreamCollector:
+    """
+    Accumulates the content deltas of a streamed reply, feeds them to an IncrementalJSONParser
+    and times the stream. on_field(key, value) is called for every completed top-level field.
+    """
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.parser = IncrementalJSONParser()
+        self.parts = []
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.end = None
+
+    def add(self, delta):
+        if not delta:
+            return
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.parts.append(delta)
+        for key, value in self.parser.feed(delta):
+            if self.on_field is not None:
+                self.on_field(key, value)
+
+    def finish(self):
+        self.end = time.perf_counter()
+        return "".join(self.parts)
+
+    def metrics(self, completion_tokens=None):
+        """Time to first token in seconds and completion tokens per second after the first token."""
+        if self.first_token is None:
+            return {"time_to_first_token": None, "tokens_per_second": None}
+        if completion_tokens is None:
+            completion_tokens = count_tokens("".join(self.parts))
+        generation_time = (self.end or time.perf_counter()) - self.first_token
+        return {
+            "time_to_first_token": self.first_token - self.start,
+            "tokens_per_second": completion_tokens / generation_time if generation_time > 0 else None
+        }
@@ -4,12 +4,28 @@ import os
 import sys
 from utils import Logger
 import argparse
-from agent import LLMAgent
+from agent import LLMAgent, OPENAI_MODELS
 from status import Status
-from llm.generator_llm import llm_optimize, handle_compilation_error
+from llm.generator_llm import llm_optimize, llm_optimize_candidates, handle_compilation_error
 from llm.evaluator_llm import evaluator_llm
 from energy_language_benchmark import get_valid_energy_language_programs, EnergyLanguageBenchmark
 from pie_benchmark import get_valid_pie_programs, PIEBenchmark
+from scheduler import ProgramScheduler, get_llm_limiter, get_measurement_slot, get_build_slot
+from llm_cache import LLMResponseCache
+from binary_cache import BinaryCache
+from measurement_cache import MeasurementCache
+from rapl_reader import EnergyMeter, create_backend
+from measurement_stats import AdaptiveSampler
+from calibration import StartupCalibration
+from measurement_env import MeasurementEnvironment, set_measurement_environment, get_measurement_environment
+from test_runner import TestCaseRunner
+from prescreen import PreScreen
+from input_selection import InputSelector
+from memory_policy import MemoryPolicy
+from prompt_budget import PromptBudget
+from llm_client import RetryPolicy, TokenBucket, LLMRequestError, set_token_bucket
+from batch_llm import BatchCoordinator, OpenAIBatchBackend, LocalFileBatchBackend, set_batch_coordinator
+from openai import OpenAI
 
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
@@ -22,130 +38,342 @@ def parse_arguments():
     parser.add_argument("--llm", type=str, default="gpt-4o", choices=["gpt-4o", "o1", "o3-mini", "deepseek-r1:671b","deepseek-r1:70b", "qwen2.5-coder:32b", "llama3.3:70b", "codellama:70b"], help="llm used for inference")
     parser.add_argument("--self_optimization_step", type=int, default=5, help="number of LLM self-optimization step")
     parser.add_argument("--num_programs", type=int, default=5, help="number of programs from the benchmark to test")
+    parser.add_argument("--num_workers", type=int, default=None, help="number of programs optimized in parallel (default: number of cores minus the measurement core)")
+    parser.add_argument("--llm_concurrency", type=int, default=None, help="maximum number of LLM requests in flight across all workers")
+    parser.add_argument("--measurement_core", type=int, default=0, help="core reserved for serialized energy measurements")
+    parser.add_argument("--governor", type=str, default=None, help="cpufreq governor of the measurement core during the run, e.g. performance (needs root)")
+    parser.add_argument("--disable_turbo", action="store_true", help="disable turbo boost during the run (needs root)")
+    parser.add_argument("--max_background_load", type=float, default=None, help="busy cores outside the measurement tolerated before and during a trial, noisier trials wait or are rejected (default: no check)")
+    parser.add_argument("--background_load_wait", type=float, default=5, help="seconds a trial waits for the background load to drop")
+    parser.add_argument("--llm_cache", action="store_true", help="cache LLM responses on disk and reuse them for identical requests")
+    parser.add_argument("--llm_cache_dir", type=str, default=None, help="directory of the LLM response cache (default: USER_PREFIX/llm_cache)")
+    parser.add_argument("--llm_cache_max_size_mb", type=int, default=1024, help="evict least recently used LLM cache entries above this size")
+    parser.add_argument("--llm_cache_max_age_days", type=float, default=30, help="evict LLM cache entries older than this")
+    parser.add_argument("--no_binary_cache", action="store_true", help="always recompile instead of reusing binaries of previously compiled code")
+    parser.add_argument("--binary_cache_dir", type=str, default=None, help="directory of the compiled binary cache (default: USER_PREFIX/binary_cache)")
+    parser.add_argument("--no_measurement_cache", action="store_true", help="always re-measure instead of reusing stored energy measurements")
+    parser.add_argument("--refresh_measurements", action="store_true", help="re-measure every binary and overwrite stored measurements")
+    parser.add_argument("--measurement_max_age_days", type=float, default=7, help="stored measurements older than this are re-measured")
+    parser.add_argument("--rapl_backend", type=str, default="make", choices=["make", "powercap", "msr", "fake"], help="measure through make/RAPL/main or read RAPL counters in-process (powercap sysfs, MSR, or a fake sysfs for machines without RAPL)")
+    parser.add_argument("--adaptive_trials", action="store_true", help="repeat measurements until the 95%% confidence interval of energy and runtime is narrow enough")
+    parser.add_argument("--target_rel_ci", type=float, default=0.05, help="relative confidence interval width at which adaptive measurement stops")
+    parser.add_argument("--min_trials", type=int, default=3, help="minimum number of adaptive measurement trials")
+    parser.add_argument("--max_trials", type=int, default=30, help="maximum number of adaptive measurement trials")
+    parser.add_argument("--warmup_trials", type=int, default=1, help="measurement batches discarded before adaptive sampling")
+    parser.add_argument("--calibrate_startup", action="store_true", help="measure no-op and idle programs through the same launch path and report energy and runtime net of the startup overhead, raw values are kept")
+    parser.add_argument("--calibration_idle_ms", type=int, default=200, help="sleep of the idle calibration program the idle package power is derived from")
+    parser.add_argument("--workspace_dir", type=str, default=None, help="directory for per-run build workspaces (default: system temp directory)")
+    parser.add_argument("--test_workers", type=int, default=None, help="number of test cases run in parallel (default: number of cores)")
+    parser.add_argument("--test_timeout", type=float, default=10, help="seconds before a single test case run is killed and counted as failed")
+    parser.add_argument("--num_candidates", type=int, default=1, help="candidates generated per optimization step from the generator's alternative strategies, compiled and tested concurrently")
+    parser.add_argument("--prescreen", action="store_true", help="reject candidates whose single timing run is clearly worse than the best version so far before measuring them")
+    parser.add_argument("--prescreen_margin", type=float, default=0.2, help="relative slowdown over the best version tolerated by the pre-screen")
+    parser.add_argument("--prescreen_metric", type=str, default="time", choices=["time", "instructions"], help="pre-screen on wall time or on instructions retired (needs perf)")
+    parser.add_argument("--memory_max_tokens", type=int, default=None, help="token budget of each LLM conversation, older turns are compacted and summarized above it (default: unbounded)")
+    parser.add_argument("--prompt_max_tokens", type=int, default=None, help="token budget of each generator and evaluator prompt, older code versions are sent as diffs, then truncated or dropped above it (default: unbounded)")
+    parser.add_argument("--llm_timeout", type=float, default=120, help="seconds before a single LLM request attempt is abandoned")
+    parser.add_argument("--llm_max_retries", type=int, default=5, help="retries of an LLM request on timeouts, connection errors, 429 and 5xx responses, with exponential backoff")
+    parser.add_argument("--llm_tokens_per_minute", type=int, default=None, help="client-side token rate limit shared by every LLM agent of the run (default: unlimited)")
+    parser.add_argument("--stream", action="store_true", help="stream LLM replies, compile final_code as soon as it is complete and record time to first token and tokens/s")
+    parser.add_argument("--batch_backend", type=str, default=None, choices=["openai", "local"], help="advance all programs in rounds and submit each round's LLM requests as one batch job (local: file-based stand-in in --batch_dir)")
+    parser.add_argument("--batch_dir", type=str, default=None, help="directory of the local batch backend's job files (default: USER_PREFIX/batch_jobs)")
+    parser.add_argument("--batch_poll_interval", type=float, default=30, help="seconds between polls of a submitted batch job")
+    parser.add_argument("--pie_seed", type=int, default=None, help="sample PIE problems reproducibly with this seed instead of taking the first ones")
+    parser.add_argument("--pie_min_src_lines", type=int, default=None, help="only select PIE problems whose slow source has at least this many lines")
+    parser.add_argument("--pie_max_src_lines", type=int, default=None, help="only select PIE problems whose slow source has at most this many lines")
+    parser.add_argument("--pie_min_test_cases", type=int, default=None, help="only select PIE problems with at least this many test cases")
+    parser.add_argument("--pie_inputs", type=int, default=1, help="number of PIE test case inputs energy is measured on, reported per input and as their weighted mean")
+    parser.add_argument("--pie_input_selection", type=str, default="size", choices=["size", "probe", "first"], help="measure the heaviest inputs by file size or by a timed probe run of the original code, or the first ones (first with --pie_inputs 1: input.0.txt only)")
+    parser.add_argument("--pie_input_weighting", type=str, default="uniform", choices=["uniform", "cost"], help="weight inputs equally or by their size or probe time in the aggregate energy")
+    parser.add_argument("--replay", action="store_true", help="reproduce a run offline, serving every LLM response from the cache")
 
     args = parser.parse_args()
     return args
 
-def get_valid_programs(benchmark, num_programs):
+def get_valid_programs(benchmark, num_programs, options=None):
+    options = options or {}
     if (benchmark == "EnergyLanguage"):
         return get_valid_energy_language_programs()
     elif (benchmark == "PIE"):
-        return get_valid_pie_programs(num_programs)
+        return get_valid_pie_programs(
+            num_programs,
+            seed=options.get("pie_seed"),
+            min_src_lines=options.get("pie_min_src_lines"),
+            max_src_lines=options.get("pie_max_src_lines"),
+            min_test_cases=options.get("pie_min_test_cases")
+        )
     return []
 
-def master_script(benchmark, num_programs, model, self_optimization_step):
+def create_response_cache(options):
+    if not (options.get("llm_cache") or options.get("replay")):
+        return None
+    cache_dir = options.get("llm_cache_dir") or f"{USER_PREFIX}/llm_cache"
+    return LLMResponseCache(
+        cache_dir,
+        max_size_bytes=options.get("llm_cache_max_size_mb", 1024) * 1024 * 1024,
+        max_age_seconds=options.get("llm_cache_max_age_days", 30) * 24 * 3600,
+        replay=options.get("replay", False)
+    )
+
+def create_batch_backend(options):
+    if options["batch_backend"] == "openai":
+        return OpenAIBatchBackend(OpenAI(api_key=openai_key))
+    return LocalFileBatchBackend(options.get("batch_dir") or f"{USER_PREFIX}/batch_jobs")
+
+def optimize_program(program, benchmark, model, self_optimization_step, results_dir, options):
     #create LLM agent
-    generator = LLMAgent(api_key=openai_key, model=model, system_message="You are a code expert. Think through the code optimizations strategies possible step by step.")
-    evaluator = LLMAgent(api_key=openai_key, model=model, system_message="You are a code expert. Think through the code optimizations strategies possible step by step.")
+    response_cache = create_response_cache(options)
+    retry_policy = RetryPolicy(max_retries=options.get("llm_max_retries", 5), timeout=options.get("llm_timeout", 120))
+    generator = LLMAgent(api_key=openai_key, model=model, system_message="You are a code expert. Think through the code optimizations strategies possible step by step.", response_cache=response_cache, retry_policy=retry_policy)
+    evaluator = LLMAgent(api_key=openai_key, model=model, system_message="You are a code expert. Think through the code optimizations strategies possible step by step.", response_cache=response_cache, retry_policy=retry_policy)
+    generator.set_request_limiter(get_llm_limiter())
+    evaluator.set_request_limiter(get_llm_limiter())
+    if options.get("memory_max_tokens"):
+        generator.set_memory_policy(MemoryPolicy(max_tokens=options["memory_max_tokens"]))
+        evaluator.set_memory_policy(MemoryPolicy(max_tokens=options["memory_max_tokens"]))
+    if options.get("stream"):
+        generator.set_streaming(True)
+        evaluator.set_streaming(True)
+    if options.get("prompt_max_tokens"):
+        generator.set_prompt_budget(PromptBudget(max_tokens=options["prompt_max_tokens"]))
+        evaluator.set_prompt_budget(PromptBudget(max_tokens=options["prompt_max_tokens"]))
+
+    benchmark_obj = EnergyLanguageBenchmark(program) if benchmark == "EnergyLanguage" else PIEBenchmark(program)
+    benchmark_obj.set_measurement_slot(get_measurement_slot())
+    benchmark_obj.set_build_slot(get_build_slot())
+    measurement_env = get_measurement_environment()
+    if not options.get("no_binary_cache"):
+        benchmark_obj.set_binary_cache(BinaryCache(options.get("binary_cache_dir") or f"{USER_PREFIX}/binary_cache"))
+    if options.get("rapl_backend", "make") != "make":
+        # Adaptive sampling decides after every single trial, make measure always runs 5
+        trials = 1 if options.get("adaptive_trials") else 5
+        # MSRs are read on the measurement core, package counters belong to the package it is on
+        core = measurement_env.core if measurement_env is not None and measurement_env.core is not None else 0
+        benchmark_obj.set_energy_meter(EnergyMeter(create_backend(options["rapl_backend"], core), trials=trials))
+    benchmark_obj.set_measurement_environment(measurement_env)
+    if options.get("adaptive_trials"):
+        benchmark_obj.set_adaptive_sampler(AdaptiveSampler(
+            target_rel_ci=options.get("target_rel_ci", 0.05),
+            min_trials=options.get("min_trials", 3),
+            max_trials=options.get("max_trials", 30),
+            warmup=options.get("warmup_trials", 1)
+        ))
+    if options.get("calibrate_startup"):
+        benchmark_obj.set_calibration(StartupCalibration(idle_ms=options.get("calibration_idle_ms", 200)))
+    if not options.get("no_measurement_cache"):
+        benchmark_obj.set_measurement_cache(MeasurementCache(
+            f"{USER_PREFIX}/measurement_cache/measurements.db",
+            rapl_binary=f"{USER_PREFIX}/RAPL/main",
+            max_age_seconds=options.get("measurement_max_age_days", 7) * 24 * 3600,
+            refresh=options.get("refresh_measurements", False)
+        ))
+    benchmark_obj.set_workspace_root(options.get("workspace_dir"))
+    if options.get("prescreen"):
+        benchmark_obj.set_prescreen(PreScreen(margin=options.get("prescreen_margin", 0.2), metric=options.get("prescreen_metric", "time")))
+    if benchmark == "PIE":
+        benchmark_obj.set_input_selector(InputSelector(
+            num_inputs=options.get("pie_inputs", 1),
+            strategy=options.get("pie_input_selection", "size"),
+            weighting=options.get("pie_input_weighting", "uniform")
+        ))
+    benchmark_obj.set_test_runner(TestCaseRunner(max_workers=options.get("test_workers"), timeout=options.get("test_timeout", 10)))
+
+    # Workspaces hold every build and log of this program, remove them however the loop ends
+    try:
+        return run_optimization_loop(program, benchmark_obj, generator, evaluator, self_optimization_step, results_dir, options.get("num_candidates", 1))
+    except LLMRequestError as e:
+        # Every retry already failed, further iterations would only compile empty code
+        logger.error(f"LLM requests failed for {program}: {e}")
+        return f"LLM requests failed: {e}"
+    finally:
+        benchmark_obj.cleanup()
+
+def generate_candidates(code, generator, evaluator_feedback, ast, num_candidates, on_code=None):
+    """Returns (final_code, memory) pairs, a single one with memory None when speculation is off."""
+    if num_candidates > 1:
+        return llm_optimize_candidates(code=code, llm_assistant=generator, evaluator_feedback=evaluator_feedback, ast=ast, num_candidates=num_candidates)
+    return [(llm_optimize(code=code, llm_assistant=generator, evaluator_feedback=evaluator_feedback, ast=ast, on_code=on_code), None)]
 
-    results = {}
+def run_optimization_loop(program, benchmark_obj, generator, evaluator, self_optimization_step, results_dir, num_candidates=1):
+    original_code_compiles = benchmark_obj.set_original_energy()
+    if not original_code_compiles:
+        logger.error(f"Unable to compile or measure original code for {program}")
+        return "Unable to compile or measure original code"
     
-    for program in get_valid_programs(benchmark, num_programs):     
-        benchmark_obj = EnergyLanguageBenchmark(program) if benchmark == "EnergyLanguage" else PIEBenchmark(program)
-        original_code_compiles = benchmark_obj.set_original_energy()
-        if not original_code_compiles:
-            logger.error(f"Unable to compile original code for {program}")
-            results[program] = "Unable to compile original code"
-            continue
-        
-        compilation_errors = 0
-        reoptimize_lastly_flag = 0
-        evaluator_feedback = ""
-        original_code = benchmark_obj.get_original_code()
-        last_working_optimized_code = original_code
-        last_optimized_code = original_code
-        num_success_iteration = 0
-        total_output_difference = 0
-        
-        while True:
-            if total_output_difference == 3:
-                logger.error("Unable to produce functional equivalent programs.")
-                results[program] = "Unable to produce functional equivalent programs."
-                break
-            # optimize code
-            if reoptimize_lastly_flag == 0:
-                logger.info(f"Optimizing {program}, iteration {num_success_iteration}")
-                if compilation_errors > 0 and compilation_errors < 3:
-                    compilation_error_message = benchmark_obj.get_compilation_error()
-                    last_optimized_code = handle_compilation_error(error_message=compilation_error_message, llm_assistant=generator)
-                else:
-                    ast = benchmark_obj.pre_process(last_optimized_code)
-                    last_optimized_code = llm_optimize(code=last_optimized_code, llm_assistant=generator, evaluator_feedback=evaluator_feedback, ast=ast)
+    compilation_errors = 0
+    reoptimize_lastly_flag = 0
+    evaluator_feedback = ""
+    original_code = benchmark_obj.get_original_code()
+    last_working_optimized_code = original_code
+    last_optimized_code = original_code
+    num_success_iteration = 0
+    total_output_difference = 0
+    prescreen_rejections = 0
+    measurement_failures = 0
+    # A streamed reply starts compiling as soon as its final_code is complete, speculative candidates are compiled together later
+    on_code = benchmark_obj.start_compile if generator.streaming and num_candidates == 1 else None
+    
+    while True:
+        if total_output_difference == 3:
+            logger.error("Unable to produce functional equivalent programs.")
+            return "Unable to produce functional equivalent programs."
+        if measurement_failures == 3:
+            logger.error("Unable to measure the optimized programs.")
+            return "Unable to measure the optimized programs."
+        # optimize code
+        candidates = None
+        if reoptimize_lastly_flag == 0:
+            logger.info(f"Optimizing {program}, iteration {num_success_iteration}")
+            if compilation_errors > 0 and compilation_errors < 3:
+                compilation_error_message = benchmark_obj.get_compilation_error()
+                last_optimized_code = handle_compilation_error(error_message=compilation_error_message, llm_assistant=generator, on_code=on_code)
             else:
-                logger.info("re-optimizing from latest working optimization")
-                generator.clear_memory()
-                evaluator_feedback = ""
-                ast = benchmark_obj.pre_process(last_working_optimized_code)
-                last_optimized_code = llm_optimize(code=last_working_optimized_code, llm_assistant=generator, evaluator_feedback=evaluator_feedback, ast=ast)
-                reoptimize_lastly_flag = 0
-            
+                ast = benchmark_obj.pre_process(last_optimized_code)
+                candidates = generate_candidates(last_optimized_code, generator, evaluator_feedback, ast, num_candidates, on_code)
+        else:
+            logger.info("re-optimizing from latest working optimization")
+            generator.clear_memory()
+            evaluator_feedback = ""
+            ast = benchmark_obj.pre_process(last_working_optimized_code)
+            candidates = generate_candidates(last_working_optimized_code, generator, evaluator_feedback, ast, num_candidates, on_code)
+            reoptimize_lastly_flag = 0
+
+        if candidates is not None and len(candidates) > 1:
+            # Speculative step: the best surviving candidate continues the loop with its own conversation
+            codes = [benchmark_obj.post_process(code) for code, _ in candidates]
+            status, chosen = benchmark_obj.evaluate_candidates(codes, prescreen=prescreen_rejections < 3)
+            last_optimized_code = codes[chosen]
+            generator.set_memory(candidates[chosen][1])
+        else:
+            if candidates is not None:
+                last_optimized_code = candidates[0][0]
+
             # code post_process
             last_optimized_code = benchmark_obj.post_process(last_optimized_code)
 
             # static analysis
-            status = benchmark_obj.static_analysis(last_optimized_code)
-            
-            # switch case of status
-            if (status == Status.COMPILATION_ERROR):
-                if compilation_errors == 3:
-                    logger.error("Could not compile optimized file after 3 attempts, will re-optimize from lastest working optimized file")
-                    reoptimize_lastly_flag = 1
-                    compilation_errors = 0
-                    evaluator_feedback = ""
-                compilation_errors += 1
-                logger.error("Error in optimized file, re-optimizing")
-                continue
-            elif (status == Status.RUNTIME_ERROR_OR_TEST_FAILED):
-                logger.error("Output difference in optimized file, will re-optimize from lastest working optimized file")
+            status = benchmark_obj.static_analysis(last_optimized_code, prescreen=prescreen_rejections < 3)
+        
+        # switch case of status
+        if (status == Status.COMPILATION_ERROR):
+            if compilation_errors == 3:
+                logger.error("Could not compile optimized file after 3 attempts, will re-optimize from lastest working optimized file")
                 reoptimize_lastly_flag = 1
-                evaluator_feedback = ""
-                compilation_errors = 0
-                total_output_difference += 1
-                continue
-            else:
-                num_success_iteration += 1
-                benchmark_obj.set_optimization_iteration(num_success_iteration)
                 compilation_errors = 0
-                # Copy lastest optimized code for logic error re-optimization
-                last_working_optimized_code = last_optimized_code
-                total_output_difference = 0
-
-                evaluator_feedback_data = benchmark_obj.get_evaluator_feedback_data()
-                
-                if num_success_iteration == self_optimization_step:
-                    logger.info("Optimization Complete, writing results to file.....")
-
-                    dict_str = json.dumps(benchmark_obj.get_energy_data(), indent=4)
-                    results_dir = f"{USER_PREFIX}/results/{benchmark}"
-                    if not os.path.exists(results_dir):
-                        os.makedirs(results_dir)
-                    with open(f"{results_dir}/{program}.txt", "w+") as file:
-                        file.write(str(dict_str))
-
-                    original_energy = evaluator_feedback_data["original"]["avg_energy"]
-                    original_runtime = evaluator_feedback_data["original"]["avg_runtime"]
-                    original_loc = evaluator_feedback_data["original"]["num_of_lines"]
-
-                    lowest_energy = evaluator_feedback_data["lowest_avg_energy"]["avg_energy"]
-                    lowest_runtime = evaluator_feedback_data["lowest_avg_energy"]["avg_runtime"]
-                    lowest_loc = evaluator_feedback_data["lowest_avg_energy"]["num_of_lines"]
-
-                    results[program] = {
-                        "energy_change": ((lowest_energy - original_energy) / original_energy) * 100,
-                        "runtime_change": ((lowest_runtime - original_runtime) / original_runtime) * 100,
-                        "loc_change": ((lowest_loc - original_loc) / original_loc) * 100,
-                    }
-
-                    break
-
-                # getting feedback from the evaluator
-                logger.info("Regression test success, getting evaluator feedback")
-                evaluator_feedback = evaluator_llm(evaluator_feedback_data=evaluator_feedback_data, llm_assistant=evaluator)
-                logger.info("Got evaluator feedback")
+                evaluator_feedback = ""
+            compilation_errors += 1
+            logger.error("Error in optimized file, re-optimizing")
+            continue
+        elif (status == Status.PRESCREEN_REJECTED):
+            # After 3 rejections in a row the next candidate is measured regardless
+            logger.error("Optimized file is clearly slower than the best version so far, re-optimizing")
+            prescreen_rejections += 1
+            compilation_errors = 0
+            evaluator_feedback = benchmark_obj.get_prescreen_feedback()
+            last_optimized_code = last_working_optimized_code
+            continue
+        elif (status == Status.MEASUREMENT_FAILED):
+            # The code passed the tests but produced no energy samples, try another optimization of the last working code
+            logger.error("Measurement of the optimized file failed, will re-optimize from lastest working optimized file")
+            reoptimize_lastly_flag = 1
+            evaluator_feedback = ""
+            compilation_errors = 0
+            measurement_failures += 1
+            continue
+        elif (status == Status.RUNTIME_ERROR_OR_TEST_FAILED):
+            logger.error("Output difference in optimized file, will re-optimize from lastest working optimized file")
+            reoptimize_lastly_flag = 1
+            evaluator_feedback = ""
+            compilation_errors = 0
+            total_output_difference += 1
+            continue
+        else:
+            num_success_iteration += 1
+            prescreen_rejections = 0
+            measurement_failures = 0
+            benchmark_obj.set_optimization_iteration(num_success_iteration)
+            compilation_errors = 0
+            # Copy lastest optimized code for logic error re-optimization
+            last_working_optimized_code = last_optimized_code
+            total_output_difference = 0
+
+            evaluator_feedback_data = benchmark_obj.get_evaluator_feedback_data()
+            
+            if num_success_iteration == self_optimization_step:
+                logger.info("Optimization Complete, writing results to file.....")
+
+                dict_str = json.dumps(benchmark_obj.get_energy_data(), indent=4)
+                with open(f"{results_dir}/{program}.txt", "w+") as file:
+                    file.write(str(dict_str))
+                with open(f"{results_dir}/{program}_measurement_stats.txt", "w+") as file:
+                    json.dump(benchmark_obj.get_measurement_stats(), file, indent=4)
+                with open(f"{results_dir}/{program}_token_usage.txt", "w+") as file:
+                    json.dump({"generator": generator.get_token_usage(), "evaluator": evaluator.get_token_usage()}, file, indent=4)
+
+                original_energy = evaluator_feedback_data["original"]["avg_energy"]
+                original_runtime = evaluator_feedback_data["original"]["avg_runtime"]
+                original_loc = evaluator_feedback_data["original"]["num_of_lines"]
+
+                lowest_energy = evaluator_feedback_data["lowest_avg_energy"]["avg_energy"]
+                lowest_runtime = evaluator_feedback_data["lowest_avg_energy"]["avg_runtime"]
+                lowest_loc = evaluator_feedback_data["lowest_avg_energy"]["num_of_lines"]
+
+                return {
+                    "energy_change": ((lowest_energy - original_energy) / original_energy) * 100,
+                    "runtime_change": ((lowest_runtime - original_runtime) / original_runtime) * 100,
+                    "loc_change": ((lowest_loc - original_loc) / original_loc) * 100,
+                }
+
+            # getting feedback from the evaluator
+            logger.info("Regression test success, getting evaluator feedback")
+            evaluator_feedback = evaluator_llm(evaluator_feedback_data=evaluator_feedback_data, llm_assistant=evaluator)
+            logger.info("Got evaluator feedback")
+
+def master_script(benchmark, num_programs, model, self_optimization_step, num_workers=None, llm_concurrency=None, measurement_core=0, **options):
+    if options.get("batch_backend") and model not in OPENAI_MODELS:
+        # Batch jobs are OpenAI chat completion requests, ollama has no batch API
+        raise ValueError(f"--batch_backend needs an OpenAI model ({', '.join(OPENAI_MODELS)}), got {model}")
+
+    results_dir = f"{USER_PREFIX}/results/{benchmark}"
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    if options.get("llm_tokens_per_minute"):
+        # Created before the scheduler forks, so every worker draws from the same bucket
+        set_token_bucket(TokenBucket(options["llm_tokens_per_minute"]))
+
+    # Each program runs its own optimization loop, energy measurements are serialized by the scheduler
+    scheduler = ProgramScheduler(num_workers=num_workers, llm_concurrency=llm_concurrency, reserved_core=measurement_core)
+    programs = get_valid_programs(benchmark, num_programs, options)
+    # Pins every measurement to the reserved core, governor and turbo are changed for the whole run
+    measurement_env = MeasurementEnvironment(
+        core=scheduler.reserved_core,
+        governor=options.get("governor"),
+        disable_turbo=options.get("disable_turbo", False),
+        max_load=options.get("max_background_load"),
+        max_wait=options.get("background_load_wait", 5)
+    )
+    measurement_env.setup()
+    set_measurement_environment(measurement_env)
+    try:
+        results = run_programs(scheduler, programs, benchmark, model, self_optimization_step, results_dir, options)
+    finally:
+        measurement_env.restore()
 
     with open(f"{results_dir}/results.txt", "w+") as file:
         json.dump(results, file, indent=4)
 
+def run_programs(scheduler, programs, benchmark, model, self_optimization_step, results_dir, options):
+    if options.get("batch_backend"):
+        # Every program's generator and evaluator requests of a round go out as one batch job
+        if options.get("num_candidates", 1) > 1:
+            logger.warning("Speculative candidates are not batched, using a single candidate per step")
+            options["num_candidates"] = 1
+        coordinator = BatchCoordinator(create_batch_backend(options), poll_interval=options.get("batch_poll_interval", 30))
+        set_batch_coordinator(coordinator)
+        return scheduler.run_batched(optimize_program, programs, coordinator, benchmark, model, self_optimization_step, results_dir, options)
+    return scheduler.run(optimize_program, programs, benchmark, model, self_optimization_step, results_dir, options)
+
 def main():
     args=parse_arguments()
     
@@ -155,7 +383,54 @@ def main():
     self_optimization_step = args.self_optimization_step
        
     #run benchmark
-    master_script(benchmark, num_programs, model, self_optimization_step)
+    master_script(
+        benchmark, num_programs, model, self_optimization_step, args.num_workers, args.llm_concurrency, args.measurement_core,
+        llm_cache=args.llm_cache,
+        llm_cache_dir=args.llm_cache_dir,
+        llm_cache_max_size_mb=args.llm_cache_max_size_mb,
+        llm_cache_max_age_days=args.llm_cache_max_age_days,
+        replay=args.replay,
+        no_binary_cache=args.no_binary_cache,
+        binary_cache_dir=args.binary_cache_dir,
+        no_measurement_cache=args.no_measurement_cache,
+        refresh_measurements=args.refresh_measurements,
+        measurement_max_age_days=args.measurement_max_age_days,
+        rapl_backend=args.rapl_backend,
+        adaptive_trials=args.adaptive_trials,
+        target_rel_ci=args.target_rel_ci,
+        min_trials=args.min_trials,
+        max_trials=args.max_trials,
+        warmup_trials=args.warmup_trials,
+        governor=args.governor,
+        disable_turbo=args.disable_turbo,
+        max_background_load=args.max_background_load,
+        background_load_wait=args.background_load_wait,
+        calibrate_startup=args.calibrate_startup,
+        calibration_idle_ms=args.calibration_idle_ms,
+        workspace_dir=args.workspace_dir,
+        test_workers=args.test_workers,
+        test_timeout=args.test_timeout,
+        num_candidates=args.num_candidates,
+        prescreen=args.prescreen,
+        prescreen_margin=args.prescreen_margin,
+        prescreen_metric=args.prescreen_metric,
+        memory_max_tokens=args.memory_max_tokens,
+        prompt_max_tokens=args.prompt_max_tokens,
+        llm_timeout=args.llm_timeout,
+        llm_max_retries=args.llm_max_retries,
+        llm_tokens_per_minute=args.llm_tokens_per_minute,
+        stream=args.stream,
+        batch_backend=args.batch_backend,
+        batch_dir=args.batch_dir,
+        batch_poll_interval=args.batch_poll_interval,
+        pie_seed=args.pie_seed,
+        pie_min_src_lines=args.pie_min_src_lines,
+        pie_max_src_lines=args.pie_max_src_lines,
+        pie_min_test_cases=args.pie_min_test_cases,
+        pie_inputs=args.pie_inputs,
+        pie_input_selection=args.pie_input_selection,
+        pie_input_weighting=args.pie_input_weighting
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
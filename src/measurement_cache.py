@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import platform
+import sqlite3
+import sys
+import time
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+def file_digest(path):
+    if path is None or not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def machine_fingerprint():
+    """CPU model, core count and kernel, measurements are only reused on an identical machine."""
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as file:
+            for line in file:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return {
+        "hostname": platform.node(),
+        "cpu_model": cpu_model,
+        "cpu_count": os.cpu_count(),
+        "kernel": platform.release()
+    }
+
+class MeasurementCache:
+    """
+    Persistent store of energy measurements backed by SQLite.
+    Results are keyed on the measured binary, its input file, the machine fingerprint and the
+    measurement configuration (measure command, Makefile and RAPL driver). Entries older than
+    max_age_seconds are stale and re-measured; refresh=True always re-measures and overwrites.
+    """
+    def __init__(self, db_path, rapl_binary=None, max_age_seconds=7 * 24 * 3600, refresh=False):
+        self.db_path = db_path
+        self.rapl_binary = rapl_binary
+        self.max_age_seconds = max_age_seconds
+        self.refresh = refresh
+        self.fingerprint = machine_fingerprint()
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self._execute("CREATE TABLE IF NOT EXISTS measurements (key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)")
+
+    def _execute(self, query, params=()):
+        # Scheduler workers share the database, wait for each other's writes
+        connection = sqlite3.connect(self.db_path, timeout=60)
+        try:
+            with connection:
+                return connection.execute(query, params).fetchone()
+        finally:
+            connection.close()
+
+    def measurement_config(self, build_dir, measure_command):
+        return {
+            "command": measure_command,
+            "makefile": file_digest(os.path.join(build_dir, "Makefile")),
+            "rapl": file_digest(self.rapl_binary)
+        }
+
+    def make_key(self, binary_path, input_path, config):
+        payload = {
+            "binary": file_digest(binary_path),
+            "input": file_digest(input_path) if input_path is not None else None,
+            "machine": self.fingerprint,
+            "config": config
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if self.refresh:
+            return None
+        row = self._execute("SELECT result, created FROM measurements WHERE key = ?", (key,))
+        if row is None:
+            return None
+        result, created = row
+        if self.max_age_seconds is not None and time.time() - created > self.max_age_seconds:
+            logger.info("MeasurementCache: stale entry, re-measuring")
+            return None
+        logger.info("MeasurementCache: reusing stored measurement")
+        return json.loads(result)
+
+    def put(self, key, result):
+        self._execute(
+            "INSERT OR REPLACE INTO measurements (key, result, created) VALUES (?, ?, ?)",
+            (key, json.dumps(result), time.time())
+        )
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+CPU_SYSFS = "/sys/devices/system/cpu"
+# Trials shorter than this many clock ticks are too short to attribute /proc/stat busy time
+MIN_TRIAL_TICKS = 20
+
+# Environment every benchmark of the process measures in, see set_measurement_environment
+_measurement_environment = None
+
+def read_cpu_times(proc_stat="/proc/stat"):
+    """(busy, total) clock ticks of all CPUs since boot."""
+    with open(proc_stat, "r") as file:
+        fields = [int(value) for value in file.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal, guest time is already counted in user
+    fields = fields[:8]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields) - idle, sum(fields)
+
+class MeasurementEnvironment:
+    """
+    Controls where and under which conditions energy is measured.
+    - Measurements are pinned to core with sched_setaffinity while the environment is
+      entered, make, RAPL/main and the measured child inherit the affinity.
+    - setup() sets the cpufreq governor of core and disables turbo through sysfs for the
+      whole run, restore() puts the previous values back. Both need root, a value that
+      cannot be written is skipped with a warning.
+    - With max_load, the background load (busy cores outside the measurement) is sampled
+      over load_window seconds before every trial, waiting up to max_wait seconds for it to
+      drop to max_load. Trials started above it, or during which other processes kept more
+      than max_load cores busy, are rejected; after max_rejected rejections in one
+      measurement noisy trials are kept.
+    """
+    def __init__(self, core=None, governor=None, disable_turbo=False, max_load=None, load_window=0.05, max_wait=5,
+                 max_rejected=10, sysfs_root=CPU_SYSFS, proc_stat="/proc/stat"):
+        self.core = core
+        self.governor = governor
+        self.disable_turbo = disable_turbo
+        self.max_load = max_load
+        self.load_window = load_window
+        self.max_wait = max_wait
+        self.max_rejected = max_rejected
+        self.sysfs_root = sysfs_root
+        self.proc_stat = proc_stat
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.previous_values = []
+        self.previous_affinity = None
+
+    def _write_sysfs(self, path, value):
+        try:
+            with open(path, "r") as file:
+                previous = file.read().strip()
+            if previous != value:
+                with open(path, "w") as file:
+                    file.write(value)
+                self.previous_values.append((path, previous))
+            return True
+        except OSError as e:
+            logger.warning(f"MeasurementEnvironment: cannot set {path} to {value}: {e}")
+            return False
+
+    def setup(self):
+        if self.governor is not None:
+            cores = [self.core] if self.core is not None else range(os.cpu_count() or 1)
+            for core in cores:
+                self._write_sysfs(os.path.join(self.sysfs_root, f"cpu{core}", "cpufreq", "scaling_governor"), self.governor)
+        if self.disable_turbo:
+            # intel_pstate has its own switch, acpi-cpufreq and amd-pstate use the generic boost one
+            no_turbo = os.path.join(self.sysfs_root, "intel_pstate", "no_turbo")
+            if os.path.exists(no_turbo):
+                self._write_sysfs(no_turbo, "1")
+            else:
+                self._write_sysfs(os.path.join(self.sysfs_root, "cpufreq", "boost"), "0")
+        for path, previous in self.previous_values:
+            logger.info(f"MeasurementEnvironment: {path} changed from {previous}")
+
+    def restore(self):
+        while self.previous_values:
+            path, previous = self.previous_values.pop()
+            try:
+                with open(path, "w") as file:
+                    file.write(previous)
+            except OSError as e:
+                logger.warning(f"MeasurementEnvironment: cannot restore {path} to {previous}: {e}")
+
+    def __enter__(self):
+        if self.core is not None:
+            self.previous_affinity = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, {self.core})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.previous_affinity is not None:
+            os.sched_setaffinity(0, self.previous_affinity)
+            self.previous_affinity = None
+        return False
+
+    def cpu_times(self):
+        return read_cpu_times(self.proc_stat)
+
+    def background_load(self):
+        """Busy cores over the next load_window seconds, nothing of ours runs meanwhile."""
+        busy_before, total_before = self.cpu_times()
+        time.sleep(self.load_window)
+        busy_after, total_after = self.cpu_times()
+        if total_after == total_before:
+            return 0.0
+        return (busy_after - busy_before) / (total_after - total_before) * (os.cpu_count() or 1)
+
+    def wait_until_quiet(self):
+        """Background load once it is at most max_load or max_wait passed, None without max_load."""
+        if self.max_load is None:
+            return None
+        deadline = time.monotonic() + self.max_wait
+        load = self.background_load()
+        while load > self.max_load and time.monotonic() < deadline:
+            load = self.background_load()
+        if load > self.max_load:
+            logger.warning(f"MeasurementEnvironment: background load still {load:.2f} cores after {self.max_wait}s")
+        return load
+
+    def trial_load(self, cpu_times_before, cpu_times_after, child_cpu_seconds, wall_seconds):
+        """
+        Cores other processes kept busy during a trial, from /proc/stat busy time minus the
+        CPU time of the measured child. None when the trial was too short to tell.
+        """
+        if wall_seconds * self.clock_ticks < MIN_TRIAL_TICKS:
+            return None
+        busy_seconds = (cpu_times_after[0] - cpu_times_before[0]) / self.clock_ticks
+        return max(0.0, busy_seconds - child_cpu_seconds) / wall_seconds
+
+    def is_noisy(self, load):
+        return self.max_load is not None and load is not None and load > self.max_load
+
+def set_measurement_environment(measurement_environment):
+    global _measurement_environment
+    _measurement_environment = measurement_environment
+
+def get_measurement_environment():
+    return _measurement_environment
@@ -0,0 +1,77 @@
+import math
+import sys
+import numpy as np
+from measurement_store import RECORD_DTYPE, aggregate, valid_mask
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+def _weighted_summary(parts):
+    # parts is a list of (weight, summary of one metric in measurement_store.aggregate stats)
+    mean = sum(weight * part["mean"] for weight, part in parts)
+    half_width = math.sqrt(sum((weight * (part["ci_high"] - part["mean"])) ** 2 for weight, part in parts))
+    return {
+        "n": sum(part["n"] for weight, part in parts),
+        "mean": mean,
+        "median": sum(weight * part["median"] for weight, part in parts),
+        "stddev": math.sqrt(sum((weight * part["stddev"]) ** 2 for weight, part in parts)),
+        "ci_low": mean - half_width,
+        "ci_high": mean + half_width,
+        "rel_ci_width": (2 * half_width / abs(mean)) if mean else math.inf
+    }
+
+def aggregate_stats(per_input, weights):
+    """
+    Weighted mean over inputs of measurement_store.aggregate stats. per_input and weights are keyed by
+    input name; the confidence interval combines the per-input half widths as independent
+    errors. The per-input stats and weights are kept under "inputs".
+    """
+    aggregate = {"trials": sum(stats["trials"] for stats in per_input.values())}
+    for metric in ("energy", "runtime"):
+        aggregate[metric] = _weighted_summary([(weights[name], stats[metric]) for name, stats in per_input.items()])
+    # Stats with the startup overhead subtracted carry the raw ones along
+    if all("raw" in stats for stats in per_input.values()):
+        aggregate["raw"] = {metric: _weighted_summary([(weights[name], stats["raw"][metric]) for name, stats in per_input.items()])
+                            for metric in ("energy", "runtime")}
+        aggregate["overhead"] = next(iter(per_input.values()))["overhead"]
+    aggregate["inputs"] = {name: dict(stats, weight=weights[name]) for name, stats in per_input.items()}
+    return aggregate
+
+class AdaptiveSampler:
+    """
+    Repeats measurement batches until the relative confidence interval width of both energy and
+    runtime is below target_rel_ci, bounded by min_trials/max_trials. The first warmup batches
+    are discarded.
+    """
+    def __init__(self, target_rel_ci=0.05, min_trials=3, max_trials=30, warmup=1, confidence=0.95):
+        self.target_rel_ci = target_rel_ci
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.warmup = warmup
+        self.confidence = confidence
+
+    def is_converged(self, records):
+        if len(records) < self.min_trials:
+            return False
+        stats = aggregate(records, by=None, confidence=self.confidence)
+        return stats["energy"]["rel_ci_width"] <= self.target_rel_ci and stats["runtime"]["rel_ci_width"] <= self.target_rel_ci
+
+    def run(self, sample_batch, *args):
+        """sample_batch(*args) returns the RECORD_DTYPE records of one batch, the valid trials of all batches are returned."""
+        for _ in range(self.warmup):
+            sample_batch(*args)
+
+        records = np.zeros(0, dtype=RECORD_DTYPE)
+        while len(records) < self.max_trials:
+            batch = sample_batch(*args)
+            batch = batch[valid_mask(batch)]
+            if len(batch) == 0:
+                logger.error("AdaptiveSampler: measurement batch returned no samples")
+                break
+            records = np.concatenate((records, batch))
+            if self.is_converged(records):
+                break
+
+        records = records[:self.max_trials]
+        logger.info(f"AdaptiveSampler: {len(records)} trials, converged: {self.is_converged(records)}")
+        return records
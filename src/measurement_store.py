@@ -0,0 +1,166 @@
+import math
+import os
+import statistics
+import time
+import numpy as np
+
+DOMAINS = ["package", "core", "gpu", "dram"]
+
+# Two-sided 95% Student t quantiles for 1..30 degrees of freedom
+T_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042
+]
+
+# One fixed-size record per measurement trial, energy in Joules (NaN when the domain is not available), runtime in ms
+RECORD_DTYPE = np.dtype([
+    ("program_id", "S96"),
+    ("iteration", "<i4"),
+    ("trial", "<i4"),
+    ("timestamp", "<f8"),
+    ("package", "<f8"),
+    ("core", "<f8"),
+    ("gpu", "<f8"),
+    ("dram", "<f8"),
+    ("runtime", "<f8")
+])
+
+def make_records(program_id, samples, iteration=0):
+    """samples is a list of {domain: Joules, "runtime": ms} dicts, e.g. from rapl_reader.EnergyMeter."""
+    records = np.zeros(len(samples), dtype=RECORD_DTYPE)
+    records["program_id"] = program_id.encode("utf-8")
+    records["iteration"] = iteration
+    records["trial"] = np.arange(len(samples))
+    records["timestamp"] = time.time()
+    for domain in DOMAINS:
+        records[domain] = [sample.get(domain, np.nan) for sample in samples]
+    records["runtime"] = [sample["runtime"] for sample in samples]
+    return records
+
+def _parse_float(value):
+    value = value.strip()
+    return float(value) if value else np.nan
+
+def read_rapl_csv(path, program_id=None, iteration=0):
+    """
+    Parse a runtime log written by RAPL/main ("name ; package, gpu, dram, runtime" per trial).
+    Fields are positional, empty ones are domains this CPU does not report. The trial index
+    restarts for every name; program_id overrides the name column when given.
+    """
+    rows = []
+    trials = {}
+    if os.path.exists(path):
+        with open(path, "r") as file:
+            for line in file:
+                if ";" not in line:
+                    continue
+                name, values = line.split(";", 1)
+                fields = values.split(",")
+                if len(fields) < 4:
+                    continue
+                name = program_id if program_id is not None else name.strip()
+                trial = trials.get(name, 0)
+                trials[name] = trial + 1
+                rows.append((name.encode("utf-8"), iteration, trial, time.time(),
+                             _parse_float(fields[0]), np.nan, _parse_float(fields[1]), _parse_float(fields[2]), _parse_float(fields[-1])))
+    return np.array(rows, dtype=RECORD_DTYPE)
+
+def valid_mask(records):
+    # RAPL/main reports failed trials as negative readings
+    return (records["package"] >= 0) & (records["runtime"] >= 0)
+
+def t_quantile(df, confidence=0.95):
+    if confidence == 0.95 and df <= len(T_95):
+        return T_95[df - 1]
+    # Large samples or other confidence levels: normal approximation
+    return statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+def _group_summaries(values, inverse, num_groups, confidence):
+    # Mean, median, standard deviation and confidence interval of the mean of every group at once
+    keep = ~np.isnan(values)
+    values, inverse = values[keep], inverse[keep]
+    n = np.bincount(inverse, minlength=num_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(inverse, weights=values, minlength=num_groups) / n
+        squares = np.bincount(inverse, weights=(values - mean[inverse]) ** 2, minlength=num_groups)
+        stddev = np.where(n > 1, np.sqrt(squares / np.maximum(n - 1, 1)), 0.0)
+        t = np.array([t_quantile(count - 1, confidence) if count > 1 else np.inf for count in n])
+        half_width = np.where(n > 1, t * stddev / np.sqrt(n), np.inf)
+        rel_ci_width = np.where(mean != 0, 2 * half_width / np.abs(mean), np.inf)
+
+    # Sorted by group then value, the median is taken at the middle of every group's run
+    sorted_values = values[np.lexsort((values, inverse))]
+    start = np.cumsum(n) - n
+    median = np.full(num_groups, np.nan)
+    filled = n > 0
+    median[filled] = (sorted_values[start[filled] + (n[filled] - 1) // 2] + sorted_values[start[filled] + n[filled] // 2]) / 2
+    mean[~filled] = np.nan
+    stddev[~filled] = np.nan
+
+    return [{
+        "n": int(n[index]),
+        "mean": float(mean[index]),
+        "median": float(median[index]),
+        "stddev": float(stddev[index]),
+        "ci_low": float(mean[index] - half_width[index]),
+        "ci_high": float(mean[index] + half_width[index]),
+        "rel_ci_width": float(rel_ci_width[index]) if filled[index] else math.inf
+    } for index in range(num_groups)]
+
+def aggregate(records, by="program_id", confidence=0.95):
+    """
+    Vectorized statistics of the valid trials in records, grouped by a record field.
+    Every group gets {"trials": n, "energy": package, "runtime": runtime, "domains": {domain: ...}}
+    where each entry has "n", "mean", "median", "stddev", "ci_low", "ci_high" and "rel_ci_width";
+    domains this CPU does not report are left out. Returns {group: stats}, or the stats of all
+    records as one group when by is None.
+    """
+    records = records[valid_mask(records)]
+    if by is None:
+        keys, inverse = [None], np.zeros(len(records), dtype=np.intp)
+    else:
+        groups, inverse = np.unique(records[by], return_inverse=True)
+        keys = [group.decode("utf-8") if isinstance(group, bytes) else group.item() for group in groups]
+        inverse = inverse.reshape(-1)
+    trials = np.bincount(inverse, minlength=len(keys))
+    columns = {column: _group_summaries(records[column], inverse, len(keys), confidence) for column in DOMAINS + ["runtime"]}
+
+    result = {}
+    for index, key in enumerate(keys):
+        result[key] = {
+            "trials": int(trials[index]),
+            "energy": columns["package"][index],
+            "runtime": columns["runtime"][index],
+            "domains": {domain: columns[domain][index] for domain in DOMAINS if columns[domain][index]["n"]}
+        }
+    if by is None:
+        return result[None]
+    return result
+
+class MeasurementStore:
+    """Append-only binary file of RECORD_DTYPE records."""
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def append(self, records):
+        records = np.asarray(records, dtype=RECORD_DTYPE)
+        if len(records) == 0:
+            return
+        # A single O_APPEND write keeps records from concurrent workers whole
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            os.write(fd, records.tobytes())
+        finally:
+            os.close(fd)
+
+    def load(self, program_id=None):
+        if not os.path.exists(self.path):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        records = np.fromfile(self.path, dtype=RECORD_DTYPE)
+        if program_id is not None:
+            records = records[records["program_id"] == program_id.encode("utf-8")]
+        return records
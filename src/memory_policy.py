@@ -0,0 +1,100 @@
+import json
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+
+SUMMARY_PREFIX = "Summary of"
+STRATEGIES_PREFIX = "Strategies already tried: "
+
+def count_tokens(text):
+    """Token count with tiktoken when it is installed, otherwise the usual 4 characters per token estimate."""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def count_memory_tokens(memory):
+    # A few tokens of framing per message, as counted by the chat APIs
+    return sum(count_tokens(message["content"]) + 4 for message in memory)
+
+class MemoryPolicy:
+    """
+    Keeps an LLMAgent conversation under a token budget before every request.
+    - The system message and the latest user message are always kept verbatim.
+    - Earlier assistant replies keep their reasoning but lose their final_code,
+      only the latest code version stays in the conversation.
+    - Earlier user messages are cut to their first head_tokens tokens, which hold the
+      instructions rather than the code and AST.
+    - If that is still over budget the oldest turns are dropped and replaced by one
+      message summarizing the strategies they selected.
+    """
+    def __init__(self, max_tokens=16000, head_tokens=1200):
+        self.max_tokens = max_tokens
+        self.head_tokens = head_tokens
+
+    def apply(self, memory):
+        if len(memory) <= 2 or count_memory_tokens(memory) <= self.max_tokens:
+            return list(memory)
+
+        last_user = max(i for i, message in enumerate(memory) if message["role"] == "user")
+        assistant_indices = [i for i, message in enumerate(memory) if message["role"] == "assistant"]
+        latest_code = assistant_indices[-1] if assistant_indices else None
+
+        compacted = [memory[0]]
+        for i, message in enumerate(memory[1:], start=1):
+            if i == last_user or i == latest_code:
+                compacted.append(message)
+            elif message["role"] == "assistant":
+                compacted.append({"role": "assistant", "content": self._compact_reply(message["content"])})
+            else:
+                compacted.append({"role": message["role"], "content": self._head(message["content"])})
+
+        # Drop the oldest turns until the budget holds, never the latest user message
+        dropped = []
+        while count_memory_tokens(compacted) > self.max_tokens and len(compacted) > 2 and compacted[1] is not memory[last_user]:
+            dropped.append(compacted.pop(1))
+        if dropped:
+            compacted.insert(1, {"role": "user", "content": self._summarize(dropped)})
+        return compacted
+
+    def _head(self, content):
+        if count_tokens(content) <= self.head_tokens:
+            return content
+        # Characters per token of this message, to cut close to head_tokens
+        cut = int(len(content) * self.head_tokens / count_tokens(content))
+        return content[:cut] + f"\n[... {len(content) - cut} characters of an earlier prompt omitted]"
+
+    def _compact_reply(self, content):
+        try:
+            reply = json.loads(content)
+        except ValueError:
+            return self._head(content)
+        if not isinstance(reply, dict) or "final_code" not in reply:
+            return content
+        reply["final_code"] = "[code of an earlier version omitted]"
+        return json.dumps(reply)
+
+    def _summarize(self, dropped):
+        strategies = []
+        for message in dropped:
+            # Keep what an earlier summary recorded when it is dropped in turn
+            if message["content"].startswith(SUMMARY_PREFIX) and STRATEGIES_PREFIX in message["content"]:
+                strategies.extend(message["content"].split(STRATEGIES_PREFIX, 1)[1].rstrip(".").split("; "))
+            if message["role"] != "assistant":
+                continue
+            try:
+                reply = json.loads(message["content"])
+            except ValueError:
+                continue
+            if isinstance(reply, dict) and reply.get("selected_strategy"):
+                strategies.append(reply["selected_strategy"])
+        summary = f"{SUMMARY_PREFIX} {len(dropped)} earlier messages removed to save context."
+        if strategies:
+            summary += f" {STRATEGIES_PREFIX}" + "; ".join(strategies) + "."
+        return summary
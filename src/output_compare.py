@@ -0,0 +1,78 @@
+import os
+import re
+
+WHITESPACE = re.compile(r"\s+")
+
+def normalize(content):
+    """Remove all spaces, newline characters, and tabs for cleaner comparison."""
+    return WHITESPACE.sub("", content)
+
+class StreamingComparator:
+    """
+    Compares output chunk by chunk against an expected, already normalized, output.
+    Whitespace is removed per chunk, which is equivalent to removing it from the whole
+    output. Only the last few matched characters are kept, so memory does not grow
+    with the output size, and comparison stops at the first divergence.
+    """
+    def __init__(self, expected, window=40):
+        self.expected = expected
+        self.window = window
+        self.position = 0
+        self.recent = ""
+        self.mismatch = None
+
+    @property
+    def matched(self):
+        return self.mismatch is None
+
+    def feed(self, chunk):
+        """Returns False once the output diverged from the expected output."""
+        if self.mismatch is not None:
+            return False
+        chunk = normalize(chunk)
+        expected = self.expected[self.position:self.position + len(chunk)]
+        if expected != chunk:
+            self._record_mismatch(len(os.path.commonprefix([expected, chunk])), chunk)
+            return False
+        self.position += len(chunk)
+        self.recent = (self.recent + chunk)[-self.window:]
+        return True
+
+    def finish(self):
+        """Call at the end of the output, it must not be shorter than the expected output."""
+        if self.mismatch is None and self.position < len(self.expected):
+            self._record_mismatch(0, "")
+        return self.matched
+
+    def _record_mismatch(self, index, chunk):
+        offset = self.position + index
+        context = (self.recent + chunk[:index])[-self.window:]
+        self.mismatch = {
+            "offset": offset,
+            "context": context,
+            "expected": self.expected[offset:offset + self.window],
+            "actual": chunk[index:index + self.window]
+        }
+
+    def diff(self):
+        if self.mismatch is None:
+            return ""
+        return "outputs differ at offset {} (whitespace removed) after ...{!r}: expected {!r}, got {!r}".format(
+            self.mismatch["offset"], self.mismatch["context"],
+            self.mismatch["expected"] or "<end of output>", self.mismatch["actual"] or "<end of output>")
+
+def compare_stream(stream, expected, chunk_size=65536, window=40):
+    """
+    Reads a binary pipe in chunks until EOF or the first divergence. expected is the
+    normalized output or a golden_outputs.OutputDigest.
+    Returns the comparator and whether the stream was read to the end.
+    """
+    comparator = expected.comparator() if hasattr(expected, "comparator") else StreamingComparator(expected, window)
+    read = getattr(stream, "read1", stream.read)
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            comparator.finish()
+            return comparator, True
+        if not comparator.feed(chunk.decode("latin-1")):
+            return comparator, False
@@ -1,14 +1,22 @@
 from abstract_syntax_trees.cpp_ast import CPPAST
-from benchmark import Benchmark
+from benchmark import Benchmark, measurement_failed
 from dotenv import load_dotenv
 import glob
-import json
 import os
 import re
-import shutil
 import subprocess
+import tempfile
 import sys
 from utils import Logger
+from measurement_store import MeasurementStore, make_records, read_rapl_csv
+from measurement_stats import aggregate_stats
+from input_selection import InputSelector
+from calibration import CPP_NOOP_PROGRAM, CPP_IDLE_PROGRAM
+from prescreen import PreScreen
+from test_runner import TestCaseRunner
+from golden_outputs import GoldenIndex, OutputDigest
+from pie_index import PIEIndex
+from pie_materializer import PIEMaterializer
 
 
 load_dotenv()
@@ -17,15 +25,14 @@ logger = Logger("logs", sys.argv[2]).logger
 
 class PIEBenchmark(Benchmark):
     def __init__(self, program):
-        self.program = program #This is the CPP file name including the .cpp extension
-        self.compilation_error = None
-        self.energy_data = {}
-        self.evaluator_feedback_data = {}
+        super().__init__(program) #program is the CPP file name including the .cpp extension
+        self.source_dir = f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}"
         self.expect_test_output = None
-        self.original_code = None
-        self.optimization_iteration = 0
-
-        self.set_original_code()
+        self.expected_outputs = None
+        self.test_runner = TestCaseRunner()
+        self.measurement_store = MeasurementStore(f"{USER_PREFIX}/src/runtime_logs/measurements.bin")
+        self.input_selector = InputSelector()
+        self.measurement_inputs = None
     
     def set_original_code(self):
         source_path = f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}/{self.program}"
@@ -41,41 +48,78 @@ class PIEBenchmark(Benchmark):
     def get_optimization_iteration(self):
         return super().get_optimization_iteration()
     
+    def set_input_selector(self, input_selector):
+        self.input_selector = input_selector
+
+    def _measurement_inputs(self):
+        """
+        [(input file relative to the build dir, weight)] the binaries are measured on, heaviest
+        first. Chosen once on the original binary, every version is measured on the same set.
+        """
+        if self.measurement_inputs is None:
+            build_dir = self._get_original_workspace().path
+            binary_path = f"{build_dir}/{self.program.split('.')[0]}.gpp_run"
+            input_files = glob.glob(f"{build_dir}/test_cases/input.*.txt")
+            probe_runner = PreScreen(metric="time")
+            def probe(input_path):
+                # Timed runs are as sensitive to interference as RAPL trials
+                with self.measurement_slot, self._environment():
+                    return probe_runner.sample([binary_path], input_path, build_dir)
+            selection = self.input_selector.select(input_files, probe)
+            self.measurement_inputs = [(os.path.relpath(path, build_dir), weight) for path, weight in selection]
+        return self.measurement_inputs
+
+    def _calibration_programs(self):
+        return CPP_NOOP_PROGRAM, CPP_IDLE_PROGRAM
+
+    def _measure_inputs(self, build_dir, target, binary_path, optimized):
+        # Every input is measured and cached on its own, the aggregate is their weighted mean
+        problem_id = self.program.split('_')[0]
+        per_input, weights = {}, {}
+        for input_file, weight in self._measurement_inputs():
+            measure_command = ["make", target, f"input={input_file}", f"problem_id={problem_id}"]
+            per_input[input_file] = self._memoized_measurement(build_dir, measure_command, binary_path, f"{build_dir}/{input_file}", optimized, input_file)
+            weights[input_file] = weight
+        return aggregate_stats(per_input, weights)
+
     def set_original_energy(self):
         logger.info("Run benchmark on the original code")
 
-        # compile
-        # Needed for makefiles
-        problem_id = self.program.split('_')[0]
-        os.chdir(f"{USER_PREFIX}/benchmark_pie/{problem_id}")  
+        # compile inside the original workspace, the problem folder itself is never written to
+        build_dir = self._get_original_workspace().path
         try: 
-            result = subprocess.run(
-                ["make", "compile"], 
-                check=True,
-                capture_output=True,
-                text=True
-            )
+            result = self._make_compile(build_dir, "compile", self.original_code)
             self.compilation_error = result.stdout + result.stderr
             logger.info(f"Original code compile successfully.\n")
         except subprocess.CalledProcessError as e:
             logger.error(f"Original code compile failed: {e}\n")
             return False
 
-        self._run_rapl(problem_id)
-
-        avg_energy, avg_runtime = self._compute_avg()
+        binary_path = f"{build_dir}/{self.program.split('.')[0]}.gpp_run"
+        if not self._measurement_inputs():
+            logger.error(f"No test case inputs to measure {self.program} on\n")
+            return False
+        self._calibrate()
+        stats = self._measure_inputs(build_dir, "measure", binary_path, False)
+        if measurement_failed(stats):
+            logger.error(f"Measurement of the original code produced no samples\n")
+            return False
+        avg_energy, avg_runtime = stats["energy"]["mean"], stats["runtime"]["mean"]
 
         #Append results to benchmark data dict
         self.energy_data[0] = (self.original_code, round(avg_energy, 3), round(avg_runtime, 3), len(self.original_code.splitlines()))
+        self.measurement_stats[0] = stats
+        self._print_measurement_stats(stats)
         logger.info(f"original_energy_data: {self.energy_data[0]}")
         return True
 
     def pre_process(self, code):
-        ast = CPPAST("cpp")
-        source_code_path = f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}/ast_{self.program}"
-        with open(source_code_path, 'w') as file:
-            file.write(code)
-        return ast.create_ast(source_code_path)
+        ast = CPPAST("cpp", cache_dir=f"{USER_PREFIX}/ast_cache")
+        with tempfile.TemporaryDirectory(prefix="ast_") as ast_dir:
+            source_code_path = f"{ast_dir}/ast_{self.program}"
+            with open(source_code_path, 'w') as file:
+                file.write(code)
+            return ast.create_ast(source_code_path)
 
     def post_process(self, code):
         # Remove code block delimiters
@@ -86,65 +130,66 @@ class PIEBenchmark(Benchmark):
         return code
 
     def compile(self, optimized_code):
-        logger.info(f"llm_optimize: : writing optimized code to benchmark_pie/{self.program.split('_')[0]}/optimized_{self.program}")
-        destination_path = f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}/optimized_{self.program}"
-        with open(destination_path, "w") as file:
-            file.write(optimized_code)
-
-        # Needed for makefiles
-        os.chdir(f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}")  
-        try: 
-            result = subprocess.run(
-                ["make", "compile_optimized"], 
-                check=True,
-                capture_output=True,
-                text=True
-            )
+        error = self._compile_in_candidate_workspace(optimized_code)
+        if error is None:
             logger.info(f"Compile successfully.\n")
             return True
-        except subprocess.CalledProcessError as e:
-            self.compilation_error = e.stderr
-            logger.error(f"Compile failed: {self.compilation_error}\n")
-            return False
+        self.compilation_error = error
+        logger.error(f"Compile failed: {self.compilation_error}\n")
+        return False
 
     def get_compilation_error(self):
         return super().get_compilation_error()
 
-    def run_tests(self):
-        # Needed for makefiles
-        os.chdir(f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}")
-
-        # Iterate through all test cases and perform correctness check
-        problem_id = self.program.split('_')[0]
-        test_case_folder = f"{USER_PREFIX}/benchmark_pie/{problem_id}/test_cases"
-        input_files = sorted(glob.glob(f"{test_case_folder}/input.*.txt"))
-        output_files = sorted(glob.glob(f"{test_case_folder}/output.*.txt"))
-
-        assert (len(input_files) == len(output_files)), "Number of input files and output files do not match"
-        
-        for i, input_file in enumerate(input_files):
-            with open(output_files[i], 'r') as file:
-                self.expect_test_output = self._process_output_content(file.read())
-
-            optimized_output = self._run_program(True, input_file)
+    def run_tests(self, workspace=None):
+        workspace = workspace if workspace is not None else self.candidate_workspace
+        # Run all test cases against the optimized binary, stopping at the first failure
+        expected_outputs = self._get_expected_outputs()
+        binary_path = workspace.file(f"optimized_{self.program.split('.')[0]}.gpp_run")
+        failure = self.test_runner.run([binary_path], expected_outputs, workspace.path)
+        if failure is None:
+            logger.info(f"All {len(expected_outputs)} test cases passed.\n")
+            return True
 
-            if not self._compare_outputs(optimized_output):
-                return False
-        
-        return True
+        logger.error(f"Test case {failure['input_file']} failed: {failure['reason']} {failure['diff']}\n")
+        return False
+
+    def _get_expected_outputs(self):
+        # Expected outputs never change, their digests are computed once and stored next to the test cases
+        if self.expected_outputs is None:
+            problem_id = self.program.split('_')[0]
+            test_case_folder = f"{USER_PREFIX}/benchmark_pie/{problem_id}/test_cases"
+            input_files = sorted(glob.glob(f"{test_case_folder}/input.*.txt"))
+            output_files = sorted(glob.glob(f"{test_case_folder}/output.*.txt"))
+
+            assert (len(input_files) == len(output_files)), "Number of input files and output files do not match"
+
+            golden_index = GoldenIndex(f"{test_case_folder}/golden_outputs.json")
+            self.expected_outputs = []
+            for input_file, output_file in zip(input_files, output_files):
+                stat = os.stat(output_file)
+                fingerprint = f"{stat.st_size}:{stat.st_mtime_ns}"
+                digest = golden_index.get(os.path.basename(input_file), fingerprint)
+                if digest is None:
+                    digest = OutputDigest.from_file(output_file)
+                    golden_index.put(os.path.basename(input_file), fingerprint, digest)
+                # A failing case is compared against the output file again to report the difference
+                digest.source = output_file
+                self.expected_outputs.append((input_file, digest))
+        return self.expected_outputs
 
     
-    def measure_energy(self, optimized_code):            
+    def measure_energy(self, optimized_code, stats=None):            
         #load the optimized code and data
         logger.info(f"Iteration {self.optimization_iteration + 1}, run benchmark on the optimized code")
-        
-        problem_id = self.program.split('_')[0]
-        self._run_rapl(problem_id)
-    
-        avg_energy, avg_runtime = self._compute_avg()
+        if stats is None:
+            stats = self._candidate_stats()
+        avg_energy, avg_runtime = stats["energy"]["mean"], stats["runtime"]["mean"]
         
         #Append results to benchmark data dict
         self.energy_data[self.optimization_iteration + 1] = (optimized_code, round(avg_energy, 3), round(avg_runtime, 3), len(optimized_code.splitlines()))
+        self.measurement_stats[self.optimization_iteration + 1] = stats
+        self._print_measurement_stats(stats)
         
         # Find the required benchmark elements
         self.evaluator_feedback_data = self._extract_content(self.energy_data)
@@ -153,114 +198,71 @@ class PIEBenchmark(Benchmark):
         self._print_benchmark_info(self.evaluator_feedback_data)
 
  
+    def _measure_target(self, optimized):
+        # A single run of the heaviest input
+        make_args = [f"input={self._measurement_inputs()[0][0]}", f"problem_id={self.program.split('_')[0]}"]
+        if optimized:
+            return self.candidate_workspace.path, "measure_optimized", make_args
+        return self._get_original_workspace().path, "measure", make_args
+
+    def _candidate_stats(self):
+        build_dir = self.candidate_workspace.path
+        binary_path = f"{build_dir}/optimized_{self.program.split('.')[0]}.gpp_run"
+        return self._measure_inputs(build_dir, "measure_optimized", binary_path, True)
+
     def get_energy_data(self):
         return super().get_energy_data()
     
     def get_evaluator_feedback_data(self):
         return super().get_evaluator_feedback_data()
     
-    def static_analysis(self, optimized_code):
-        return super().static_analysis(optimized_code)
-
-    def _run_program(self, optimized, input_file):
-        # Run the make command and capture the output in a variable
-        if not optimized:
-            result = subprocess.run(["make", "run"], stdin=open(input_file, 'r'), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='latin-1')
-        else:
-            logger.info(f"Running optimized program with input file: {input_file}")
-            result = subprocess.run(["make", "run_optimized"], stdin=open(input_file, 'r'), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='latin-1')
-            
-        logger.info(f"_run_program result: {result}")
-
-        # Check for runtime errors
-        if result.returncode is not None and result.returncode != 0:
-            return
-
-        # Filter out the unwanted lines
-        filtered_output = "\n".join(
-            line for line in result.stdout.splitlines()
-            if not (line.startswith("make[") or line.startswith("./"))
-        )
-        logger.info(f"filtered_output: {filtered_output}")
-        return filtered_output
-    
-    def _compare_outputs(self, optimized_output):
-        # whitespace remove
-        optimized_output = self._process_output_content(optimized_output)
-        
-        if self.expect_test_output == optimized_output:
-            logger.info("Outputs are the same.\n")
-            return True
-        else:
-            logger.error(f"Original program output:\n{self.expect_test_output}\n")
-            logger.error(f"Optimized program output:\n{optimized_output}\n\n")
-            return False
-            
-    def _process_output_content(self, content):
-        """Remove all spaces, newline characters, and tabs for cleaner comparison."""
-        if content is None or not isinstance(content, str):
-           return content
-        # If content is a list of lines, join it into a single string
-        if isinstance(content, list):
-            content = ''.join(content)
-        # Remove all whitespace characters
-        return re.sub(r'\s+', '', content)
-
-    def _run_rapl(self, problem_id):
-        # First clear the contents of the energy data log file
-        logger.info(f"Benchmark.run: clearing content in c++.csv")
-        log_file_path = f"{USER_PREFIX}/src/runtime_logs/c++.csv"
-        if os.path.exists(log_file_path):
-            file = open(log_file_path, "w+")
-            file.close()
-
-        #run make measure using make file
-        #change current directory to benchmarks/folder to run make file
-        os.chdir(f"{USER_PREFIX}/benchmark_pie/{self.program.split('_')[0]}")
-        current_dir = os.getcwd()
-        logger.info(f"Current directory: {current_dir}")
+    def static_analysis(self, optimized_code, prescreen=True):
+        return super().static_analysis(optimized_code, prescreen)
+
+    def _sample_batch(self, optimized, input_file):
+        # Called inside the measurement slot, measurements must not overlap between workers
+        records = self._run_rapl(self.program.split('_')[0], optimized, input_file)
+        self.measurement_store.append(records)
+        return records
+
+    def _run_rapl(self, problem_id, optimized, input_file):
+        # RAPL/main writes to the log given by RAPL_LOG, kept in the workspace so workers do not share it
+        workspace = self._get_workspace(optimized)
+        current_dir = workspace.path
+        workspace.remove_file("c++.csv")
+        workspace_log_path = workspace.file("c++.csv")
+        iteration = self.optimization_iteration + 1 if optimized else 0
+        if self.energy_meter is not None:
+            try:
+                make_args = [f"input={input_file}", f"problem_id={problem_id}"]
+                samples = self.energy_meter.measure_make_target(current_dir, "measure_optimized" if optimized else "measure", make_args)
+                logger.info("Benchmark.run: in-process RAPL measurement successfully\n")
+                return make_records(self.program, samples, iteration)
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                logger.error(f"Benchmark.run: in-process RAPL measurement failed: {e}\n")
+                return make_records(self.program, [], iteration)
 
         try:
-            input_file = "input.0.txt"
-            measure_unoptimized = ["make", "measure", f"input={input_file}", f"problem_id={problem_id}"]
-            measure_optimized = ["make", "measure_optimized", f"input={input_file}", f"problem_id={problem_id}"]
-            if (self.optimization_iteration == 0):
-                subprocess.run(measure_unoptimized, check=True, capture_output=True, text=True)
+            make_args = [f"input={input_file}", f"problem_id={problem_id}", f"RAPL_LOG={workspace_log_path}"]
+            if self.measurement_env is not None and self.measurement_env.core is not None:
+                # RAPL/main reads the MSRs of the package the measurement is pinned to
+                make_args.append(f"RAPL_CORE={self.measurement_env.core}")
+            measure_unoptimized = ["make", "measure", *make_args]
+            measure_optimized = ["make", "measure_optimized", *make_args]
+            if not optimized:
+                subprocess.run(measure_unoptimized, cwd=current_dir, check=True, capture_output=True, text=True)
             else:
-                subprocess.run(measure_optimized, check=True, capture_output=True, text=True)
+                subprocess.run(measure_optimized, cwd=current_dir, check=True, capture_output=True, text=True)
             logger.info("Benchmark.run: make measure successfully\n")
         except subprocess.CalledProcessError as e:
             logger.error(f"Benchmark.run: make measure failed: {e}\n")
 
-    def _compute_avg(self):
-        energy_data_file = open(f"{USER_PREFIX}/src/runtime_logs/c++.csv", "r")
-        benchmark_data = []
-        for line in energy_data_file:
-            parts = line.split(';')
-            benchmark_name = parts[0].strip()
-            energy_data = [vals.strip() for vals in parts[1].split(',')]
-            
-            #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-            energy_data = [float(num) for num in energy_data if num]
-            benchmark_data.append((benchmark_name, *energy_data))
-
-        energy_data_file.close()
-
-        #Find average energy usage and average runtime
-        avg_energy = 0
-        avg_runtime = 0
-        for data in benchmark_data:
-            if data[1] < 0 or data[2] < 0:
-                benchmark_data.remove(data)
-            else:
-                avg_energy += data[1]
-                avg_runtime += data[2]
+        if not os.path.exists(workspace_log_path):
+            # A RAPL/main built before RAPL_LOG was passed writes to the shared log instead, rebuild it with make -C RAPL
+            logger.error(f"Benchmark.run: RAPL/main did not write {workspace_log_path}, no samples recorded\n")
+            return make_records(self.program, [], iteration)
+        return read_rapl_csv(workspace_log_path, self.program, iteration)
 
-        avg_energy /= len(benchmark_data)
-        avg_runtime /= len(benchmark_data)
-
-        return avg_energy, avg_runtime
-    
     def _extract_content(self, contents):
         # Convert keys to a sorted list to access the first and last elements
         keys = list(contents.keys())
@@ -316,23 +318,11 @@ class PIEBenchmark(Benchmark):
         logger.info("Lowest Average Energy: Average Energy: {}, Average Runtime: {}".format(benchmark_info["lowest_avg_energy"]["avg_energy"], benchmark_info["lowest_avg_energy"]["avg_runtime"]))
         logger.info("Current: Average Energy: {}, Average Runtime: {}".format(benchmark_info["current"]["avg_energy"], benchmark_info["current"]["avg_runtime"]))
 
-def get_valid_pie_programs(num_programs):
-    slow_fast_pairs = []
-    selected_problem_ids = set()
-    source_code = []
-
-    #Extract the first 5 unique problems from the validation set
-    file = open(f"{USER_PREFIX}/benchmark_pie/val.jsonl", "r")
-    for line in file:
-        json_line = json.loads(line)
-        if json_line["problem_id"] not in selected_problem_ids and len(selected_problem_ids) != num_programs:
-            selected_problem_ids.add(json_line["problem_id"])
-            slow_fast_pairs.append(json_line)
-            src_code = json_line["src_code"].replace("\n\n", "\n")
-            source_code.append(src_code)
-        if len(selected_problem_ids) == num_programs:
-            break
-    file.close()
+def get_valid_pie_programs(num_programs, seed=None, min_src_lines=None, max_src_lines=None, min_test_cases=None):
+    # One problem per program, looked up in the val.jsonl index instead of parsing the file
+    index = PIEIndex(f"{USER_PREFIX}/benchmark_pie/val_index.sqlite", f"{USER_PREFIX}/benchmark_pie/val.jsonl", f"{USER_PREFIX}/benchmark_pie/merged_test_cases")
+    slow_fast_pairs = index.select(num_programs, seed=seed, min_src_lines=min_src_lines, max_src_lines=max_src_lines, min_test_cases=min_test_cases)
+    source_code = [pair["src_code"].replace("\n\n", "\n") for pair in slow_fast_pairs]
 
     #Return only the program names
     valid_programs = [f"{pair['problem_id']}_{pair['src_id']}_t{pair['tgt_id'][1:]}.cpp" for pair in slow_fast_pairs]
@@ -341,30 +331,11 @@ def get_valid_pie_programs(num_programs):
     return valid_programs
 
 def setup_benchmarks(valid_programs, source_code):
+    # Re-runs only write what changed and link test cases instead of copying them
+    materializer = PIEMaterializer(
+        f"{USER_PREFIX}/benchmark_pie",
+        f"{USER_PREFIX}/benchmark_pie/merged_test_cases",
+        f"{USER_PREFIX}/benchmark_pie/makefile_template.mak"
+    )
     for i, program in enumerate(valid_programs):
-        #Create the folder if it does not exist
-        folder_path = f"{USER_PREFIX}/benchmark_pie/{program.split('_')[0]}"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-
-        #Create a new cpp file in the folder with the source code
-        file = open(f"{folder_path}/{program}", "w")
-        file.write(f"{source_code[i]}")
-        file.close()
-        
-        #Copy the test case folder from all_test_cases/ into the program's folder
-        problem_id = program.split('_')[0]
-        test_case_folder_src = f"{USER_PREFIX}/benchmark_pie/merged_test_cases/{problem_id}"
-        test_case_folder_dest = f"{folder_path}/test_cases"
-        if not os.path.exists(test_case_folder_dest):
-            shutil.copytree(test_case_folder_src, test_case_folder_dest)
-
-        #Create parameterized Makefile for each problem id folder
-        makefile_template = open(f"{USER_PREFIX}/benchmark_pie/makefile_template.mak", "r")
-        makefile_content = makefile_template.read()
-        makefile_content = makefile_content.replace("${FILE_NAME}", program.split('.')[0])
-        makefile_content = makefile_content.replace("${PROBLEM_ID}", problem_id)
-        makefile_template.close()
-        makefile_template = open(f"{folder_path}/Makefile", "w")
-        makefile_template.write(makefile_content)
-        makefile_template.close()
+        materializer.materialize(program, source_code[i])
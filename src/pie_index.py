@@ -0,0 +1,147 @@
+import glob
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+class PIEIndex:
+    """
+    SQLite index over the PIE val.jsonl and merged_test_cases, built once and rebuilt when
+    either changes. Rows hold the byte offset of every slow/fast pair in val.jsonl with
+    the columns used for selection, so a pair is read back with a single seek instead of
+    parsing the file up to it.
+    """
+    def __init__(self, index_path, jsonl_path, test_cases_dir):
+        self.index_path = index_path
+        self.jsonl_path = jsonl_path
+        self.test_cases_dir = test_cases_dir
+        index_dir = os.path.dirname(index_path)
+        if index_dir and not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        if not self._is_current():
+            self.build()
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=60)
+
+    def _source_fingerprint(self):
+        stat = os.stat(self.jsonl_path)
+        # Test counts change when problems are added to or removed from merged_test_cases, which
+        # changes its mtime, and when test cases are added to or removed from a problem, which
+        # only changes the mtime of the problem directory
+        test_cases = hashlib.sha256()
+        if os.path.isdir(self.test_cases_dir):
+            test_cases.update(str(os.stat(self.test_cases_dir).st_mtime_ns).encode())
+            for entry in sorted(os.scandir(self.test_cases_dir), key=lambda entry: entry.name):
+                if entry.is_dir():
+                    test_cases.update(f"{entry.name}:{entry.stat().st_mtime_ns}".encode())
+        return f"{stat.st_size}:{stat.st_mtime_ns}:{test_cases.hexdigest()}"
+
+    def _is_current(self):
+        if not os.path.exists(self.index_path):
+            return False
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+        except sqlite3.DatabaseError:
+            return False
+        finally:
+            connection.close()
+        return row is not None and row[0] == self._source_fingerprint()
+
+    def _count_test_cases(self, problem_id):
+        return len(glob.glob(os.path.join(self.test_cases_dir, problem_id, "input.*.txt")))
+
+    def build(self):
+        logger.info(f"PIEIndex: indexing {self.jsonl_path}")
+        rows = []
+        test_counts = {}
+        with open(self.jsonl_path, "rb") as file:
+            offset = 0
+            for position, line in enumerate(file):
+                if line.strip():
+                    pair = json.loads(line)
+                    problem_id = pair["problem_id"]
+                    if problem_id not in test_counts:
+                        test_counts[problem_id] = self._count_test_cases(problem_id)
+                    rows.append((position, problem_id, pair["src_id"], pair["tgt_id"], offset, len(line),
+                                 pair["src_code"].replace("\n\n", "\n").count("\n") + 1, len(pair["src_code"]), pair.get("speedup")))
+                offset += len(line)
+
+        # Build into a temporary database and swap it in, concurrent readers never see a partial index
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                connection.execute("""CREATE TABLE pairs (position INTEGER PRIMARY KEY, problem_id TEXT NOT NULL, src_id TEXT NOT NULL,
+                    tgt_id TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, src_lines INTEGER NOT NULL,
+                    src_chars INTEGER NOT NULL, speedup REAL)""")
+                connection.execute("CREATE TABLE problems (problem_id TEXT PRIMARY KEY, num_test_cases INTEGER NOT NULL)")
+                connection.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.executemany("INSERT INTO problems VALUES (?, ?)", test_counts.items())
+                connection.execute("CREATE INDEX pairs_problem ON pairs (problem_id, position)")
+                connection.execute("CREATE INDEX pairs_src ON pairs (src_id)")
+                connection.execute("INSERT INTO meta VALUES ('source', ?)", (self._source_fingerprint(),))
+        finally:
+            connection.close()
+        os.replace(tmp_path, self.index_path)
+        logger.info(f"PIEIndex: {len(rows)} pairs of {len(test_counts)} problems indexed")
+
+    def _read_pair(self, offset, length):
+        with open(self.jsonl_path, "rb") as file:
+            file.seek(offset)
+            return json.loads(file.read(length))
+
+    def get_pair(self, problem_id=None, src_id=None):
+        """First pair of problem_id, or the pair of src_id (optionally within problem_id), None when absent."""
+        if src_id is not None:
+            query, params = "SELECT offset, length FROM pairs WHERE src_id = ?", [src_id]
+            if problem_id is not None:
+                query, params = query + " AND problem_id = ?", params + [problem_id]
+        else:
+            query, params = "SELECT offset, length FROM pairs WHERE problem_id = ?", [problem_id]
+        connection = self._connect()
+        try:
+            row = connection.execute(query + " ORDER BY position LIMIT 1", params).fetchone()
+        finally:
+            connection.close()
+        return self._read_pair(*row) if row is not None else None
+
+    def select(self, num_programs, seed=None, min_src_lines=None, max_src_lines=None, min_test_cases=None):
+        """
+        One pair per problem, the first of each problem in val.jsonl like the original scan.
+        Problems are taken in file order, or sampled reproducibly with seed.
+        Source length is counted in lines after blank-line removal.
+        """
+        conditions, params = [], []
+        for column, operator, value in (("src_lines", ">=", min_src_lines), ("src_lines", "<=", max_src_lines), ("num_test_cases", ">=", min_test_cases)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # The first pair of every problem, filtered after picking it so the chosen pair does not depend on the filters
+        query = f"""SELECT first.offset, first.length FROM (
+                SELECT pairs.*, ROW_NUMBER() OVER (PARTITION BY pairs.problem_id ORDER BY position) AS rank
+                FROM pairs) AS first
+            JOIN problems ON problems.problem_id = first.problem_id
+            {where} {'AND' if where else 'WHERE'} rank = 1 ORDER BY position"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+        if seed is not None:
+            rows = random.Random(seed).sample(rows, min(num_programs, len(rows)))
+        else:
+            rows = rows[:num_programs]
+        if len(rows) < num_programs:
+            logger.warning(f"PIEIndex: only {len(rows)} problems match the selection, {num_programs} requested")
+        return [self._read_pair(offset, length) for offset, length in rows]
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+MANIFEST = ".materialized.json"
+# Written next to the linked test cases by the benchmark itself, never linked or removed
+LOCAL_TEST_FILES = {"golden_outputs.json"}
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def file_hash(path):
+    try:
+        with open(path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+class PIEMaterializer:
+    """
+    Sets up PIE problem folders incrementally.
+    - Sources and Makefiles are only rewritten when their content hash changed, so make
+      does not see a new mtime and rebuild on every run.
+    - Test cases are hardlinked from merged_test_cases, or symlinked when that is on
+      another filesystem, instead of copied. A manifest records the state of the
+      problem's test case folder, unchanged test cases are not even listed again.
+    """
+    def __init__(self, benchmark_dir, test_cases_root, makefile_template_path):
+        self.benchmark_dir = benchmark_dir
+        self.test_cases_root = test_cases_root
+        with open(makefile_template_path, "r") as file:
+            self.makefile_template = file.read()
+
+    def materialize(self, program, source_code):
+        problem_id = program.split('_')[0]
+        folder_path = os.path.join(self.benchmark_dir, problem_id)
+        os.makedirs(folder_path, exist_ok=True)
+        manifest = self._load_manifest(folder_path)
+
+        written = self._write_if_changed(os.path.join(folder_path, program), source_code)
+        makefile_content = self.makefile_template.replace("${FILE_NAME}", program.split('.')[0]).replace("${PROBLEM_ID}", problem_id)
+        written += self._write_if_changed(os.path.join(folder_path, "Makefile"), makefile_content)
+
+        test_case_folder_src = os.path.join(self.test_cases_root, problem_id)
+        test_case_folder_dest = os.path.join(folder_path, "test_cases")
+        state = self._test_cases_state(test_case_folder_src)
+        linked = 0
+        if state != manifest.get("test_cases") or not os.path.isdir(test_case_folder_dest):
+            linked = self._link_test_cases(test_case_folder_src, test_case_folder_dest)
+            manifest["test_cases"] = state
+            self._store_manifest(folder_path, manifest)
+        logger.info(f"PIEMaterializer: {program}, {written} files written, {linked} test case files linked")
+
+    def _write_if_changed(self, path, content):
+        if file_hash(path) == content_hash(content):
+            return 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        return 1
+
+    def _test_cases_state(self, folder):
+        # Adding, removing or replacing a test case file changes the directory mtime
+        try:
+            stat = os.stat(folder)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_nlink}"
+
+    def _link_test_cases(self, source_folder, dest_folder):
+        if not os.path.isdir(source_folder):
+            logger.error(f"PIEMaterializer: no test cases in {source_folder}")
+            return 0
+        os.makedirs(dest_folder, exist_ok=True)
+        names = set(os.listdir(source_folder))
+        linked = 0
+        for name in names:
+            source = os.path.join(source_folder, name)
+            dest = os.path.join(dest_folder, name)
+            if not os.path.isfile(source) or (os.path.exists(dest) and os.path.samefile(source, dest)):
+                continue
+            # Copies left by earlier runs are replaced by links as well
+            tmp_dest = f"{dest}.link.tmp"
+            if os.path.lexists(tmp_dest):
+                os.remove(tmp_dest)
+            try:
+                os.link(source, tmp_dest)
+            except OSError:
+                os.symlink(os.path.abspath(source), tmp_dest)
+            os.replace(tmp_dest, dest)
+            linked += 1
+        for name in set(os.listdir(dest_folder)) - names - LOCAL_TEST_FILES:
+            path = os.path.join(dest_folder, name)
+            if os.path.isfile(path) or os.path.islink(path):
+                os.remove(path)
+        return linked
+
+    def _load_manifest(self, folder_path):
+        try:
+            with open(os.path.join(folder_path, MANIFEST), "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _store_manifest(self, folder_path, manifest):
+        self._write_if_changed(os.path.join(folder_path, MANIFEST), json.dumps(manifest, sort_keys=True))
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import tempfile
+import time
+
+class PreScreen:
+    """
+    One cheap run of a candidate before the full RAPL measurement.
+    The run is timed, or counted in instructions retired through `perf stat`, and compared
+    against the same number for the lowest-energy version so far. A candidate worse than
+    that by more than margin is rejected without being measured. A failed pre-screen run
+    never rejects a candidate, the full measurement decides.
+    """
+    def __init__(self, margin=0.2, metric="time"):
+        if metric not in ("time", "instructions"):
+            raise ValueError(f"Unknown pre-screen metric: {metric}")
+        self.margin = margin
+        self.metric = metric
+
+    def limit(self, reference):
+        if reference is None:
+            return None
+        return reference * (1 + self.margin)
+
+    def sample(self, argv, stdin_path=None, cwd=None, reference=None):
+        """
+        Returns the wall time in seconds or the instructions retired of one run of argv,
+        None when it could not be sampled. With a reference, a timed run is killed as soon
+        as it exceeds the rejection limit.
+        """
+        try:
+            stdin = open(stdin_path, "rb") if stdin_path is not None else subprocess.DEVNULL
+        except OSError:
+            return None
+        timeout = self.limit(reference) if self.metric == "time" else None
+        perf_output = None
+        if self.metric == "instructions":
+            fd, perf_output = tempfile.mkstemp(suffix=".perf")
+            os.close(fd)
+            argv = ["perf", "stat", "-x,", "-e", "instructions", "-o", perf_output, "--", *argv]
+
+        try:
+            start = time.perf_counter()
+            result = subprocess.run(argv, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=cwd, timeout=timeout)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                return None
+            if self.metric == "time":
+                return elapsed
+            return self._parse_instructions(perf_output)
+        except subprocess.TimeoutExpired:
+            return time.perf_counter() - start
+        except OSError:
+            return None
+        finally:
+            if stdin_path is not None:
+                stdin.close()
+            if perf_output is not None and os.path.exists(perf_output):
+                os.remove(perf_output)
+
+    def _parse_instructions(self, path):
+        # perf stat -x, lines look like: <value>,<unit>,<event>,...
+        with open(path, "r") as file:
+            for line in file:
+                fields = line.strip().split(",")
+                if len(fields) > 2 and fields[2].startswith("instructions"):
+                    try:
+                        return float(fields[0])
+                    except ValueError:
+                        # <not counted> or <not supported>
+                        return None
+        return None
+
+    def rejects(self, value, reference):
+        if value is None or reference is None:
+            return False
+        return value > self.limit(reference)
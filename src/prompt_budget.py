@@ -0,0 +1,105 @@
+import difflib
+from memory_policy import count_tokens
+
+class PromptSection:
+    """
+    One part of a prompt: fixed prefix and suffix text around a body the budget may shrink.
+    Optional sections with a diff_base can be sent as a unified diff of the body against it,
+    then cut to their head and tail, then dropped. Lower priority sections are reduced first.
+    """
+    def __init__(self, name, body, prefix="", suffix="", required=False, priority=0, diff_base=None, diff_label="the code above"):
+        self.name = name
+        self.body = body
+        self.prefix = prefix
+        self.suffix = suffix
+        self.required = required
+        self.priority = priority
+        self.diff_base = diff_base
+        self.diff_label = diff_label
+        self.action = "full"
+
+    def text(self):
+        if self.action == "dropped":
+            return ""
+        return self.prefix + self.body + self.suffix
+
+    def tokens(self):
+        return count_tokens(self.text()) if self.action != "dropped" else 0
+
+    def to_diff(self):
+        diff = "\n".join(difflib.unified_diff(
+            self.diff_base.splitlines(), self.body.splitlines(),
+            fromfile="reference", tofile=self.name, n=2, lineterm=""))
+        if not diff:
+            body = f"(identical to {self.diff_label})"
+        else:
+            body = f"(unified diff against {self.diff_label})\n{diff}"
+        if count_tokens(body) >= count_tokens(self.body):
+            return False
+        self.body = body
+        self.action = "diff"
+        return True
+
+    def truncate(self, target_tokens):
+        lines = self.body.splitlines(keepends=True)
+        body_tokens = count_tokens(self.body)
+        if body_tokens <= target_tokens or len(lines) < 3:
+            return False
+        # Keep the same number of lines at both ends, signatures and the final output usually matter most
+        keep = max(1, int(len(lines) * target_tokens / body_tokens) // 2)
+        omitted = len(lines) - 2 * keep
+        if omitted <= 0:
+            return False
+        self.body = "".join(lines[:keep]) + f"[... {omitted} lines omitted ...]\n" + "".join(lines[-keep:])
+        self.action = "truncated" if self.action == "full" else self.action + "+truncated"
+        return True
+
+class PromptBudget:
+    """
+    Assembles prompts from PromptSections under max_tokens. Required sections are always
+    sent verbatim, even when they alone exceed the budget. Optional sections are reduced
+    in priority order, each step only as far as needed:
+    diff against their diff_base, truncation to min_section_tokens or more, dropping.
+    With max_tokens None nothing is reduced and only the token accounting is done.
+    """
+    def __init__(self, max_tokens=None, min_section_tokens=200):
+        self.max_tokens = max_tokens
+        self.min_section_tokens = min_section_tokens
+
+    def assemble(self, sections):
+        """Returns the prompt and a report with the name, tokens, original_tokens and action of every section."""
+        original_tokens = [section.tokens() for section in sections]
+        if self.max_tokens is not None:
+            optional = sorted((section for section in sections if not section.required), key=lambda section: section.priority)
+            for reduce in (self._diff, self._truncate, self._drop):
+                for section in optional:
+                    excess = sum(part.tokens() for part in sections) - self.max_tokens
+                    if excess <= 0:
+                        break
+                    reduce(section, excess)
+        report = [
+            {"name": section.name, "tokens": section.tokens(), "original_tokens": tokens, "action": section.action}
+            for section, tokens in zip(sections, original_tokens)
+        ]
+        return "".join(section.text() for section in sections), report
+
+    def _diff(self, section, excess):
+        if section.diff_base is not None:
+            section.to_diff()
+
+    def _truncate(self, section, excess):
+        body_tokens = count_tokens(section.body)
+        section.truncate(max(self.min_section_tokens, body_tokens - excess))
+
+    def _drop(self, section, excess):
+        section.action = "dropped"
+
+def format_report(report):
+    total = sum(entry["tokens"] for entry in report)
+    parts = []
+    for entry in report:
+        part = f"{entry['name']}={entry['tokens']}"
+        if entry["action"] != "full":
+            part += f" ({entry['action']} from {entry['original_tokens']})"
+        parts.append(part)
+    return f"{total} tokens: " + ", ".join(parts)
@@ -0,0 +1,220 @@
+import glob
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+# Same registers as RAPL/rapl.h
+MSR_RAPL_POWER_UNIT = 0x606
+MSR_PKG_ENERGY_STATUS = 0x611
+MSR_PP0_ENERGY_STATUS = 0x639
+MSR_PP1_ENERGY_STATUS = 0x641
+MSR_DRAM_ENERGY_STATUS = 0x619
+
+DOMAINS = ["package", "core", "gpu", "dram"]
+# powercap zone names of the package sub-domains
+POWERCAP_DOMAINS = {"core": "core", "uncore": "gpu", "dram": "dram"}
+
+class PowercapBackend:
+    """Reads the RAPL counters exported by the kernel under /sys/class/powercap/intel-rapl:<package>."""
+    def __init__(self, root="/sys/class/powercap", package=0):
+        self.root = root
+        package_zone = os.path.join(root, f"intel-rapl:{package}")
+        if not os.path.exists(os.path.join(package_zone, "energy_uj")):
+            raise FileNotFoundError(f"No powercap RAPL zone at {package_zone}")
+
+        self.zones = {"package": package_zone}
+        for zone in sorted(glob.glob(os.path.join(package_zone, f"intel-rapl:{package}:*"))):
+            domain = POWERCAP_DOMAINS.get(self._read_file(zone, "name"))
+            if domain is not None:
+                self.zones[domain] = zone
+        self.max_energy = {domain: int(self._read_file(zone, "max_energy_range_uj")) / 1e6 for domain, zone in self.zones.items()}
+
+    def _read_file(self, zone, name):
+        with open(os.path.join(zone, name), "r") as file:
+            return file.read().strip()
+
+    def read(self):
+        """Returns the current counter of every domain in Joules."""
+        return {domain: int(self._read_file(zone, "energy_uj")) / 1e6 for domain, zone in self.zones.items()}
+
+    def close(self):
+        pass
+
+class MSRBackend:
+    """Reads the RAPL MSRs through /dev/cpu/<core>/msr, the same logic as RAPL/rapl.c."""
+    def __init__(self, core=0):
+        self.fd = os.open(f"/dev/cpu/{core}/msr", os.O_RDONLY)
+        units = self._read_msr(MSR_RAPL_POWER_UNIT)
+        self.energy_units = 0.5 ** ((units >> 8) & 0x1f)
+
+        self.registers = {}
+        for domain, register in [("package", MSR_PKG_ENERGY_STATUS), ("core", MSR_PP0_ENERGY_STATUS), ("gpu", MSR_PP1_ENERGY_STATUS), ("dram", MSR_DRAM_ENERGY_STATUS)]:
+            try:
+                self._read_msr(register)
+                self.registers[domain] = register
+            except OSError:
+                # Domain not available on this CPU model
+                pass
+        # Energy status registers are 32-bit counters
+        self.max_energy = {domain: (1 << 32) * self.energy_units for domain in self.registers}
+
+    def _read_msr(self, register):
+        data = os.pread(self.fd, 8, register)
+        if len(data) != 8:
+            raise OSError(f"Short read of MSR {hex(register)}")
+        return int.from_bytes(data, "little")
+
+    def read(self):
+        return {domain: (self._read_msr(register) & 0xffffffff) * self.energy_units for domain, register in self.registers.items()}
+
+    def close(self):
+        os.close(self.fd)
+
+class FakeSysfs:
+    """
+    powercap-like directory tree whose counters advance at a constant power, for machines without RAPL.
+    A small max_energy_range_uj makes the counters wrap quickly.
+    """
+    def __init__(self, root=None, watts=None, max_energy_range_uj=2 ** 32):
+        self.root = root if root is not None else tempfile.mkdtemp(prefix="fake_powercap_")
+        self.watts = watts if watts is not None else {"package": 30.0, "core": 20.0, "uncore": 1.0, "dram": 3.0}
+        self.max_energy_range_uj = max_energy_range_uj
+        self.start_time = time.perf_counter()
+
+        self.zones = {"package": os.path.join(self.root, "intel-rapl:0")}
+        for i, name in enumerate(name for name in self.watts if name != "package"):
+            self.zones[name] = os.path.join(self.zones["package"], f"intel-rapl:0:{i}")
+        for name, zone in self.zones.items():
+            os.makedirs(zone, exist_ok=True)
+            self._write(zone, "name", "package-0" if name == "package" else name)
+            self._write(zone, "max_energy_range_uj", str(max_energy_range_uj))
+        self.update()
+
+    def _write(self, zone, name, value):
+        with open(os.path.join(zone, name), "w") as file:
+            file.write(value + "\n")
+
+    def update(self):
+        elapsed = time.perf_counter() - self.start_time
+        for name, zone in self.zones.items():
+            energy_uj = int(self.watts[name] * elapsed * 1e6) % self.max_energy_range_uj
+            self._write(zone, "energy_uj", str(energy_uj))
+
+class FakeSysfsBackend(PowercapBackend):
+    def __init__(self, fake_sysfs=None):
+        self.fake_sysfs = fake_sysfs if fake_sysfs is not None else FakeSysfs()
+        super().__init__(root=self.fake_sysfs.root)
+
+    def read(self):
+        self.fake_sysfs.update()
+        return super().read()
+
+def create_backend(name, core=0):
+    if name == "powercap":
+        return PowercapBackend()
+    elif name == "msr":
+        return MSRBackend(core)
+    elif name == "fake":
+        return FakeSysfsBackend()
+    raise ValueError(f"Unknown RAPL backend: {name}")
+
+def parse_measure_command(build_dir, target, make_args=()):
+    """
+    Extracts the program RAPL/main would run for a Makefile measure target.
+    Returns (argv, stdin_path, test_name).
+    """
+    result = subprocess.run(["make", "-n", target, *make_args], cwd=build_dir, capture_output=True, text=True, check=True)
+    for line in result.stdout.splitlines():
+        tokens = shlex.split(line)
+        for i, token in enumerate(tokens):
+            if token.endswith("RAPL/main") and len(tokens) > i + 3:
+                command, test_name = tokens[i + 1], tokens[i + 3]
+                stdin_path = None
+                if "<" in command:
+                    command, stdin_path = command.split("<", 1)
+                    stdin_path = os.path.join(build_dir, stdin_path.strip())
+                argv = shlex.split(command)
+                argv[0] = os.path.join(build_dir, argv[0])
+                return argv, stdin_path, test_name
+    raise ValueError(f"No RAPL/main command in make {target}")
+
+class EnergyMeter:
+    """
+    Measures energy and runtime of a directly exec'd child process, without going through
+    make, sudo, RAPL/main and a shell for every sample.
+    """
+    def __init__(self, backend, trials=5, environment=None):
+        self.backend = backend
+        self.trials = trials
+        self.environment = environment
+
+    def _energy_delta(self, before, after):
+        delta = {}
+        for domain in before:
+            energy = after[domain] - before[domain]
+            # The counter wrapped around during the run
+            if energy < 0:
+                energy += self.backend.max_energy[domain]
+            delta[domain] = energy
+        return delta
+
+    def run_once(self, argv, stdin_path=None, cwd=None):
+        """
+        Returns {domain: Joules, ..., "runtime": ms, "returncode": int} for one run of argv,
+        with a measurement environment also the "background_load" during the run.
+        """
+        stdin = open(stdin_path, "rb") if stdin_path is not None else subprocess.DEVNULL
+        cpu_times_before = self.environment.cpu_times() if self.environment is not None else None
+        try:
+            before = self.backend.read()
+            start = time.perf_counter()
+            process = subprocess.Popen(argv, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=cwd)
+            # wait4 also returns the CPU time of the child alone
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            runtime = (time.perf_counter() - start) * 1000
+            after = self.backend.read()
+        finally:
+            if stdin_path is not None:
+                stdin.close()
+
+        sample = self._energy_delta(before, after)
+        sample["runtime"] = runtime
+        sample["returncode"] = process.returncode
+        if self.environment is not None:
+            sample["background_load"] = self.environment.trial_load(
+                cpu_times_before, self.environment.cpu_times(), rusage.ru_utime + rusage.ru_stime, runtime / 1000)
+        return sample
+
+    def measure(self, argv, stdin_path=None, cwd=None, trials=None):
+        trials = trials if trials is not None else self.trials
+        if self.environment is None or self.environment.max_load is None:
+            return [self.run_once(argv, stdin_path, cwd) for _ in range(trials)]
+
+        # Noisy trials are rejected and repeated, up to max_rejected of them
+        samples, rejected = [], 0
+        while len(samples) < trials:
+            load = self.environment.wait_until_quiet()
+            sample = self.run_once(argv, stdin_path, cwd)
+            noisy = self.environment.is_noisy(load) or self.environment.is_noisy(sample["background_load"])
+            if noisy and rejected < self.environment.max_rejected:
+                rejected += 1
+                continue
+            samples.append(sample)
+        if rejected:
+            logger.info(f"EnergyMeter: rejected {rejected} trials with background load above {self.environment.max_load} cores")
+        return samples
+
+    def parse_measure_command(self, build_dir, target, make_args=()):
+        return parse_measure_command(build_dir, target, make_args)
+
+    def measure_make_target(self, build_dir, target, make_args=()):
+        """Drop-in replacement for `make <target>`, returns one sample per trial."""
+        argv, stdin_path, test_name = self.parse_measure_command(build_dir, target, make_args)
+        return self.measure(argv, stdin_path, cwd=build_dir)
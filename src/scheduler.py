@@ -0,0 +1,159 @@
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from utils import Logger
+
+logger = Logger("logs", sys.argv[2]).logger
+
+# Per-worker state, set by _init_worker in every child process of the pool
+_measurement_lock = None
+_llm_semaphore = None
+_reserved_core = None
+_build_semaphore = None
+
+def _init_worker(measurement_lock, llm_semaphore, reserved_core, build_semaphore=None):
+    global _measurement_lock, _llm_semaphore, _reserved_core, _build_semaphore
+    _measurement_lock = measurement_lock
+    _llm_semaphore = llm_semaphore
+    _reserved_core = reserved_core
+    _build_semaphore = build_semaphore
+
+    # Keep LLM/compile/test work off the core reserved for RAPL measurements
+    if reserved_core is not None:
+        cores = os.sched_getaffinity(0) - {reserved_core}
+        if cores:
+            os.sched_setaffinity(0, cores)
+
+class MeasurementSlot:
+    """Serializes energy measurements across workers and pins them to the reserved core."""
+    def __init__(self, lock, reserved_core):
+        self.lock = lock
+        self.reserved_core = reserved_core
+        self.previous_affinity = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.reserved_core is not None:
+            self.previous_affinity = os.sched_getaffinity(0)
+            # make/sudo/RAPL children inherit this affinity
+            os.sched_setaffinity(0, {self.reserved_core})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.previous_affinity is not None:
+                os.sched_setaffinity(0, self.previous_affinity)
+                self.previous_affinity = None
+        finally:
+            self.lock.release()
+        return False
+
+def get_measurement_slot():
+    if _measurement_lock is None:
+        return contextlib.nullcontext()
+    return MeasurementSlot(_measurement_lock, _reserved_core)
+
+def get_build_slot():
+    if _build_semaphore is None:
+        return contextlib.nullcontext()
+    return _build_semaphore
+
+def get_llm_limiter():
+    if _llm_semaphore is None:
+        return contextlib.nullcontext()
+    return _llm_semaphore
+
+class ProgramScheduler:
+    def __init__(self, num_workers=None, llm_concurrency=None, reserved_core=0):
+        cpu_count = os.cpu_count() or 1
+        if num_workers is None:
+            # One core stays reserved for measurements
+            num_workers = max(1, cpu_count - 1)
+        if reserved_core is not None and reserved_core >= cpu_count:
+            logger.warning(f"Reserved measurement core {reserved_core} does not exist, measurements will not be pinned")
+            reserved_core = None
+        self.num_workers = num_workers
+        self.llm_concurrency = llm_concurrency
+        self.reserved_core = reserved_core
+
+    def run(self, worker_fn, programs, *args):
+        """
+        Run worker_fn(program, *args) for every program and return {program: result}.
+        Optimization loops run in separate processes so every benchmark keeps its own
+        working directory, LLM calls are capped at llm_concurrency and energy
+        measurements are serialized on the reserved core.
+        """
+        programs = list(programs)
+        num_workers = min(self.num_workers, len(programs))
+        if num_workers <= 1:
+            results = {}
+            for program in programs:
+                try:
+                    results[program] = worker_fn(program, *args)
+                    logger.info(f"Finished optimizing {program}")
+                except Exception as e:
+                    logger.error(f"Optimization of {program} failed: {e}")
+                    results[program] = f"Optimization failed: {e}"
+            return results
+
+        logger.info(f"Scheduling {len(programs)} programs on {num_workers} workers")
+        context = multiprocessing.get_context("fork")
+        measurement_lock = context.Lock()
+        llm_semaphore = context.BoundedSemaphore(self.llm_concurrency) if self.llm_concurrency else None
+
+        results = {}
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(measurement_lock, llm_semaphore, self.reserved_core)
+        ) as executor:
+            futures = {executor.submit(worker_fn, program, *args): program for program in programs}
+            for future in as_completed(futures):
+                program = futures[future]
+                try:
+                    results[program] = future.result()
+                    logger.info(f"Finished optimizing {program}")
+                except Exception as e:
+                    logger.error(f"Optimization of {program} failed: {e}")
+                    results[program] = f"Optimization failed: {e}"
+
+        # Keep results in the order programs were selected
+        return {program: results[program] for program in programs}
+
+    def run_batched(self, worker_fn, programs, coordinator, *args):
+        """
+        Run worker_fn(program, *args) for every program in threads of this process, advancing
+        them in rounds through coordinator (a batch_llm.BatchCoordinator): LLM requests of a
+        round are batched together. Energy measurements are still serialized on the reserved core.
+        """
+        programs = list(programs)
+        # Every program gets a thread so all of them reach the round's LLM request, but only
+        # num_workers build or test at once. A thread waiting for a build slot is still running
+        # for the coordinator, the round is flushed once it got through and blocks on a request.
+        # Threads started below inherit the affinity set here
+        _init_worker(threading.Lock(), None, self.reserved_core, threading.BoundedSemaphore(self.num_workers))
+        coordinator.join(len(programs))
+
+        def run(program):
+            try:
+                return worker_fn(program, *args)
+            finally:
+                coordinator.leave()
+
+        logger.info(f"Running {len(programs)} programs in batch rounds")
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(programs))) as executor:
+            futures = {executor.submit(run, program): program for program in programs}
+            for future in as_completed(futures):
+                program = futures[future]
+                try:
+                    results[program] = future.result()
+                    logger.info(f"Finished optimizing {program}")
+                except Exception as e:
+                    logger.error(f"Optimization of {program} failed: {e}")
+                    results[program] = f"Optimization failed: {e}"
+        return {program: results[program] for program in programs}
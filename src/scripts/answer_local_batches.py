@@ -0,0 +1,53 @@
+"""
+Answers the pending jobs of the local batch backend (main.py --batch_backend local) by sending
+every request to an OpenAI-compatible chat completions endpoint, one at a time. With
+OPENAI_BASE_URL pointing at scripts/fake_openai_server.py a whole batch run can be tested offline:
+
+    python src/scripts/answer_local_batches.py --batch_dir batch_jobs --watch
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from dotenv import load_dotenv
+from openai import OpenAI
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Answer local batch jobs")
+    parser.add_argument("--batch_dir", type=str, required=True)
+    parser.add_argument("--watch", action="store_true", help="keep answering new jobs")
+    parser.add_argument("--interval", type=float, default=1, help="seconds between scans with --watch")
+    return parser.parse_args()
+
+def answer_job(client, input_path):
+    output_path = input_path.replace(".input.jsonl", ".output.jsonl")
+    if os.path.exists(output_path):
+        return False
+    lines = []
+    with open(input_path, "r") as file:
+        for line in file:
+            request = json.loads(line)
+            try:
+                completion = client.chat.completions.create(**request["body"])
+                lines.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": completion.model_dump()}})
+            except Exception as e:
+                lines.append({"custom_id": request["custom_id"], "error": {"message": str(e)}})
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        for line in lines:
+            file.write(json.dumps(line) + "\n")
+    os.replace(tmp_path, output_path)
+    print(f"Answered {len(lines)} requests of {os.path.basename(input_path)}")
+    return True
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_arguments()
+    client = OpenAI(api_key=os.getenv("API_KEY"))
+    while True:
+        for input_path in sorted(glob.glob(os.path.join(args.batch_dir, "*.input.jsonl"))):
+            answer_job(client, input_path)
+        if not args.watch:
+            break
+        time.sleep(args.interval)
@@ -1,6 +1,10 @@
 import os
 import subprocess
+import sys
+import time
 from dotenv import load_dotenv
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from measurement_store import MeasurementStore, aggregate, read_rapl_csv
 load_dotenv()
 USER_PREFIX = os.getenv('USER_PREFIX')
 
@@ -12,6 +16,7 @@ energy_csv_file = open(f"{USER_PREFIX}/energy/data/C++.csv", 'w')
 energy_csv_file.close()
 
 compiler_optimized = False
+run_start = time.time()
 
 #Iterate through all the folders in benchmarks folder
 for benchmark in benchmark_dirs:
@@ -36,37 +41,15 @@ for benchmark in benchmark_dirs:
 
     
 
-#Now process C++.csv NUM_TRIALS lines at a time and get average energy and runtime values
-energy_data_file = open(f"{USER_PREFIX}/energy/data/C++.csv")
-benchmark_data = []
+#Now load C++.csv into typed records and store them with the earlier runs
+store = MeasurementStore(f"{USER_PREFIX}/energy/data/measurements.bin")
+store.append(read_rapl_csv(f"{USER_PREFIX}/energy/data/C++.csv"))
 
-for line in energy_data_file:
-    parts = line.split(';')
-    benchmark_name = parts[0].strip()
-    energy_data = [vals.strip() for vals in parts[1].split(',')]
-    
-    #Remove empty strings for CPU, GPU, DRAM and convert remaining numbers to floats
-    energy_data = [float(num) for num in energy_data if num]
-    benchmark_data.append((benchmark_name, *energy_data))
-
-#Find average energy usage and average runtime
-averages = []
-for i in range(0, len(benchmark_data), 5):
-    n_runs_data = benchmark_data[i:i + 5]
-
-    total_energy = 0
-    total_runtime = 0
-    count = 0
-    
-    for data in n_runs_data:
-        total_energy += data[1]
-        total_runtime += data[2]
-        count += 1
-
-    avg_energy = round(total_energy / count, 3)
-    avg_runtime = round(total_runtime / count, 3)
-
-    full_report[n_runs_data[0][0]] = (avg_energy, avg_runtime)
+#Average every benchmark's trials of this run, read back from the store
+records = store.load()
+records = records[records["timestamp"] >= run_start]
+for benchmark, stats in aggregate(records).items():
+    full_report[benchmark] = (round(stats["energy"]["mean"], 3), round(stats["runtime"]["mean"], 3))
 
 #Print out results nicely
 for benchmark in full_report.keys():
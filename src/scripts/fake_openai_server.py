@@ -0,0 +1,115 @@
+"""
+Local OpenAI-compatible chat completions server to exercise the LLM call layer.
+Every response is valid for OptimizationReasoning, ErrorReasoning and Feedback. Failures,
+rate-limit headers and slow responses can be injected, for example:
+
+    python src/scripts/fake_openai_server.py --port 8089 --fail_every 2 --fail_status 429 --retry_after 1
+    OPENAI_BASE_URL=http://localhost:8089/v1 API_KEY=fake python src/main.py ...
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--fail_every", type=int, default=0, help="fail every Nth request (0: never)")
+    parser.add_argument("--fail_status", type=int, default=429, help="HTTP status of injected failures")
+    parser.add_argument("--retry_after", type=float, default=None, help="Retry-After seconds sent with injected failures")
+    parser.add_argument("--delay", type=float, default=0, help="seconds before every response, to trigger client timeouts")
+    parser.add_argument("--chunk_delay", type=float, default=0.01, help="seconds between streamed chunks")
+    parser.add_argument("--tokens_per_minute", type=int, default=30000, help="limit reported in the x-ratelimit headers")
+    parser.add_argument("--final_code_file", type=str, default=None, help="code returned as final_code (default: empty)")
+    return parser.parse_args()
+
+def make_handler(args):
+    counter = {"requests": 0, "tokens": 0}
+    lock = threading.Lock()
+    final_code = ""
+    if args.final_code_file:
+        with open(args.final_code_file, "r") as file:
+            final_code = file.read()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body, headers):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, number, model, content, prompt_tokens, headers):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            base = {"id": f"chatcmpl-fake-{number}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+            pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+            for index, piece in enumerate(pieces):
+                delta = {"role": "assistant", "content": piece} if index == 0 else {"content": piece}
+                chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(args.chunk_delay)
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))}\n\n".encode())
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1, "total_tokens": prompt_tokens + len(content) // 4 + 1}
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt_tokens = sum(len(message.get("content") or "") // 4 + 1 for message in request.get("messages", []))
+            with lock:
+                counter["requests"] += 1
+                counter["tokens"] += prompt_tokens
+                number, used = counter["requests"], counter["tokens"]
+            if args.delay:
+                time.sleep(args.delay)
+            headers = {
+                "x-ratelimit-limit-tokens": str(args.tokens_per_minute),
+                "x-ratelimit-remaining-tokens": str(max(0, args.tokens_per_minute - used)),
+                "x-ratelimit-reset-tokens": "1s"
+            }
+            if args.fail_every and number % args.fail_every == 0:
+                if args.retry_after is not None:
+                    headers["retry-after"] = str(args.retry_after)
+                self._send(args.fail_status, {"error": {"message": "injected failure", "type": "fake_error", "code": None}}, headers)
+                return
+            content = json.dumps({
+                "analysis": "fake analysis",
+                "optimization_opportunities": "none",
+                "strategies": [{"Strategy": "keep", "Pros": "", "Cons": ""}],
+                "selected_strategy": "keep",
+                "final_code": final_code,
+                "feedback": "fake feedback"
+            })
+            if request.get("stream"):
+                self._send_stream(number, request.get("model", "gpt-4o"), content, prompt_tokens, headers)
+                return
+            self._send(200, {
+                "id": f"chatcmpl-fake-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content, "refusal": None}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4 + 1, "total_tokens": prompt_tokens + len(content) // 4 + 1}
+            }, headers)
+
+        def log_message(self, format, *log_args):
+            print(f"{self.command} {self.path} -> " + format % log_args)
+
+    return Handler
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(args))
+    print(f"Fake OpenAI server on http://localhost:{args.port}/v1")
+    server.serve_forever()
@@ -3,5 +3,7 @@ from enum import Enum
 class Status(Enum):
     COMPILATION_ERROR = "Compilation Error"
     RUNTIME_ERROR_OR_TEST_FAILED = "Runtime Error/Test Failed"
+    PRESCREEN_REJECTED = "Rejected by Pre-screen"
+    MEASUREMENT_FAILED = "Measurement Failed"
     ALL_TEST_PASSED = "All Test Passed"
     PERFORMANCE_IMPROVED = "Performance Improved"
\ No newline at end of file
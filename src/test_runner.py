@@ -0,0 +1,129 @@
+import concurrent.futures
+import os
+import signal
+import subprocess
+import threading
+from output_compare import compare_stream, normalize
+
+def _kill(process):
+    # Cases run in their own session, kill the whole group so make's children go too
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+class TestCaseRunner:
+    """
+    Runs a command against many (input_file, expected_output) test cases in parallel.
+    Output is streamed through a StreamingComparator, so a case is stopped at the first
+    divergence and memory stays flat for large outputs. The first failing case stops
+    the run: pending cases are cancelled and running ones are killed.
+    A case checked against an OutputDigest with a source file is run once more against the
+    expected text when it fails, so the failure reports where the outputs differ.
+    """
+    def __init__(self, max_workers=None, timeout=10):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+
+    def _locate_mismatch(self, argv, cwd, input_file, expected):
+        """
+        Diff of a case that failed against a digest, from a second run compared with the
+        expected text. None when the digest has no source file or the second run passed.
+        """
+        source = getattr(expected, "source", None)
+        if source is None:
+            return None
+        with open(source, "rb") as file:
+            text = normalize(file.read().decode("latin-1"))
+        stdin = open(input_file, "rb") if input_file is not None else subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(argv, cwd=cwd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True)
+        finally:
+            if input_file is not None:
+                stdin.close()
+        timer = threading.Timer(self.timeout, _kill, [process]) if self.timeout else None
+        if timer is not None:
+            timer.start()
+        try:
+            comparator, exhausted = compare_stream(process.stdout, text)
+            if not exhausted:
+                _kill(process)
+            process.stdout.close()
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        return None if comparator.matched else comparator.diff()
+
+    def run(self, argv, test_cases, cwd):
+        """
+        expected_output is normalized with output_compare.normalize or an OutputDigest,
+        input_file may be None.
+        Returns None when every case passed, otherwise the first failure as a dict
+        with input_file, reason and diff.
+        """
+        stop = threading.Event()
+        lock = threading.Lock()
+        running = set()
+
+        def run_case(input_file, expected):
+            if stop.is_set():
+                return None
+            stdin = open(input_file, "rb") if input_file is not None else subprocess.DEVNULL
+            try:
+                process = subprocess.Popen(argv, cwd=cwd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=True)
+            finally:
+                if input_file is not None:
+                    stdin.close()
+            with lock:
+                running.add(process)
+                if stop.is_set():
+                    _kill(process)
+
+            timed_out = threading.Event()
+            def on_timeout():
+                timed_out.set()
+                _kill(process)
+            timer = threading.Timer(self.timeout, on_timeout) if self.timeout else None
+            if timer is not None:
+                timer.start()
+            try:
+                comparator, exhausted = compare_stream(process.stdout, expected)
+                if not exhausted:
+                    _kill(process)
+                process.stdout.close()
+                process.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                with lock:
+                    running.discard(process)
+
+            if timed_out.is_set():
+                return {"input_file": input_file, "reason": f"timeout after {self.timeout}s", "diff": ""}
+            if stop.is_set():
+                # Killed because another case already failed
+                return None
+            if exhausted and process.returncode != 0:
+                return {"input_file": input_file, "reason": f"exit code {process.returncode}", "diff": ""}
+            if not comparator.matched:
+                diff = None if stop.is_set() else self._locate_mismatch(argv, cwd, input_file, expected)
+                return {"input_file": input_file, "reason": "output mismatch", "diff": diff or comparator.diff()}
+            return None
+
+        failure = None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(run_case, input_file, expected) for input_file, expected in test_cases]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result is None:
+                    continue
+                failure = result
+                stop.set()
+                for pending in futures:
+                    pending.cancel()
+                with lock:
+                    for process in running:
+                        _kill(process)
+                break
+        return failure
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+
+# Build products and per-candidate files that must never be shared between workspaces
+GENERATED_PREFIXES = ("optimized_", "ast_")
+GENERATED_SUFFIXES = (".o", ".gpp_run", ".csv", ".bin")
+
+class Workspace:
+    """
+    Private directory for one run of a benchmark: source, binaries, AST and measurement log.
+    Everything else in the benchmark folder (Makefile, inputs, test cases) is symlinked,
+    so make runs unchanged with cwd=workspace.path and concurrent candidates never clobber
+    each other's files.
+    """
+    def __init__(self, source_dir, name="workspace", root=None):
+        self.source_dir = source_dir
+        if root is not None and not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=f"{name}_", dir=root)
+
+        for entry in os.listdir(source_dir):
+            if entry.startswith(GENERATED_PREFIXES) or entry.endswith(GENERATED_SUFFIXES):
+                continue
+            os.symlink(os.path.join(source_dir, entry), os.path.join(self.path, entry))
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def write_file(self, name, content):
+        path = self.file(name)
+        # Never write through a symlink into the shared benchmark folder
+        if os.path.islink(path):
+            os.remove(path)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def remove_file(self, name):
+        # Files written by sudo RAPL/main are owned by root, remove instead of truncating
+        path = self.file(name)
+        if os.path.lexists(path):
+            os.remove(path)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,48 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# Modules create their logger from sys.argv[2] at import time, like main.py is run with
+if len(sys.argv) < 3:
+    sys.argv += [""] * (3 - len(sys.argv))
+
+from openai import OpenAI
+from utils import Logger
+
+# Logger is a singleton, created here the test logs go to a temporary directory
+Logger(tempfile.mkdtemp(prefix="tests_logs_"), "tests")
+
+FAKE_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "scripts", "fake_openai_server.py")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def fake_server():
+    processes = []
+    def start(*args):
+        port = free_port()
+        process = subprocess.Popen([sys.executable, FAKE_SERVER, "--port", str(port), *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes.append(process)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("localhost", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        return OpenAI(api_key="fake", base_url=f"http://localhost:{port}/v1", max_retries=0)
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait()
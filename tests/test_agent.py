@@ -0,0 +1,48 @@
+import asyncio
+import time
+from pydantic import BaseModel
+import agent
+from agent import AsyncLLMAgent, generate_concurrently, get_request_semaphore
+
+class Reply(BaseModel):
+    analysis: str
+    feedback: str
+
+def test_async_agents_share_the_request_semaphore(fake_server, monkeypatch):
+    client = fake_server("--delay", "0.3")
+    monkeypatch.setenv("OPENAI_BASE_URL", str(client.base_url))
+    monkeypatch.setattr(agent, "MAX_CONCURRENCY", 1)
+    agents = [AsyncLLMAgent("fake", "gpt-4o") for _ in range(3)]
+    for async_agent in agents:
+        async_agent.add_to_memory("user", "optimize")
+
+    async def run():
+        assert all(async_agent._request_slot() is get_request_semaphore() for async_agent in agents)
+        start = time.monotonic()
+        statuses = await generate_concurrently([(async_agent, Reply) for async_agent in agents])
+        return statuses, time.monotonic() - start
+    statuses, elapsed = asyncio.run(run())
+
+    assert statuses == [1, 1, 1]
+    # One request in flight at a time across the three agents
+    assert elapsed >= 0.9
+    for async_agent in agents:
+        assert Reply.model_validate_json(async_agent.memory[-1]["content"]).feedback == "fake feedback"
+
+def test_async_agent_with_its_own_semaphore(fake_server, monkeypatch):
+    client = fake_server("--delay", "0.3")
+    monkeypatch.setenv("OPENAI_BASE_URL", str(client.base_url))
+    monkeypatch.setattr(agent, "MAX_CONCURRENCY", 1)
+
+    async def run():
+        semaphore = asyncio.Semaphore(3)
+        agents = [AsyncLLMAgent("fake", "gpt-4o", semaphore=semaphore) for _ in range(3)]
+        for async_agent in agents:
+            async_agent.add_to_memory("user", "optimize")
+        start = time.monotonic()
+        statuses = await generate_concurrently([(async_agent, Reply) for async_agent in agents])
+        return statuses, time.monotonic() - start
+    statuses, elapsed = asyncio.run(run())
+
+    assert statuses == [1, 1, 1]
+    assert elapsed < 0.9
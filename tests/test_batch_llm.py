@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from pydantic import BaseModel
+from batch_llm import BatchCoordinator, LocalFileBatchBackend
+from scheduler import ProgramScheduler, get_build_slot
+
+class Reply(BaseModel):
+    feedback: str
+
+def echo(body):
+    return f"{body['model']}:{body['messages'][-1]['content']}"
+
+class RecordingBackend(LocalFileBatchBackend):
+    """Keeps the size of every submitted job."""
+    def __init__(self, batch_dir, responder=None):
+        super().__init__(batch_dir, responder)
+        self.jobs = []
+
+    def submit(self, requests):
+        self.jobs.append(len(requests))
+        return super().submit(requests)
+
+def run_programs(coordinator, requests_per_program):
+    # One thread per program, program i makes requests_per_program[i] requests
+    results = {}
+    def program(index, count):
+        try:
+            results[index] = [coordinator.request("gpt-4o", [{"role": "user", "content": f"{index}.{round}"}], Reply)
+                              for round in range(count)]
+        finally:
+            coordinator.leave()
+    coordinator.join(len(requests_per_program))
+    threads = [threading.Thread(target=program, args=(index, count)) for index, count in enumerate(requests_per_program)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+def test_requests_of_a_round_go_out_as_one_job(tmp_path):
+    backend = RecordingBackend(str(tmp_path), echo)
+    coordinator = BatchCoordinator(backend, poll_interval=0.01)
+    results = run_programs(coordinator, [2, 2, 2])
+    assert backend.jobs == [3, 3]
+    assert coordinator.rounds == 2
+    for index in range(3):
+        assert [result["content"] for result in results[index]] == [f"gpt-4o:{index}.0", f"gpt-4o:{index}.1"]
+
+def test_finished_programs_leave_the_round(tmp_path):
+    backend = RecordingBackend(str(tmp_path), echo)
+    coordinator = BatchCoordinator(backend, poll_interval=0.01)
+    results = run_programs(coordinator, [1, 3])
+    assert backend.jobs == [2, 1, 1]
+    assert [result["content"] for result in results[1]] == ["gpt-4o:1.0", "gpt-4o:1.1", "gpt-4o:1.2"]
+
+def test_job_is_polled_until_its_output_exists(tmp_path):
+    # Without a responder another process answers the job, here a thread once the job was submitted
+    backend = LocalFileBatchBackend(str(tmp_path))
+    coordinator = BatchCoordinator(backend, poll_interval=0.01)
+    def answer():
+        while not list(tmp_path.glob("*.input.jsonl")):
+            time.sleep(0.05)
+        input_path = next(tmp_path.glob("*.input.jsonl"))
+        output_path = tmp_path / input_path.name.replace(".input.", ".output.")
+        entries = [json.loads(line) for line in input_path.read_text().splitlines()]
+        # Written next to the output and renamed, the poller must not see a partial file
+        tmp_path_output = tmp_path / "output.tmp"
+        tmp_path_output.write_text("".join(json.dumps({"custom_id": entry["custom_id"], "response": {"status_code": 200, "body": {
+            "choices": [{"message": {"content": echo(entry["body"])}}]}}}) + "\n" for entry in entries))
+        tmp_path_output.replace(output_path)
+    threading.Thread(target=answer).start()
+    results = run_programs(coordinator, [1])
+    assert results[0][0]["content"] == "gpt-4o:0.0"
+
+def test_failed_job_returns_errors(tmp_path):
+    class FailingBackend(LocalFileBatchBackend):
+        def submit(self, requests):
+            raise OSError("provider unavailable")
+    coordinator = BatchCoordinator(FailingBackend(str(tmp_path)), poll_interval=0.01)
+    results = run_programs(coordinator, [1, 1])
+    assert all(result[0] == {"error": "provider unavailable"} for result in results.values())
+
+def test_run_batched_bounds_builds_by_num_workers(tmp_path):
+    backend = RecordingBackend(str(tmp_path), echo)
+    coordinator = BatchCoordinator(backend, poll_interval=0.01)
+    lock = threading.Lock()
+    building = [0, 0]  # current, peak
+
+    def worker(program):
+        for round in range(2):
+            with get_build_slot():
+                with lock:
+                    building[0] += 1
+                    building[1] = max(building)
+                time.sleep(0.02)
+                with lock:
+                    building[0] -= 1
+            coordinator.request("gpt-4o", [{"role": "user", "content": f"{program}.{round}"}], Reply)
+        return program
+
+    results = ProgramScheduler(num_workers=2, reserved_core=None).run_batched(worker, ["a", "b", "c", "d", "e"], coordinator)
+    assert results == {program: program for program in "abcde"}
+    assert building[1] == 2
+    # Programs waiting for a build slot still make the round's request
+    assert backend.jobs == [5, 5]
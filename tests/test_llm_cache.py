@@ -0,0 +1,20 @@
+import os
+from llm_cache import LLMResponseCache
+
+def test_get_returns_stored_content(tmp_path):
+    cache = LLMResponseCache(str(tmp_path))
+    cache.put("key", "gpt-4o", "content")
+    assert cache.get("key") == "content"
+    assert cache.get("other") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_entry_evicted_during_get_is_a_miss(tmp_path, monkeypatch):
+    cache = LLMResponseCache(str(tmp_path))
+    cache.put("key", "gpt-4o", "content")
+    # Another worker evicts the entry between the read and the mtime refresh
+    def evicted(path, times):
+        os.remove(path)
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get("key") is None
+    assert (cache.hits, cache.misses) == (0, 1)
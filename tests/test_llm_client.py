@@ -0,0 +1,44 @@
+import time
+import pytest
+from pydantic import BaseModel
+from llm_client import RetryPolicy, LLMRequestError, call_with_retries
+
+class Reply(BaseModel):
+    analysis: str
+    feedback: str
+
+def counting_request(client, attempts):
+    # One attempt the way LLMAgent._request makes it
+    def request():
+        attempts.append(time.monotonic())
+        raw_response = client.beta.chat.completions.with_raw_response.parse(
+            model="gpt-4o", messages=[{"role": "user", "content": "optimize"}], response_format=Reply)
+        response = raw_response.parse()
+        return response, response.choices[0].message.content, raw_response.headers
+    return request
+
+def test_retries_injected_rate_limit_after_retry_after(fake_server):
+    client = fake_server("--fail_every", "2", "--fail_status", "429", "--retry_after", "0.2")
+    policy = RetryPolicy(max_retries=2, timeout=10)
+    first, second = [], []
+    response, content = call_with_retries(counting_request(client, first), policy, 100)
+    assert len(first) == 1 and Reply.model_validate_json(content).feedback == "fake feedback"
+    # The second request is the injected failure, its retry is the third
+    response, content = call_with_retries(counting_request(client, second), policy, 100)
+    assert len(second) == 2
+    assert second[1] - second[0] >= 0.2
+    assert response.usage.total_tokens > 0
+
+def test_gives_up_after_max_retries(fake_server):
+    client = fake_server("--fail_every", "1", "--fail_status", "500")
+    attempts = []
+    with pytest.raises(LLMRequestError):
+        call_with_retries(counting_request(client, attempts), RetryPolicy(max_retries=2, timeout=10, base_delay=0.01), 100)
+    assert len(attempts) == 3
+
+def test_does_not_retry_client_errors(fake_server):
+    client = fake_server("--fail_every", "1", "--fail_status", "400")
+    attempts = []
+    with pytest.raises(LLMRequestError):
+        call_with_retries(counting_request(client, attempts), RetryPolicy(max_retries=2, timeout=10, base_delay=0.01), 100)
+    assert len(attempts) == 1
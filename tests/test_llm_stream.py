@@ -0,0 +1,46 @@
+import json
+import pytest
+from llm_stream import IncrementalJSONParser, StreamCollector
+
+DOCUMENTS = [
+    '{"final_code": "int main() { return 0; }"}',
+    '{"analysis": "loops \\"hot\\" path\\n{[", "count": 12, "ratio": -1.5e3, "ok": true, "bad": false, "none": null}',
+    '{ "strategies" : [ {"Strategy": "unroll", "Pros": "fast]", "Cons": ""}, {"Strategy": "}"} ] , "selected_strategy": "unroll" }',
+    '{"nested": {"a": [1, 2, {"b": "c"}], "d": {}}, "empty": [], "unicode": "\\u00e9t\\u00e9 \\\\ done"}',
+    '{\n  "analysis": "x",\n  "final_code": "#include <cstdio>\\nint main() {\\n  printf(\\"%d\\\\n\\", 1);\\n}"\n}',
+]
+
+def parse_in_chunks(document, size):
+    parser = IncrementalJSONParser()
+    fields = []
+    for start in range(0, len(document), size):
+        fields.extend(parser.feed(document[start:start + size]))
+    return fields
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 4096])
+def test_fields_match_json_loads(document, size):
+    fields = parse_in_chunks(document, size)
+    expected = json.loads(document)
+    assert [key for key, value in fields] == list(expected)
+    assert dict(fields) == expected
+
+def test_string_field_is_reported_before_the_object_ends():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"final_code": "int main() {}", "analysis": "still str') == [("final_code", "int main() {}")]
+    assert parser.feed('eaming"}') == [("analysis", "still streaming")]
+
+def test_number_is_reported_once_it_is_delimited():
+    parser = IncrementalJSONParser()
+    # 12 could still become 123
+    assert parser.feed('{"count": 12') == []
+    assert parser.feed('3, "x": 1}') == [("count", 123), ("x", 1)]
+
+def test_collector_calls_on_field_and_keeps_the_reply():
+    fields = []
+    collector = StreamCollector(lambda key, value: fields.append((key, value)))
+    for piece in ['{"feedback": "go', 'od", "final_', 'code": ""}']:
+        collector.add(piece)
+    assert collector.finish() == '{"feedback": "good", "final_code": ""}'
+    assert fields == [("feedback", "good"), ("final_code", "")]
+    assert collector.metrics(completion_tokens=10)["time_to_first_token"] >= 0
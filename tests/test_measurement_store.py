@@ -0,0 +1,56 @@
+import math
+import statistics
+import numpy as np
+import pytest
+from measurement_store import MeasurementStore, aggregate, make_records, t_quantile
+from measurement_stats import AdaptiveSampler
+
+def _records(program_id, energies, runtimes):
+    return make_records(program_id, [{"package": energy, "dram": energy / 10, "runtime": runtime} for energy, runtime in zip(energies, runtimes)])
+
+def test_aggregate_matches_statistics():
+    energies = [1.5, 2.0, 2.5, 1.75, 2.25]
+    runtimes = [100.0, 110.0, 90.0, 105.0]
+    records = np.concatenate((_records("a", energies, [100.0] * 5), _records("b", [3.0] * 4, runtimes)))
+    stats = aggregate(records)
+    assert set(stats) == {"a", "b"}
+
+    energy = stats["a"]["energy"]
+    assert stats["a"]["trials"] == 5
+    assert energy["mean"] == pytest.approx(statistics.fmean(energies))
+    assert energy["median"] == pytest.approx(statistics.median(energies))
+    assert energy["stddev"] == pytest.approx(statistics.stdev(energies))
+    half_width = t_quantile(4) * statistics.stdev(energies) / math.sqrt(5)
+    assert energy["ci_high"] == pytest.approx(energy["mean"] + half_width)
+    assert stats["b"]["runtime"]["median"] == pytest.approx(statistics.median(runtimes))
+    assert set(stats["a"]["domains"]) == {"package", "dram"}
+
+def test_aggregate_without_grouping():
+    records = _records("a", [1.0, -1.0, 3.0], [10.0, 10.0, 30.0])
+    stats = aggregate(records, by=None)
+    # The negative reading is a failed trial
+    assert stats["trials"] == 2
+    assert stats["energy"]["mean"] == pytest.approx(2.0)
+    assert stats["runtime"]["median"] == pytest.approx(20.0)
+
+    empty = aggregate(records[:0], by=None)
+    assert empty["trials"] == 0
+    assert math.isnan(empty["energy"]["mean"])
+    assert empty["energy"]["rel_ci_width"] == math.inf
+
+def test_adaptive_sampler_stops_when_converged():
+    sampler = AdaptiveSampler(target_rel_ci=0.05, min_trials=3, max_trials=30, warmup=1)
+    batches = []
+    def sample_batch():
+        batches.append(1)
+        return _records("a", [2.0, 2.01], [100.0, 100.5])
+    records = sampler.run(sample_batch)
+    assert len(records) == 4
+    assert len(batches) == 3
+
+def test_store_load_reads_appended_records(tmp_path):
+    store = MeasurementStore(str(tmp_path / "measurements.bin"))
+    store.append(_records("a", [1.0, 2.0], [10.0, 20.0]))
+    store.append(_records("b", [3.0], [30.0]))
+    assert len(store.load()) == 3
+    assert aggregate(store.load("a"), by=None)["energy"]["mean"] == pytest.approx(1.5)
@@ -0,0 +1,38 @@
+import sys
+import pytest
+from rapl_reader import PowercapBackend, FakeSysfs, FakeSysfsBackend, EnergyMeter
+
+def test_powercap_backend_maps_subzones_to_domains(tmp_path):
+    FakeSysfs(root=str(tmp_path))
+    backend = PowercapBackend(root=str(tmp_path))
+    assert set(backend.zones) == {"package", "core", "gpu", "dram"}
+    assert backend.max_energy["package"] == pytest.approx(2 ** 32 / 1e6)
+
+def test_powercap_backend_reads_joules(tmp_path):
+    fake_sysfs = FakeSysfs(root=str(tmp_path))
+    for zone in fake_sysfs.zones.values():
+        with open(f"{zone}/energy_uj", "w") as file:
+            file.write("2500000\n")
+    assert PowercapBackend(root=str(tmp_path)).read() == {"package": 2.5, "core": 2.5, "gpu": 2.5, "dram": 2.5}
+
+def test_powercap_backend_without_zone(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PowercapBackend(root=str(tmp_path))
+
+def test_energy_meter_measures_constant_power(tmp_path):
+    meter = EnergyMeter(FakeSysfsBackend(FakeSysfs(root=str(tmp_path))), trials=2)
+    samples = meter.measure([sys.executable, "-c", "import time; time.sleep(0.2)"])
+    assert len(samples) == 2
+    for sample in samples:
+        assert sample["returncode"] == 0
+        seconds = sample["runtime"] / 1000
+        assert sample["package"] == pytest.approx(30.0 * seconds, rel=0.05)
+        assert sample["dram"] == pytest.approx(3.0 * seconds, rel=0.05)
+
+def test_energy_meter_handles_counter_wraparound(tmp_path):
+    # The package counter wraps every 0.1s at 30 W
+    fake_sysfs = FakeSysfs(root=str(tmp_path), max_energy_range_uj=3 * 10 ** 6)
+    meter = EnergyMeter(FakeSysfsBackend(fake_sysfs))
+    before = {"package": 2.9}
+    after = {"package": 0.1}
+    assert meter._energy_delta(before, after)["package"] == pytest.approx(0.2)
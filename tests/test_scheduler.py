@@ -0,0 +1,14 @@
+from scheduler import ProgramScheduler
+
+def optimize(program):
+    if program == "broken":
+        raise RuntimeError("no such benchmark")
+    return program.upper()
+
+def test_sequential_run_records_failed_programs():
+    results = ProgramScheduler(num_workers=1, reserved_core=None).run(optimize, ["a", "broken", "b"])
+    assert results == {"a": "A", "broken": "Optimization failed: no such benchmark", "b": "B"}
+
+def test_pool_run_records_failed_programs():
+    results = ProgramScheduler(num_workers=2, reserved_core=None).run(optimize, ["a", "broken", "b"])
+    assert results == {"a": "A", "broken": "Optimization failed: no such benchmark", "b": "B"}